@@ -1,19 +1,32 @@
 import autogen
 import panel as pn
-import asyncio
 from tool.utils import get_openai_api_key
+from tool.llm_cache import get_llm_cache
+from tool.speaker import SpeakerStateMachine
+from tool.compaction import Compaction
+from tool.metrics import ChatMetrics
+from tool.events import get_bus, scope, track
+from tool.streaming import PanelSink, TokenStream, register_streaming
+from tool.executors import make_executor, output_summary
+from tool.engine import a_execute_code
+from tool.human import HumanInput
+from tool.loop import submit
+from autogen.io import IOStream
 
 get_openai_api_key()
 
 llm_config = {"model": "gpt-4-turbo"}
+# Agents stream their replies token by token; the manager (speaker selection) does not
+stream_llm_config = {**llm_config, "stream": True}
 
 # Define Agents
 user_proxy = autogen.ConversableAgent(
     name="Admin",
     system_message="Give the task, and send instructions to writer to refine the financial report.",
     code_execution_config=False,
-    llm_config=llm_config,
-    human_input_mode="Never",
+    llm_config=stream_llm_config,
+    # Asks the person in the chat (HumanInput below) every time it is its turn
+    human_input_mode="ALWAYS",
 )
 
 planner = autogen.ConversableAgent(
@@ -22,18 +35,18 @@ planner = autogen.ConversableAgent(
                    "All information should be retrievable via Python code. "
                    "After each step, check progress and instruct the next steps. Handle failures gracefully.",
     description="Determine information needed for task completion and manage progress after each step.",
-    llm_config=llm_config,
+    llm_config=stream_llm_config,
 )
 
 engineer = autogen.AssistantAgent(
     name="Engineer",
-    llm_config=llm_config,
+    llm_config=stream_llm_config,
     description="Write code based on the plan provided by the planner.",
 )
 
 writer = autogen.ConversableAgent(
     name="Writer",
-    llm_config=llm_config,
+    llm_config=stream_llm_config,
     system_message="Writer. Write financial report in markdown format (with relevant titles) "
                    "and put the content in a ```md``` code block. Refine based on Admin feedback.",
     description="Write a financial report and refine it based on Admin's feedback.",
@@ -45,10 +58,21 @@ executor = autogen.ConversableAgent(
     human_input_mode="NEVER",
     code_execution_config={
         "last_n_messages": 3,
-        "work_dir": "coding",
-        "use_docker": False,
+        "executor": make_executor(work_dir="coding"),
     },
 )
+# Code runs on a worker thread, not on the loop every session's chat runs on
+executor.register_reply([autogen.Agent, None], reply_func=a_execute_code, ignore_async_in_sync_chat=True)
+
+# Pick the next speaker by rule; the manager's LLM only decides what the rules leave open
+speaker_selection = SpeakerStateMachine({
+    # The task goes to the Planner; later Admin turns are open
+    "Admin": lambda turn: "Planner" if turn.previous is None else None,
+    "Planner": lambda turn: None if turn.executed() else "Engineer",
+    "Engineer": "Executor",
+    "Executor": lambda turn: "Engineer" if turn.failed else "Planner",
+    "Writer": "Admin",
+})
 
 # Define GroupChat
 groupchat = autogen.GroupChat(
@@ -63,6 +87,7 @@ groupchat = autogen.GroupChat(
         planner: [user_proxy, engineer, writer],
     },
     speaker_transitions_type="allowed",
+    speaker_selection_method=speaker_selection,
 )
 
 manager = autogen.GroupChatManager(
@@ -71,45 +96,66 @@ manager = autogen.GroupChatManager(
 
 avatar = {user_proxy.name: "👨‍💼", engineer.name: "👩‍💻", writer.name: "✍", planner.name: "🗓", executor.name: "🛠"}
 
-# Function to display messages in Panel UI
-def print_messages(recipient, messages, sender, config):
-    content = messages[-1]['content']
-    if 'name' in messages[-1]:
-        chat_interface.send(content, user=messages[-1]['name'], avatar=avatar[messages[-1]['name']], respond=False)
-    else:
-        chat_interface.send(content, user=recipient.name, avatar=avatar[recipient.name], respond=False)
-    return False, None
+# Messages, turns and tokens go to the event bus; PanelSink shows them in the chat
+track([user_proxy, engineer, writer, planner, executor])
+register_streaming([user_proxy, engineer, writer, planner, executor])
+
+# Keep each agent's prompt within a token budget (tool/compaction.py)
+compaction = Compaction(max_tokens=6000, budgets={"Writer": 12000})
+compaction.add_to_agents([user_proxy, engineer, writer, planner])
 
-# Register replies for all agents
-user_proxy.register_reply([autogen.Agent, None], reply_func=print_messages, config={"callback": None})
-engineer.register_reply([autogen.Agent, None], reply_func=print_messages, config={"callback": None})
-writer.register_reply([autogen.Agent, None], reply_func=print_messages, config={"callback": None})
-planner.register_reply([autogen.Agent, None], reply_func=print_messages, config={"callback": None})
-executor.register_reply([autogen.Agent, None], reply_func=print_messages, config={"callback": None})
+# Per-round latency, tokens and cost; the summary table updates after every round
+metrics = ChatMetrics("autogen_panel")
+metrics.track([user_proxy, engineer, writer, planner, executor])
+metrics_pane = pn.pane.Markdown("")
+metrics.subscribe(lambda record: setattr(metrics_pane, "object", metrics.summary_markdown()))
 
 # Panel UI setup
 pn.extension(design="material")
 
-initiate_chat_task_created = False
-
-async def delayed_initiate_chat(agent, recipient, message):
-    global initiate_chat_task_created
-    initiate_chat_task_created = True
-    await asyncio.sleep(2)
-    await agent.a_initiate_chat(recipient, message=message)
+chat_interface = pn.chat.ChatInterface()
+chat_interface.send("Send a message!", user="System", respond=False)
+ttft_pane = pn.pane.Markdown("")
+
+# This session's events, rendered on a worker thread while the agents carry on
+sink = PanelSink(chat_interface, avatar, ttft_pane=ttft_pane, metrics=metrics)
+subscription = sink.subscribe()
+# What the person types while the Admin is asking for input goes to the Admin
+human = HumanInput(on_prompt=sink.prompt)
+human.attach([user_proxy])
+running = None  # concurrent Future of the chat in progress
+
+async def run_chat(message):
+    compaction.reset()
+    metrics.new_run()
+    with scope(sink), IOStream.set_default(TokenStream()):
+        await user_proxy.a_initiate_chat(manager, message=message, cache=get_llm_cache())
+    await get_bus().drain(sink)
+    print(speaker_selection.summary())
+    print(compaction.summary())
+    if output_summary(executor.code_executor):
+        print(output_summary(executor.code_executor))
+    metrics.flush()
+
+def start_chat(message):
+    global running
+    # On the shared loop (tool/loop.py), so a chat waiting on its person holds no thread
+    running = submit(run_chat(message))
+
+def callback(contents: str, user: str, instance: pn.chat.ChatInterface):
+    if running is None or running.done():
+        start_chat(contents)
+    else:
+        human.reply(contents)
 
-async def callback(contents: str, user: str, instance: pn.chat.ChatInterface):
-    global initiate_chat_task_created
-    global input_future
+chat_interface.callback = callback
 
-    if not initiate_chat_task_created:
-        asyncio.create_task(delayed_initiate_chat(user_proxy, manager, contents))
-    else:
-        if input_future and not input_future.done():
-            input_future.set_result(contents)
+def session_destroyed(session_context):
+    # A chat still waiting on this person ends ("exit") instead of waiting forever
+    human.close()
+    get_bus().unsubscribe(subscription)
 
-chat_interface = pn.chat.ChatInterface(callback=callback)
-chat_interface.send("Send a message!", user="System", respond=False)
+pn.state.on_session_destroyed(session_destroyed)
 
 # Panel input for task and submit button
 task_input = pn.widgets.TextInput(name="Enter your task", placeholder="E.g., Write a financial report about Nvidia's stock price performance.")
@@ -120,7 +166,7 @@ def submit_task(event):
     task = task_input.value
     if task:
         chat_interface.send(f"Task: {task}", user="System", respond=False)
-        asyncio.create_task(delayed_initiate_chat(user_proxy, manager, task))
+        callback(task, "User", chat_interface)
 
 submit_button.on_click(submit_task)
 
@@ -128,6 +174,8 @@ submit_button.on_click(submit_task)
 app_layout = pn.Column(
     task_input,
     submit_button,
+    ttft_pane,
+    metrics_pane,
     chat_interface,
 )
 
@@ -1,9 +1,16 @@
 import streamlit as st
+import time
 import yfinance as yf
-import matplotlib.pyplot as plt
 import autogen
-from tool.utils import get_openai_api_key
-from autogen.coding import LocalCommandLineCodeExecutor
+from tool.utils import get_openai_api_key, add_repo_to_pythonpath
+from tool.llm_cache import get_llm_cache
+from tool.speaker import SpeakerStateMachine
+from tool.compaction import Compaction
+from tool.metrics import ChatMetrics
+from tool.executors import make_executor, output_summary
+from tool.analytics import executor_functions
+from tool.events import track
+from tool.prefetch import get_prefetcher
 
 # Set up the OpenAI API key
 get_openai_api_key()
@@ -21,26 +28,20 @@ avatars = {
 
 # Custom stock data retrieval and plotting functions
 def get_stock_prices(stock_symbols, start_date, end_date):
-    stock_data = yf.download(stock_symbols, start=start_date, end=end_date)
-    return stock_data.get("Close")
+    # Served from the local store; only date ranges we don't have yet are downloaded
+    from tool.market_data import default_store
+    return default_store().get_close(stock_symbols, start_date, end_date)
 
 def plot_stock_prices(stock_prices, filename):
-    plt.figure(figsize=(10, 5))
-    for column in stock_prices.columns:
-        plt.plot(stock_prices.index, stock_prices[column], label=column)
-    plt.title("Stock Prices")
-    plt.xlabel("Date")
-    plt.ylabel("Price")
-    plt.grid(True)
-    plt.legend()
-    plt.savefig(filename)
-    plt.close()
-
-# Define Executor with provided functions
-executor_func = LocalCommandLineCodeExecutor(
+    from tool.charts import plot_stock_prices as render
+    return render(stock_prices, filename)
+
+# Define Executor with provided functions: data, charts and the analytics library (tool/analytics.py)
+add_repo_to_pythonpath()
+executor_func = make_executor(
     timeout=60,
     work_dir="coding",
-    functions=[get_stock_prices, plot_stock_prices],
+    functions=[get_stock_prices, plot_stock_prices] + executor_functions(),
 )
 
 executor = autogen.ConversableAgent(
@@ -68,7 +69,10 @@ engineer = autogen.AssistantAgent(
     name="Engineer",
     system_message=(
         "Write code based on the Planner's instructions. Communicate with the Executor to run the code. "
-        "Never run code, only write code and pass it to the executor to run."
+        "Never run code, only write code and pass it to the executor to run. "
+        "Use the functions below for returns, rolling statistics, volatility, drawdowns, beta, Sharpe ratios, "
+        "correlations and resampling instead of writing them yourself.\n"
+        + executor_func.format_functions_for_prompt()
     ),
     description="Write and iterate code for stock price retrieval and analysis based on Planner's instructions.",
     llm_config=llm_config,
@@ -93,6 +97,16 @@ user_proxy = autogen.ConversableAgent(
     human_input_mode="ALWAYS",
 )
 
+# Pick the next speaker by rule; the manager's LLM only decides what the rules leave open
+speaker_selection = SpeakerStateMachine({
+    "Admin": "Planner",
+    # Code first; once it runs, the Planner may add steps or hand over to the Writer
+    "Planner": lambda turn: None if turn.executed() else "Engineer",
+    "Engineer": "Executor",
+    "Executor": "Planner",
+    "Writer": "Admin",
+})
+
 # Group Chat for Agents
 groupchat = autogen.GroupChat(
     agents=[user_proxy, engineer, writer, executor, planner],
@@ -106,6 +120,7 @@ groupchat = autogen.GroupChat(
         writer: [user_proxy, planner],
     },
     speaker_transitions_type="allowed",
+    speaker_selection_method=speaker_selection,
 )
 
 manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=llm_config)
@@ -121,7 +136,9 @@ def print_messages(recipient, messages, sender, config):
     content = messages[-1]['content']
     user_name = messages[-1].get('name', sender.name)
     user_avatar = avatars.get(user_name, "")
+    started = time.perf_counter()
     st.write(f"{user_avatar} **{user_name}:** {content}")
+    metrics.record_render(user_name, time.perf_counter() - started)
     return False, None
 
 # Register reply functions to capture and display messages with avatars
@@ -131,15 +148,45 @@ planner.register_reply([autogen.Agent, None], reply_func=print_messages, config=
 executor.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
 writer.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
 
+# Keep each agent's prompt within a token budget (tool/compaction.py)
+compaction = Compaction(max_tokens=6000, budgets={"Writer": 12000})
+compaction.add_to_agents([engineer, planner, writer])
+
+# Per-round latency, tokens and cost (tool/metrics.py)
+metrics = ChatMetrics("autogen_st")
+metrics.track([user_proxy, engineer, planner, executor, writer])
+
+# Warm the local market-data store with the tickers the Admin and Planner name,
+# while the Engineer is still writing the code that asks for them
+track([user_proxy, planner])
+
+# Subscribed once per process, not on every rerun
+@st.cache_resource
+def start_prefetcher():
+    prefetcher = get_prefetcher()
+    prefetcher.subscribe()
+    return prefetcher
+
+prefetcher = start_prefetcher()
+
 # Function to initiate the workflow
 if st.button("Submit Task"):
     if task_input:
         st.write(f"**Task:** {task_input}")
+        compaction.reset()
+        metrics.new_run()
         # Start the chat between Admin and Planner
         groupchat_result = user_proxy.initiate_chat(
-            manager, message=f"Admin initiated the task: {task_input}"
+            manager, message=f"Admin initiated the task: {task_input}", cache=get_llm_cache()
         )
         st.write(f"**Chat Manager Result:** {groupchat_result}")
+        st.caption(speaker_selection.summary())
+        st.caption(compaction.summary())
+        st.caption(prefetcher.summary())
+        if output_summary(executor_func):
+            st.caption(output_summary(executor_func))
+        metrics.flush()
+        st.table(metrics.summary_rows())
 
 # Placeholder for results
 st.write("### Results")
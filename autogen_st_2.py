@@ -1,32 +1,31 @@
 import streamlit as st
 import yfinance as yf
-import matplotlib.pyplot as plt
+import time
 import autogen
-import asyncio
 from tool.utils import get_openai_api_key
-from autogen.coding import LocalCommandLineCodeExecutor
+from tool.loop import start_run
+from tool.events import MESSAGE, get_bus, track
+from tool.llm_cache import get_llm_cache
+from tool.speaker import END, SpeakerStateMachine
+from tool.compaction import Compaction
+from tool.metrics import ChatMetrics
+from tool.transcript import Transcript
+from tool.executors import make_executor, output_summary
 from autogen import AssistantAgent, UserProxyAgent, ConversableAgent
 
-# Custom trackable classes to display messages in Streamlit chat
-class TrackableAssistantAgent(AssistantAgent):
-    def _process_received_message(self, message, sender, silent):
-        with st.chat_message(sender.name):
-            st.markdown(message)
-        return super()._process_received_message(message, sender, silent)
+# Agents publish what they send to the event bus (tool/events.py); the run
+# collects it for the UI. This subscriber picks out the Admin's prompts.
+def watch_admin_prompt(event):
+    run = event.run
+    if event.name == "Admin" and event.content and "Provide feedback" in event.content and hasattr(run, "state"):
+        run.state["admin_prompt"] = event.content  # Store Admin's prompt for display in the UI
 
+# Subscribed once per process, not on every rerun
+@st.cache_resource
+def watch_admin_prompts():
+    return get_bus().subscribe(watch_admin_prompt, kinds=(MESSAGE,), name="admin prompt")
 
-class TrackableUserProxyAgent(UserProxyAgent):
-    def _process_received_message(self, message, sender, silent):
-        with st.chat_message(sender.name):
-            st.markdown(message)
-        return super()._process_received_message(message, sender, silent)
-
-
-class TrackableConversableAgent(ConversableAgent):
-    def _process_received_message(self, message, sender, silent):
-        with st.chat_message(sender.name):
-            st.markdown(message)
-        return super()._process_received_message(message, sender, silent)
+watch_admin_prompts()
 
 # Set up the OpenAI API key
 get_openai_api_key()
@@ -45,28 +44,21 @@ avatars = {
 
 # Custom stock data retrieval and plotting functions
 def get_stock_prices(stock_symbols, start_date, end_date):
-    stock_data = yf.download(stock_symbols, start=start_date, end=end_date)
-    return stock_data.get("Close")
+    # Served from the local store; only date ranges we don't have yet are downloaded
+    from tool.market_data import default_store
+    return default_store().get_close(stock_symbols, start_date, end_date)
 
 def plot_stock_prices(stock_prices, filename):
-    plt.figure(figsize=(10, 5))
-    for column in stock_prices.columns:
-        plt.plot(stock_prices.index, stock_prices[column], label=column)
-    plt.title("Stock Prices")
-    plt.xlabel("Date")
-    plt.ylabel("Price")
-    plt.grid(True)
-    plt.legend()
-    plt.savefig(filename)
-    plt.close()
+    from tool.charts import plot_stock_prices as render
+    return render(stock_prices, filename)
 
 # Define Executor with provided functions
-executor_func = LocalCommandLineCodeExecutor(
+executor_func = make_executor(
     timeout=120,
     work_dir="coding",
 )
 
-executor = TrackableUserProxyAgent(
+executor = UserProxyAgent(
     name="Executor",
     description="Execute the code written by the Engineer and report the result. Execute multiple steps if provided."
                 "When you have fully completed the execution of code successfully, give the results and information to the writer."
@@ -76,7 +68,7 @@ executor = TrackableUserProxyAgent(
 )
 
 # Planner with enhanced multi-step handling
-planner = TrackableConversableAgent(
+planner = ConversableAgent(
     name="Planner",
     system_message=(
         "You are responsible for planning the task. Break it down into steps and coordinate with Engineer for code."
@@ -87,7 +79,7 @@ planner = TrackableConversableAgent(
 )
 
 # Engineer to write code based on Planner instructions
-engineer = TrackableAssistantAgent(
+engineer = AssistantAgent(
     name="Engineer",
     system_message=(
         "Write python code based on the Planner's instructions. Communicate with the Executor to run the code. "
@@ -98,7 +90,7 @@ engineer = TrackableAssistantAgent(
 )
 
 # Writer Agent
-writer = TrackableConversableAgent(
+writer = ConversableAgent(
     name="Writer",
     system_message="Write the final report after analysis. Refine based on feedback."
                    "When you have written your final report save it in the current directory as a markdown file."
@@ -108,44 +100,29 @@ writer = TrackableConversableAgent(
 )
 
 # Define Admin Agent (user_proxy)
-user_proxy = TrackableUserProxyAgent(
+user_proxy = UserProxyAgent(
     name="Admin",
     system_message="A human admin. Interact with the planner to discuss the plan. Plan execution needs to be approved by this admin.",
     code_execution_config=False,
 )
 
-# # managing workflow for agents
-# def state_transition(last_speaker, groupchat):
-#     messages = groupchat.messages
-
-#     if last_speaker is user_proxy:
-#         # init -> retrieve
-#         return planner
-#     elif last_speaker is planner:
-#         # retrieve: action 1 -> action 2
-#         return engineer
-#     elif last_speaker is engineer:
-#         # retrieve: action 1 -> action 2
-#         return executor
-#     elif last_speaker is executor:
-#         if messages[-1]["content"] == "exitcode: 1":
-#             # retrieve --(execution failed)--> retrieve
-#             return engineer
-#         elif 'possibly delisted' or 'no price data found' in messages[-1]["content"]:
-#               return engineer
-
-#         else:
-#             # retrieve --(execution success)--> writer
-#             return writer
-#     elif last_speaker == "writer":
-#         # research -> end
-#         return None
+# Workflow from agent_workflow.txt: the rules pick the next speaker, so the
+# manager's LLM is only asked when a rule leaves the choice open
+speaker_selection = SpeakerStateMachine({
+    "Admin": "Planner",
+    "Planner": "Engineer",
+    "Engineer": "Executor",
+    # Failed runs and missing price data go back to the Engineer
+    "Executor": lambda turn: "Engineer" if turn.failed else "Writer",
+    "Writer": END,
+})
 
 # Group Chat for Agents
 groupchat = autogen.GroupChat(
     agents=[user_proxy, engineer, writer, executor, planner],
     messages=[],
-    max_round=50
+    max_round=50,
+    speaker_selection_method=speaker_selection,
 )
 
 manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=llm_config)
@@ -171,44 +148,64 @@ if "admin_waiting" not in st.session_state:
     st.session_state["admin_waiting"] = False
     st.session_state["admin_prompt"] = ""  # To store admin's prompt
 
-# Function to display messages in Streamlit with avatars
-def print_messages(recipient, messages, sender, config):
-    content = messages[-1]['content']
-    user_name = messages[-1].get('name', sender.name)
+# Where each message goes in the transcript, and its heading (tool/transcript.py draws the content)
+def message_container(message):
+    user_name = message["name"]
     user_avatar = avatars.get(user_name, "")
-    
     # Alternating messages between left and right based on the agent
-    if user_name in ["Admin", "Planner"]:
-        st.chat_message("assistant").write(f"{user_avatar} **{user_name}:** {content}")
-    else:
-        st.chat_message("user").write(f"{user_avatar} **{user_name}:** {content}")
+    role = "assistant" if user_name in ["Admin", "Planner"] else "user"
+    return st.chat_message(role), f"{user_avatar} **{user_name}:**"
 
-    # Handle Admin waiting for user input
-    if user_name == "Admin" and "Provide feedback" in content:
-        st.session_state["admin_waiting"] = True
-        st.session_state["admin_prompt"] = content  # Store Admin's prompt for display in the UI
+# Keep each agent's prompt within a token budget (tool/compaction.py)
+compaction = Compaction(max_tokens=6000, budgets={"Writer": 12000})
+compaction.add_to_agents([engineer, planner, writer])
 
-    return False, None
+# Per-round latency, tokens and cost (tool/metrics.py)
+metrics = ChatMetrics("autogen_st_2")
+metrics.track([user_proxy, engineer, planner, executor, writer])
 
-# Register reply functions to capture and display messages with avatars
-engineer.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
-planner.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
-executor.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
-writer.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
+# Messages, turns and code runs go to the event bus; the run collects them for the UI
+track([user_proxy, engineer, planner, executor, writer])
 
 # Function to initiate the workflow asynchronously
 async def initiate_chat(task_input):
-    await user_proxy.a_initiate_chat(manager, message=f"Admin initiated the task: {task_input}")
+    compaction.reset()
+    metrics.new_run()
+    await user_proxy.a_initiate_chat(manager, message=f"Admin initiated the task: {task_input}", cache=get_llm_cache())
+    metrics.flush()
 
 # Get user task input
 task_input = st.chat_input("Enter your task (e.g., Retrieve stock prices for analysis)", key="task_input_key")  # Unique key provided
 if task_input:
-    st.write(f"**Task:** {task_input}")
-
-    # Create an event loop and run the chat initiation
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(initiate_chat(task_input))
+    # Run the chat on the background loop instead of blocking this script
+    st.session_state["run"] = start_run(initiate_chat(task_input), task=task_input)
+
+run = st.session_state.get("run")
+if run is not None:
+    if run.task:
+        st.write(f"**Task:** {run.task}")
+    if run.status == "queued":
+        # Waiting for a free slot (see Admission in tool/loop.py)
+        st.info(f"Many chats are running right now. Yours starts soon: position {run.position} in the queue.")
+    # Only new messages are parsed, and only the latest ones (plus a page on request) are drawn
+    Transcript.of(run).render(message_container, on_rendered=metrics.record_render)
+    if not run.running:
+        st.caption(speaker_selection.summary())
+        st.caption(compaction.summary())
+        if output_summary(executor_func):
+            st.caption(output_summary(executor_func))
+    if metrics.rounds:
+        with st.expander("Run metrics"):
+            st.table(metrics.summary_rows())
+    if run.status == "rejected":
+        st.warning(str(run.error))
+    elif run.error is not None:
+        st.error(f"Chat failed: {run.error}")
+
+    admin_prompt = run.state.pop("admin_prompt", None)
+    if admin_prompt is not None:
+        st.session_state["admin_waiting"] = True
+        st.session_state["admin_prompt"] = admin_prompt
 
 # Admin feedback input when waiting for user input
 if st.session_state["admin_waiting"]:
@@ -217,11 +214,17 @@ if st.session_state["admin_waiting"]:
 
     if admin_feedback:
         # Send Admin feedback to the backend
-        groupchat_result = user_proxy.initiate_chat(
-            manager, message=f"{admin_feedback}"
-        )
+        # clear_history=False: the feedback continues the conversation instead of restarting it
+        st.session_state["run"] = start_run(user_proxy.a_initiate_chat(manager, message=f"{admin_feedback}", clear_history=False,
+                                                                       cache=get_llm_cache()))
         st.write(f"**Admin Response Sent:** {admin_feedback}")
         st.session_state["admin_waiting"] = False
 
 # Placeholder for results
 st.write("### Results")
+
+# Poll for new messages while the agents are working
+run = st.session_state.get("run")
+if run is not None and run.running:
+    time.sleep(0.5)
+    st.rerun()
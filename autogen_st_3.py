@@ -1,38 +1,22 @@
 import streamlit as st
 import yfinance as yf
 import matplotlib.pyplot as plt
-import autogen
-import asyncio
-from tool.utils import get_openai_api_key, get_agentops_api_key
-from autogen.coding import LocalCommandLineCodeExecutor
-from autogen import AssistantAgent, UserProxyAgent, ConversableAgent
-
-# Custom trackable classes to display messages in Streamlit chat
-class TrackableAssistantAgent(AssistantAgent):
-    def _process_received_message(self, message, sender, silent):
-        with st.chat_message(sender.name):
-            st.markdown(message)
-        return super()._process_received_message(message, sender, silent)
-
-
-class TrackableUserProxyAgent(UserProxyAgent):
-    def _process_received_message(self, message, sender, silent):
-        with st.chat_message(sender.name):
-            st.markdown(message)
-        return super()._process_received_message(message, sender, silent)
-
-
-class TrackableConversableAgent(ConversableAgent):
-    def _process_received_message(self, message, sender, silent):
-        with st.chat_message(sender.name):
-            st.markdown(message)
-        return super()._process_received_message(message, sender, silent)
-
-# Set up the OpenAI API key
-get_openai_api_key()
+import os
+import time
+from tool.jobs import JobRun, get_job_store
+from tool.loop import start_run
+from tool.transcript import Transcript
 
 llm_config = {"model": "gpt-4o-mini","temperature": 0, "seed": 1234}
 
+# With JOB_QUEUE set, chats run on the job workers (python -m tool.jobs work)
+# and this script only submits tasks and renders what the jobs post
+use_jobs = bool(os.environ.get("JOB_QUEUE"))
+if not use_jobs:
+    from report_team import build_engine, summaries
+    from tool.engine import session_work_dir
+    from tool.streaming import token_stream
+
 # Avatars for each agent (using emojis)
 avatars = {
     "Planner": "🗓",
@@ -41,136 +25,14 @@ avatars = {
     "Writer": "✍"
 }
 
-# config_list_gpt4 = autogen.config_list_from_json(
-#     llm_config,
-#     filter_dict={
-#         "model": ["gpt-4-32k", "gpt-4-32k-0314", "gpt-4-32k-v0314"],
-#     },
-# )
-
-
-# gpt4_config = {
-#     "cache_seed": 42,  # change the cache_seed for different trials
-#     "temperature": 0,
-#     "config_list": config_list_gpt4,
-#     "timeout": 120,
-# }
-
-def is_termination_msg(content) -> bool:
-    have_content = content.get("content", None) is not None
-    if have_content and "TERMINATE" in content["content"]:
-        return True
-    return False
-
-user_proxy = TrackableUserProxyAgent(
-    name="Admin",
-    system_message="Admin."
-    "Give the task, and send "
-    "instructions to writer to refine the financial report.",
-    human_input_mode="NEVER",
-    code_execution_config=False,
-    is_termination_msg=is_termination_msg,
-)
-
-planner = TrackableConversableAgent(
-    name="Planner",
-    system_message="Planner."
-    "Given a task, please determine "
-    "what information is needed to complete the task. "
-    "Please note that the information will all be retrieved using"
-    " Python code. Please only suggest information that can be "
-    "retrieved using Python code. "
-    "After each step is done by others, check the progress and "
-    "instruct the remaining steps. If a step fails, try to "
-    "workaround",
-    llm_config=llm_config,
-    description="Planner. Given a task, determine what "
-    "information is needed to complete the task. "
-    "After each step is done by others, check the progress and "
-    "instruct the remaining steps"
-    ""
-)
-
-critic = TrackableConversableAgent(
-    name="Critic",
-    system_message="Critic. Double check plan, claims, code from other agents and provide feedback. Check whether the plan includes adding verifiable info such as source URL.",
-    llm_config=llm_config,
-    description="Critic."
-    "A Critic that prvides feedback for improvement for the planner and writer."
-    "Provide feedback for planner to improve overall plan."
-    "Provide feedback for writer to improve overall financial report."
-)
-
-engineer = TrackableAssistantAgent(
-    name="Engineer",
-    llm_config=llm_config,
-    code_execution_config=False,
-    system_message="""Engineer. You follow an approved plan. You write python/shell code to solve tasks. Wrap the code in a code block that specifies the script type. The user can't modify your code. So do not suggest incomplete code which requires others to modify. Don't use a code block if it's not intended to be executed by the executor.
-Don't include multiple code blocks in one response. Do not ask others to copy and paste the result. Check the execution result returned by the executor. Create graphs and plots.
-If the result indicates there is an error, fix the error and output the code again. Suggest the full code instead of partial code or code changes. If the error can't be fixed or if the task is not solved even after the code is executed successfully, analyze the problem, revisit your assumption, collect additional info you need, and think of a different approach to try.
-Include code for saving plots, tables, graphs and any meaningful results.
-Always pass code you write to executor.
-""",
-    description="Engineer."
-    "An engineer that writes code based on the plan "
-    "provided by the planner.",
-)
-
-executor = TrackableConversableAgent(
-    name="Executor",
-    system_message="""Executor. You are a helpful AI assistant.
-Solve tasks using your coding and language skills.
-In the following cases, suggest python code (in a python coding block) or shell script (in a sh coding block) for the user to execute.
-    1. When you need to collect info, use the code to output the info you need, for example, browse or search the web, download/read a file, print the content of a webpage or a file, get the current date/time, check the operating system. After sufficient info is printed and the task is ready to be solved based on your language skill, you can solve the task by yourself.
-    2. When you need to perform some task with code, use the code to perform the task and output the result. Finish the task smartly.
-Solve the task step by step if you need to. If a plan is not provided, explain your plan first. Be clear which step uses code, and which step uses your language skill.
-When using code, you must indicate the script type in the code block. The user cannot provide any other feedback or perform any other action beyond executing the code you suggest. The user can't modify your code. So do not suggest incomplete code which requires users to modify. Don't use a code block if it's not intended to be executed by the user.
-If you want the user to save the code in a file before executing it, put # filename: <filename> inside the code block as the first line. Don't include multiple code blocks in one response. Do not ask users to copy and paste the result. Instead, use 'print' function for the output when relevant. Check the execution result returned by the user.
-If the result indicates there is an error, fix the error and output the code again. Suggest the full code instead of partial code or code changes. If the error can't be fixed or if the task is not solved even after the code is executed successfully, analyze the problem, revisit your assumption, collect additional info you need, and think of a different approach to try.
-When you find an answer, verify the answer carefully. Include verifiable evidence in your response if possible.
-Reply "TERMINATE" in the end when everything is done.""",
-    human_input_mode="NEVER",
-    code_execution_config={
-        "last_n_messages": 3,
-        "work_dir": "coding",
-        "use_docker": False,
-    },
-)
-
-writer = TrackableConversableAgent(
-    name="Writer",
-    llm_config=llm_config,
-    system_message="Writer." 
-    "Please write a finanial report in markdown format (with relevant titles)"
-    " and put the content in pseudo ```md``` code block. "
-    "You take feedback from the admin and refine your financial report.",
-    description="Writer."
-    "Write financial report based on the code execution results and take "
-    "feedback from the admin to refine the financial report."
-)
-
-allowed_speaker_transitions_dict = {
-    user_proxy: [planner, critic, engineer, executor,writer],
-    planner: [user_proxy],
-    critic: [user_proxy],
-    engineer: [user_proxy],
-    executor: [user_proxy],
-    writer: [user_proxy],
-}
-
-groupchat = autogen.GroupChat(
-    agents=[user_proxy, engineer, writer, planner, executor, critic], messages=[], max_round=50,
-    allowed_or_disallowed_speaker_transitions=allowed_speaker_transitions_dict,
-    speaker_transitions_type="allowed",
-)
+# With MODEL_ROUTING=1 each agent's model comes from OAI_CONFIG_LIST by role
+# (a fast one for the Planner, Critic and speaker selection, a stronger one
+# for the Engineer and Writer), with failover between entries (tool/router.py)
 
-# Create the manager
-manager = autogen.GroupChatManager(
-    groupchat=groupchat,
-    llm_config=llm_config,
-    code_execution_config=False,
-    is_termination_msg=is_termination_msg,
-)
+# Build the agents, GroupChat and manager once per process (not on every rerun)
+@st.cache_resource
+def get_engine(model, temperature, seed):
+    return build_engine(model, temperature, seed)
 
 # Streamlit UI Setup
 st.title("Agent Conversation and Task Management")
@@ -193,59 +55,108 @@ if "admin_waiting" not in st.session_state:
     st.session_state["admin_waiting"] = False
     st.session_state["admin_prompt"] = ""  # To store admin's prompt
 
-# Function to display messages in Streamlit with avatars
-def print_messages(recipient, messages, sender, config):
-    content = messages[-1]['content']
-    user_name = messages[-1].get('name', sender.name)
+# Where each message goes in the transcript, and its heading (tool/transcript.py draws the content)
+def message_container(message):
+    user_name = message["name"]
     user_avatar = avatars.get(user_name, "")
-    
     # Alternating messages between left and right based on the agent
-    if user_name in ["Admin", "Planner"]:
-        st.chat_message("assistant").write(f"{user_avatar} **{user_name}:** {content}")
-    else:
-        st.chat_message("user").write(f"{user_avatar} **{user_name}:** {content}")
-
-    # Handle Admin waiting for user input
-    if user_name == "Admin" and "Provide feedback" in content:
-        st.session_state["admin_waiting"] = True
-        st.session_state["admin_prompt"] = content  # Store Admin's prompt for display in the UI
-
-    return False, None
-
-# Register reply functions to capture and display messages with avatars
-engineer.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
-planner.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
-executor.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
-critic.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
-writer.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
-user_proxy.register_reply([autogen.Agent, None], reply_func=print_messages, config=None)
+    role = "assistant" if user_name in ["Admin", "Planner"] else "user"
+    return st.chat_message(role), f"{user_avatar} **{user_name}:**"
+
+def render_partial(message):
+    with st.chat_message(message["name"]):
+        st.markdown(message["content"] + "▌")
+
+# Each browser session gets fresh conversation state on top of the shared engine
+chat = None
+if use_jobs:
+    # The job id is in the URL, so a browser refresh picks the run up again
+    if "run" not in st.session_state and "job" in st.query_params:
+        st.session_state["run"] = JobRun(get_job_store(), st.query_params["job"])
+else:
+    engine = get_engine(**llm_config)
+    if "chat" not in st.session_state:
+        # Code runs in a directory of this session's own, under coding/
+        st.session_state["chat"] = engine.new_session(work_dir=session_work_dir())
+    chat = st.session_state["chat"]
 
 # Function to initiate the workflow asynchronously
 async def initiate_chat(task_input):
-    await user_proxy.a_initiate_chat(manager, message=f"Admin initiated the task: {task_input}")
+    await chat.a_initiate_chat(message=f"Admin initiated the task: {task_input}")
 
 # Get user task input
-task_input = st.chat_input("Enter your task (e.g., Retrieve stock prices for analysis)", key="task_input_key")  # Unique key provided
-if task_input:
-    st.write(f"**Task:** {task_input}")
-
-    # Create an event loop and run the chat initiation
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(initiate_chat(task_input))
+# One chat per session at a time: a new task waits until the current run is done
+busy = st.session_state.get("run") is not None and st.session_state["run"].running
+task_input = st.chat_input("Enter your task (e.g., Retrieve stock prices for analysis)", key="task_input_key", disabled=busy)  # Unique key provided
+if task_input and busy:
+    st.info("The current chat is still running; send your task when it is done.")
+elif task_input and use_jobs:
+    job_id = get_job_store().submit(task_input, pipeline="report", config=llm_config,
+                                    message=f"Admin initiated the task: {task_input}")
+    st.query_params["job"] = job_id
+    st.session_state["run"] = JobRun(get_job_store(), job_id)
+elif task_input:
+    # Run the chat on the background loop instead of blocking this script
+    st.session_state["run"] = start_run(initiate_chat(task_input), task=task_input, context=token_stream)
+
+run = st.session_state.get("run")
+if run is not None:
+    if use_jobs:
+        run.refresh()
+    if run.task:
+        st.write(f"**Task:** {run.task}")
+    if run.status == "queued":
+        # Waiting for a free slot (see Admission in tool/loop.py)
+        st.info(f"Many chats are running right now. Yours starts soon: position {run.position} in the queue.")
+    # Only new messages are parsed, and only the latest ones (plus a page on request) are drawn
+    record_render = chat.metrics.record_render if chat is not None and chat.metrics is not None else None
+    Transcript.of(run).render(message_container, on_rendered=record_render)
+    # Message still being generated, shown token by token
+    if run.partial is not None:
+        render_partial(run.partial)
+    if run.ttft:
+        st.caption("Time to first token: " + ", ".join(
+            f"{name} {sum(values) / len(values):.2f}s" for name, values in list(run.ttft.items())))
+    if not run.running:
+        for line in run.summaries if use_jobs else summaries(chat):
+            st.caption(line)
+    metrics_rows = run.metrics_rows if use_jobs else (chat.metrics.summary_rows() if chat.metrics.rounds else [])
+    if metrics_rows:
+        with st.expander("Run metrics"):
+            st.table(metrics_rows)
+    if run.status == "rejected":
+        st.warning(str(run.error))
+    elif run.error is not None:
+        st.error(f"Chat failed: {run.error}")
+
+    admin_prompt = run.state.pop("admin_prompt", None)
+    if admin_prompt is not None:
+        st.session_state["admin_waiting"] = True
+        st.session_state["admin_prompt"] = admin_prompt
 
 # Admin feedback input when waiting for user input
 if st.session_state["admin_waiting"]:
     st.write(f"**Admin is requesting feedback:** {st.session_state['admin_prompt']}")  # Display Admin's prompt
-    admin_feedback = st.text_input("Admin is asking for feedback. Please provide your input:", key="admin_feedback_key")  # Unique key provided
+    feedback_busy = run is not None and run.running
+    admin_feedback = st.text_input("Admin is asking for feedback. Please provide your input:", key="admin_feedback_key",
+                                   disabled=feedback_busy)  # Unique key provided
 
-    if admin_feedback:
+    if admin_feedback and not feedback_busy:
         # Send Admin feedback to the backend
-        groupchat_result = user_proxy.initiate_chat(
-            manager, message=f"{admin_feedback}"
-        )
+        if use_jobs:
+            st.session_state["run"] = run = run.follow_up(f"{admin_feedback}")
+            st.query_params["job"] = run.id
+        else:
+            # Carry on the same conversation rather than starting a new one
+            st.session_state["run"] = start_run(chat.a_continue(message=f"{admin_feedback}"), context=token_stream)
         st.write(f"**Admin Response Sent:** {admin_feedback}")
         st.session_state["admin_waiting"] = False
 
 # Placeholder for results
 st.write("### Results")
+
+# Poll for new messages while the agents are working
+run = st.session_state.get("run")
+if run is not None and run.running:
+    time.sleep(0.1 if run.partial is not None else 0.5)
+    st.rerun()
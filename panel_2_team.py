@@ -0,0 +1,155 @@
+# The agents, transition graph and speaker rules of autogen_panel_2.py,
+# importable without Panel (for the benchmarks in tool/bench.py).
+#
+#     engine = build_engine(model="gpt-4-turbo")
+#     chat = engine.new_session()
+
+import autogen
+from tool.utils import get_openai_api_key, add_repo_to_pythonpath
+from tool.engine import AgentSpec, ChatEngine
+from tool.llm_cache import get_llm_cache
+from tool.speaker import SpeakerStateMachine
+from tool.compaction import Compaction
+from tool.metrics import ChatMetrics
+from tool.executors import make_executor
+from tool.analytics import executor_functions
+from tool.replay import get_recorder
+from tool.router import get_router
+
+# Avatars for each agent (using emojis)
+avatars = {
+    "Admin": "👨‍💼",
+    "Planner": "🗓",
+    "Engineer": "👩‍💻",
+    "Executor": "🛠",
+    "Writer": "✍",
+}
+
+# Custom stock data retrieval and plotting functions
+def get_stock_prices(stock_symbols, start_date, end_date):
+    """Get the stock prices for the given stock symbols between the start and end dates."""
+    # Served from the local store; only date ranges we don't have yet are downloaded
+    from tool.market_data import default_store
+    return default_store().get_close(stock_symbols, start_date, end_date)
+
+def plot_stock_prices(stock_prices, filename):
+    """Plot the stock prices for the given stock symbols."""
+    from tool.charts import plot_stock_prices as render
+    return render(stock_prices, filename)
+
+def build_engine(model="gpt-4-turbo", human_input_mode="ALWAYS"):
+    get_openai_api_key()
+    llm_config = {"model": model}
+
+    # Define Executor with provided functions: data, charts and the analytics library (tool/analytics.py)
+    add_repo_to_pythonpath()
+    code_executor = make_executor(
+        timeout=60,
+        work_dir="coding",
+        functions=[get_stock_prices, plot_stock_prices] + executor_functions(),
+    )
+    executor = AgentSpec(
+        autogen.ConversableAgent,
+        name="Executor",
+        description="Execute the code written by the Engineer and report the result. Execute multiple steps if provided."
+        "when you have fully completed the execution of code successfully give the results and information to the planner to prepare for the writer."
+        "save graph, visualisation plots and data in the current directory.",
+        human_input_mode="NEVER",
+        code_execution_config={
+            "last_n_messages": 5,
+            "executor": code_executor,
+        },
+    )
+
+    # Planner with enhanced multi-step handling
+    planner = AgentSpec(
+        autogen.ConversableAgent,
+        name="Planner",
+        system_message=(
+            "You are responsible for planning the task. Break it down into steps and coordinate with Engineer for code "
+            "and Executor for execution. If steps fail, guide the agents to retry."
+            "Never ask the engineer to run code, only provide plan for the engineer to write the code."
+            "code should only be executed by the executor."
+            "when sufficient information or data has been retrieved, send the results to writer with a plan for writing the report."
+            "overlook the report written by the writer, if feedback is needed then provide, if not TERMINATE session."
+        ),
+        description="Plan and delegate tasks in a step-by-step manner and ensure successful task completion.",
+        llm_config=llm_config,
+    )
+
+    # Engineer to write code based on Planner instructions
+    engineer = AgentSpec(
+        autogen.AssistantAgent,
+        name="Engineer",
+        system_message=(
+            "Write code based on the Planner's instructions. Communicate with the Executor to run the code. "
+            "If a task fails, modify the code and reattempt execution."
+            "never run code, only write code and pass it to the executor to run."
+            "when writing code dont include executable functions, let the executor run the functions."
+            "write a python runnable script which the executor can run"
+            "when creating python script save it in coding folder, do not run it."
+            "use the functions below for returns, rolling statistics, volatility, drawdowns, beta, Sharpe ratios, "
+            "correlations and resampling instead of writing them yourself.\n"
+            + code_executor.format_functions_for_prompt()
+        ),
+        description="Write and iterate code for stock price retrieval and analysis based on Planner's instructions.",
+        llm_config=llm_config,
+    )
+
+    # Writer Agent
+    writer = AgentSpec(
+        autogen.ConversableAgent,
+        name="Writer",
+        system_message="Write the final report after analysis. Refine based on feedback."
+        "when you have written your final report save it in current directory as a markdown file."
+        "present the information in a clean, professional, user-friendly and aesthetically pleasing presentation.",
+        description="Write and refine reports based on the results of the analysis.",
+        llm_config=llm_config,
+    )
+
+    # Define Admin Agent (user_proxy)
+    user_proxy = AgentSpec(
+        autogen.ConversableAgent,
+        name="Admin",
+        system_message="Oversee the workflow. Ensure Planner creates a step-by-step plan and delegates tasks correctly.",
+        code_execution_config=False,
+        llm_config=llm_config,
+        human_input_mode=human_input_mode,
+    )
+
+    allowed_speaker_transitions_dict = {
+        "Admin": ["Planner"],  # Admin delegates to Planner first
+        "Planner": ["Engineer", "Executor", "Writer"],  # Planner can delegate to Engineer, Executor, or Writer
+        "Engineer": ["Executor"],  # Engineer delegates execution to Executor
+        "Executor": ["Planner"],  # Executor reports back to Planner or sends results to Writer
+        "Writer": ["Admin", "Planner"],  # Writer can ask for feedback from Admin or Planner
+    }
+
+    # Pick the next speaker by rule; the manager's LLM only decides what the rules leave open
+    speaker_selection = SpeakerStateMachine({
+        "Admin": "Planner",
+        # Code first; once it runs, the Planner may add steps or hand over to the Writer
+        "Planner": lambda turn: None if turn.executed() else "Engineer",
+        "Engineer": "Executor",
+        "Executor": "Planner",
+        "Writer": "Admin",
+    })
+
+    # Agents stream their replies token by token; the manager (speaker selection) does not
+    return ChatEngine(
+        agents=[user_proxy, engineer, writer, executor, planner],
+        transitions=allowed_speaker_transitions_dict,
+        speaker_selection=speaker_selection,
+        # Keep each agent's prompt within a token budget (tool/compaction.py)
+        compaction=Compaction(max_tokens=6000, budgets={"Writer": 12000}),
+        # Per-round latency, tokens and cost; the summary table updates after every round
+        metrics=ChatMetrics("autogen_panel_2"),
+        max_round=50,
+        manager_config=llm_config,
+        stream=True,
+        cache=get_llm_cache(),
+        # RECORD_RUNS=1 records every run for offline replay (tool/replay.py)
+        recorder=get_recorder("panel_2_team:build_engine", {"model": model, "human_input_mode": human_input_mode}),
+        # MODEL_ROUTING=1 picks each role's model from OAI_CONFIG_LIST, with failover (tool/router.py)
+        router=get_router(),
+    )
@@ -1,32 +1,35 @@
 import streamlit as st
+import time
 import autogen
-import asyncio
 from tool.utils import get_openai_api_key
+from tool.engine import AgentSpec, ChatEngine, session_work_dir
+from tool.llm_cache import get_llm_cache
+from tool.speaker import SpeakerStateMachine, through
+from tool.compaction import Compaction
+from tool.metrics import ChatMetrics
+from tool.transcript import Transcript
+from tool.checkpoints import Checkpoints
+from tool.router import get_router
+from tool.loop import start_run
+from tool.streaming import token_stream
+from tool.executors import make_executor, output_summary
 from autogen import AssistantAgent, UserProxyAgent, ConversableAgent
 
-# Set up the OpenAI API key
-get_openai_api_key()
-
 # LLM Configuration
 llm_config = {"model": "gpt-4o-mini", "temperature": 0, "seed": 1234}
 
-# Callback function to display messages
-def display_callback(sender, recipient, message):
-    sender_name = message.get('name', 'Unknown')
-    content = message.get('content', '').strip().lower()
-    if sender_name == "Admin" or "initiated the task" in content:
-        return
-    avatar = avatars.get(sender_name, '👤')
-    with st.expander(f"{sender_name} (click to expand/collapse)", expanded=False):
-        st.markdown(f"**{sender_name}:** {content}")
-
-# General function for handling replies
-def print_messages(recipient, messages, sender, config):
-    if "callback" in config and config["callback"] is not None:
-        callback = config["callback"]
-        callback(sender, recipient, messages[-1])
-    print(f"Messages sent to: {recipient.name} | num messages: {len(messages)}")
-    return False, None
+# The expander and heading of a recorded message (tool/transcript.py draws the content)
+def message_container(message):
+    sender_name = message["name"]
+    # Skip system messages like task initiation
+    if sender_name == "Admin" or "initiated the task" in (message["content"] or "").lower():
+        return None
+    return st.expander(f"{sender_name} (click to expand/collapse)", expanded=False), f"**{sender_name}:**"
+
+def render_partial(message):
+    sender_name = message["name"]
+    with st.expander(f"{sender_name} (typing...)", expanded=True):
+        st.markdown(f"**{sender_name}:** {message['content']}▌")
 
 # Avatars for agents
 avatars = {
@@ -62,96 +65,161 @@ class TrackableConversableAgent(ConversableAgent):
     def process_last_received_message(self, content):
         return super().process_last_received_message(content)
 
-# Define agents
-user_proxy = TrackableUserProxyAgent(
-    name="Admin",
-    system_message="Admin. Give the task, and send instructions to writer to refine the financial report.",
-    human_input_mode="NEVER",
-    code_execution_config=False,
-    is_termination_msg=lambda content: "TERMINATE" in content,
-)
-
-planner = TrackableConversableAgent(
-    name="Planner",
-    system_message="Planner. Given a task, determine required information for Python code retrieval and instruct next steps.",
-    llm_config=llm_config,
-)
-
-critic = TrackableConversableAgent(
-    name="Critic",
-    system_message="Critic. Provide feedback for improvement for the planner and writer.",
-    llm_config=llm_config,
-)
-
-engineer = TrackableAssistantAgent(
-    name="Engineer",
-    system_message="Engineer. Write Python code based on the plan provided by the planner.",
-    llm_config=llm_config,
-    code_execution_config=False,
-)
-
-executor = TrackableConversableAgent(
-    name="Executor",
-    system_message="Executor. Use coding and language skills to solve tasks.",
-    human_input_mode="NEVER",
-    code_execution_config={
-        "last_n_messages": 3,
-        "work_dir": "coding",
-        "use_docker": False,
-    },
-)
-
-writer = TrackableConversableAgent(
-    name="Writer",
-    system_message="Writer. Write a financial report in markdown format.",
-    llm_config=llm_config,
-)
-
-# Define allowed speaker transitions
-allowed_speaker_transitions_dict = {
-    user_proxy: [planner, critic, engineer, executor, writer],
-    planner: [user_proxy],
-    critic: [user_proxy],
-    engineer: [user_proxy],
-    executor: [user_proxy],
-    writer: [user_proxy],
-}
+# Build the agents, GroupChat and manager once per process (not on every rerun)
+@st.cache_resource
+def get_engine(model, temperature, seed):
+    # Set up the OpenAI API key
+    get_openai_api_key()
+    llm_config = {"model": model, "temperature": temperature, "seed": seed}
+
+    # Define agents
+    user_proxy = AgentSpec(
+        TrackableUserProxyAgent,
+        name="Admin",
+        system_message="Admin. Give the task, and send instructions to writer to refine the financial report.",
+        human_input_mode="NEVER",
+        code_execution_config=False,
+        is_termination_msg=lambda content: "TERMINATE" in content,
+    )
+
+    planner = AgentSpec(
+        TrackableConversableAgent,
+        name="Planner",
+        system_message="Planner. Given a task, determine required information for Python code retrieval and instruct next steps.",
+        llm_config=llm_config,
+    )
+
+    critic = AgentSpec(
+        TrackableConversableAgent,
+        name="Critic",
+        system_message="Critic. Provide feedback for improvement for the planner and writer.",
+        llm_config=llm_config,
+    )
+
+    engineer = AgentSpec(
+        TrackableAssistantAgent,
+        name="Engineer",
+        system_message="Engineer. Write Python code based on the plan provided by the planner.",
+        llm_config=llm_config,
+        code_execution_config=False,
+    )
+
+    executor = AgentSpec(
+        TrackableConversableAgent,
+        name="Executor",
+        system_message="Executor. Use coding and language skills to solve tasks.",
+        human_input_mode="NEVER",
+        code_execution_config={
+            "last_n_messages": 3,
+            "executor": make_executor(work_dir="coding"),
+        },
+    )
+
+    writer = AgentSpec(
+        TrackableConversableAgent,
+        name="Writer",
+        system_message="Writer. Write a financial report in markdown format.",
+        llm_config=llm_config,
+    )
+
+    # Define allowed agent transitions
+    allowed_speaker_transitions_dict = {
+        "Admin": ["Planner", "Critic", "Engineer", "Executor", "Writer"],
+        "Planner": ["Admin"],
+        "Critic": ["Admin"],
+        "Engineer": ["Admin"],
+        "Executor": ["Admin"],
+        "Writer": ["Admin"],
+    }
 
-# GroupChat setup
-groupchat = autogen.GroupChat(
-    agents=[user_proxy, planner, critic, engineer, executor, writer],
-    messages=[],
-    max_round=50,
-    allowed_or_disallowed_speaker_transitions=allowed_speaker_transitions_dict,
-    speaker_transitions_type="allowed",
-)
-
-# GroupChatManager
-manager = autogen.GroupChatManager(
-    groupchat=groupchat,
-    llm_config=llm_config,
-    code_execution_config=False,
-)
-
-# Register reply functions
-def register_agents_reply(agent):
-    agent.register_reply([autogen.Agent, None], reply_func=print_messages, config={"callback": display_callback})
-
-for agent in [planner, critic, engineer, executor, writer, user_proxy]:
-    register_agents_reply(agent)
+    # Everyone reports back to the Admin; the rules pick who the Admin hands over to next
+    speaker_selection = SpeakerStateMachine(through("Admin", {
+        None: "Planner",
+        "Planner": "Engineer",
+        "Engineer": "Executor",
+        "Executor": lambda turn: "Engineer" if turn.failed else "Writer",
+        # Critic review, another draft or done: left to the manager's LLM
+        "Writer": None,
+        "Critic": None,
+    }))
+
+    # GroupChat and GroupChatManager are created per session by the engine
+    return ChatEngine(
+        agents=[user_proxy, planner, critic, engineer, executor, writer],
+        transitions=allowed_speaker_transitions_dict,
+        speaker_selection=speaker_selection,
+        # Old rounds are compacted to fit a token budget; the Writer gets room for its drafts
+        compaction=Compaction(max_tokens=6000, budgets={"Writer": 12000}),
+        # Per-round latency, tokens and cost, exported under .cache/metrics
+        metrics=ChatMetrics("real_estate_agents"),
+        # Every round goes to a durable run log under .cache/runs, so a run can be resumed
+        checkpoints=Checkpoints(),
+        max_round=50,
+        manager_config=llm_config,
+        stream=True,
+        # Identical prompts (temperature 0, fixed seed) are answered from the local cache
+        cache=get_llm_cache(),
+        manager_kwargs={"code_execution_config": False},
+        # MODEL_ROUTING=1 picks each role's model from OAI_CONFIG_LIST, with failover (tool/router.py)
+        router=get_router(),
+    )
+
+# Each browser session gets fresh conversation state on top of the shared engine
+engine = get_engine(**llm_config)
+if "chat" not in st.session_state:
+    # Code runs in a directory of this session's own, under coding/
+    st.session_state["chat"] = engine.new_session(work_dir=session_work_dir())
+chat = st.session_state["chat"]
 
 # Initiate chat function
 async def initiate_chat(task_input):
-    await user_proxy.a_initiate_chat(manager, message=f"Admin initiated the task: {task_input}")
+    await chat.a_initiate_chat(message=f"Admin initiated the task: {task_input}")
 
 # Get user task input
-task_input = st.chat_input("Enter your task (e.g., Retrieve stock prices for analysis)")
-
-if task_input:
-    st.write(f"**Task:** {task_input}")
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(initiate_chat(task_input))
+# One chat per session at a time: a new task waits until the current run is done
+busy = st.session_state.get("run") is not None and st.session_state["run"].running
+task_input = st.chat_input("Enter your task (e.g., Retrieve stock prices for analysis)", disabled=busy)
+
+if task_input and busy:
+    st.info("The current chat is still running; send your task when it is done.")
+elif task_input:
+    # Run the chat on the background loop so this script thread is not pinned
+    st.session_state["run"] = start_run(initiate_chat(task_input), task=task_input, context=token_stream)
+
+run = st.session_state.get("run")
+if run is not None:
+    st.write(f"**Task:** {run.task}")
+    if run.status == "queued":
+        # Waiting for a free slot (see Admission in tool/loop.py)
+        st.info(f"Many chats are running right now. Yours starts soon: position {run.position} in the queue.")
+    # Only new messages are parsed, and only the latest ones (plus a page on request) are drawn
+    Transcript.of(run).render(message_container,
+                              on_rendered=chat.metrics.record_render if chat.metrics is not None else None)
+    # Message still being generated, shown token by token
+    if run.partial is not None:
+        render_partial(run.partial)
+    if run.ttft:
+        st.caption("Time to first token: " + ", ".join(
+            f"{name} {sum(values) / len(values):.2f}s" for name, values in list(run.ttft.items())))
+    if chat.speaker_selection is not None and not run.running:
+        st.caption(chat.speaker_selection.summary())
+    if chat.compaction is not None and not run.running:
+        st.caption(chat.compaction.summary())
+    executor_output = output_summary(chat["Executor"].code_executor)
+    if executor_output and not run.running:
+        st.caption(executor_output)
+    if chat.metrics is not None and chat.metrics.rounds:
+        with st.expander("Run metrics"):
+            st.table(chat.metrics.summary_rows())
+    if run.status == "rejected":
+        st.warning(str(run.error))
+    elif run.error is not None:
+        st.error(f"Chat failed: {run.error}")
 
 # Placeholder for results
 st.write("### Results")
+
+# Poll for new messages while the agents are working
+if run is not None and run.running:
+    time.sleep(0.1 if run.partial is not None else 0.5)
+    st.rerun()
@@ -0,0 +1,183 @@
+# The financial-report team of autogen_st_3.py: agents, transition graph and
+# speaker rules, importable without Streamlit so that job workers
+# (tool/jobs.py) can run the same pipeline out of process.
+#
+#     engine = build_engine(model="gpt-4o-mini", temperature=0, seed=1234)
+#     chat = engine.new_session()
+
+from tool.utils import get_openai_api_key
+from tool.engine import AgentSpec, ChatEngine
+from tool.llm_cache import get_llm_cache
+from tool.speaker import SpeakerStateMachine, through
+from tool.compaction import Compaction
+from tool.metrics import ChatMetrics
+from tool.checkpoints import Checkpoints
+from tool.events import MESSAGE, get_bus
+from tool.executors import make_executor, output_summary
+from tool.replay import get_recorder
+from tool.router import get_router
+from autogen import AssistantAgent, UserProxyAgent, ConversableAgent
+
+# Agents publish what they send to the event bus (tool/events.py); the run
+# collects it for the UI. This subscriber picks out the Admin's prompts.
+def watch_admin_prompt(event):
+    run = event.run
+    if event.name == "Admin" and event.content and "Provide feedback" in event.content and hasattr(run, "state"):
+        run.state["admin_prompt"] = event.content  # Store Admin's prompt for display in the UI
+
+get_bus().subscribe(watch_admin_prompt, kinds=(MESSAGE,), name="admin prompt")
+
+def is_termination_msg(content) -> bool:
+    have_content = content.get("content", None) is not None
+    if have_content and "TERMINATE" in content["content"]:
+        return True
+    return False
+
+def build_engine(model, temperature, seed):
+    # Set up the OpenAI API key
+    get_openai_api_key()
+    llm_config = {"model": model, "temperature": temperature, "seed": seed}
+
+    user_proxy = AgentSpec(
+        UserProxyAgent,
+        name="Admin",
+        system_message="Admin."
+        "Give the task, and send "
+        "instructions to writer to refine the financial report.",
+        human_input_mode="NEVER",
+        code_execution_config=False,
+        is_termination_msg=is_termination_msg,
+    )
+
+    planner = AgentSpec(
+        ConversableAgent,
+        name="Planner",
+        system_message="Planner."
+        "Given a task, please determine "
+        "what information is needed to complete the task. "
+        "Please note that the information will all be retrieved using"
+        " Python code. Please only suggest information that can be "
+        "retrieved using Python code. "
+        "After each step is done by others, check the progress and "
+        "instruct the remaining steps. If a step fails, try to "
+        "workaround",
+        llm_config=llm_config,
+        description="Planner. Given a task, determine what "
+        "information is needed to complete the task. "
+        "After each step is done by others, check the progress and "
+        "instruct the remaining steps"
+        ""
+    )
+
+    critic = AgentSpec(
+        ConversableAgent,
+        name="Critic",
+        system_message="Critic. Double check plan, claims, code from other agents and provide feedback. Check whether the plan includes adding verifiable info such as source URL.",
+        llm_config=llm_config,
+        description="Critic."
+        "A Critic that prvides feedback for improvement for the planner and writer."
+        "Provide feedback for planner to improve overall plan."
+        "Provide feedback for writer to improve overall financial report."
+    )
+
+    engineer = AgentSpec(
+        AssistantAgent,
+        name="Engineer",
+        llm_config=llm_config,
+        code_execution_config=False,
+        system_message="""Engineer. You follow an approved plan. You write python/shell code to solve tasks. Wrap the code in a code block that specifies the script type. The user can't modify your code. So do not suggest incomplete code which requires others to modify. Don't use a code block if it's not intended to be executed by the executor.
+Don't include multiple code blocks in one response. Do not ask others to copy and paste the result. Check the execution result returned by the executor. Create graphs and plots.
+If the result indicates there is an error, fix the error and output the code again. Suggest the full code instead of partial code or code changes. If the error can't be fixed or if the task is not solved even after the code is executed successfully, analyze the problem, revisit your assumption, collect additional info you need, and think of a different approach to try.
+Include code for saving plots, tables, graphs and any meaningful results.
+Always pass code you write to executor.
+""",
+        description="Engineer."
+        "An engineer that writes code based on the plan "
+        "provided by the planner.",
+    )
+
+    executor = AgentSpec(
+        ConversableAgent,
+        name="Executor",
+        system_message="""Executor. You are a helpful AI assistant.
+Solve tasks using your coding and language skills.
+In the following cases, suggest python code (in a python coding block) or shell script (in a sh coding block) for the user to execute.
+    1. When you need to collect info, use the code to output the info you need, for example, browse or search the web, download/read a file, print the content of a webpage or a file, get the current date/time, check the operating system. After sufficient info is printed and the task is ready to be solved based on your language skill, you can solve the task by yourself.
+    2. When you need to perform some task with code, use the code to perform the task and output the result. Finish the task smartly.
+Solve the task step by step if you need to. If a plan is not provided, explain your plan first. Be clear which step uses code, and which step uses your language skill.
+When using code, you must indicate the script type in the code block. The user cannot provide any other feedback or perform any other action beyond executing the code you suggest. The user can't modify your code. So do not suggest incomplete code which requires users to modify. Don't use a code block if it's not intended to be executed by the user.
+If you want the user to save the code in a file before executing it, put # filename: <filename> inside the code block as the first line. Don't include multiple code blocks in one response. Do not ask users to copy and paste the result. Instead, use 'print' function for the output when relevant. Check the execution result returned by the user.
+If the result indicates there is an error, fix the error and output the code again. Suggest the full code instead of partial code or code changes. If the error can't be fixed or if the task is not solved even after the code is executed successfully, analyze the problem, revisit your assumption, collect additional info you need, and think of a different approach to try.
+When you find an answer, verify the answer carefully. Include verifiable evidence in your response if possible.
+Reply "TERMINATE" in the end when everything is done.""",
+        human_input_mode="NEVER",
+        code_execution_config={
+            "last_n_messages": 3,
+            "executor": make_executor(work_dir="coding"),
+        },
+    )
+
+    writer = AgentSpec(
+        ConversableAgent,
+        name="Writer",
+        llm_config=llm_config,
+        system_message="Writer."
+        "Please write a finanial report in markdown format (with relevant titles)"
+        " and put the content in pseudo ```md``` code block. "
+        "You take feedback from the admin and refine your financial report.",
+        description="Writer."
+        "Write financial report based on the code execution results and take "
+        "feedback from the admin to refine the financial report."
+    )
+
+    allowed_speaker_transitions_dict = {
+        "Admin": ["Planner", "Critic", "Engineer", "Executor", "Writer"],
+        "Planner": ["Admin"],
+        "Critic": ["Admin"],
+        "Engineer": ["Admin"],
+        "Executor": ["Admin"],
+        "Writer": ["Admin"],
+    }
+
+    # Everyone reports back to the Admin; the rules pick who the Admin hands over to next
+    speaker_selection = SpeakerStateMachine(through("Admin", {
+        None: "Planner",
+        "Planner": "Engineer",
+        "Engineer": "Executor",
+        "Executor": lambda turn: "Engineer" if turn.failed else "Writer",
+        # Critic review, another draft or done: left to the manager's LLM
+        "Writer": None,
+        "Critic": None,
+    }))
+
+    # Create the engine; every session gets its own GroupChat and manager
+    return ChatEngine(
+        agents=[user_proxy, engineer, writer, planner, executor, critic],
+        transitions=allowed_speaker_transitions_dict,
+        speaker_selection=speaker_selection,
+        # Old rounds are compacted to fit a token budget; the Writer gets room for its drafts
+        compaction=Compaction(max_tokens=6000, budgets={"Writer": 12000}),
+        # Per-round latency, tokens and cost, exported under .cache/metrics
+        metrics=ChatMetrics("autogen_st_3"),
+        # Every round goes to a durable run log under .cache/runs, so a run can be resumed
+        checkpoints=Checkpoints(),
+        max_round=50,
+        manager_config=llm_config,
+        stream=True,
+        # Identical prompts (temperature 0, fixed seed) are answered from the local cache
+        cache=get_llm_cache(),
+        manager_kwargs={"code_execution_config": False, "is_termination_msg": is_termination_msg},
+        # RECORD_RUNS=1 records every run for offline replay (tool/replay.py)
+        recorder=get_recorder("report_team:build_engine", {"model": model, "temperature": temperature, "seed": seed}),
+        # MODEL_ROUTING=1 picks each role's model from OAI_CONFIG_LIST, with failover (tool/router.py)
+        router=get_router(),
+    )
+
+
+def summaries(chat):
+    """One-line summaries of a finished session, as shown under the chat."""
+    lines = [chat.speaker_selection.summary(), chat.compaction.summary()]
+    executor_output = output_summary(chat["Executor"].code_executor)
+    if executor_output:
+        lines.append(executor_output)
+    return lines
@@ -0,0 +1,138 @@
+# The agents, transition graph and speaker rules of autogen_st_4.py,
+# importable without Streamlit (for the benchmarks in tool/bench.py and the
+# job workers).
+#
+#     engine = build_engine(model="gpt-4o-mini", temperature=0, seed=1234)
+#     chat = engine.new_session()
+
+from tool.utils import get_openai_api_key
+from tool.engine import AgentSpec, ChatEngine
+from tool.llm_cache import get_llm_cache
+from tool.speaker import SpeakerStateMachine, through
+from tool.compaction import Compaction
+from tool.metrics import ChatMetrics
+from tool.checkpoints import Checkpoints
+from tool.executors import make_executor
+from tool.replay import get_recorder
+from tool.router import get_router
+from autogen import AssistantAgent, UserProxyAgent, ConversableAgent
+
+def build_engine(model, temperature, seed):
+    # Set up the OpenAI API key
+    get_openai_api_key()
+    llm_config = {"model": model, "temperature": temperature, "seed": seed}
+
+    # Define the agents with correct system prompts
+    user_proxy = AgentSpec(
+        UserProxyAgent,
+        name="Admin",
+        system_message="Admin. Give the task, and send instructions to writer to refine the financial report.",
+        human_input_mode="NEVER",
+        code_execution_config=False,
+        is_termination_msg=lambda content: "TERMINATE" in content,
+    )
+
+    planner = AgentSpec(
+        ConversableAgent,
+        name="Planner",
+        system_message="Planner. Given a task, please determine what information is needed to complete the task. "
+                       "Please note that the information will all be retrieved using Python code. "
+                       "Please only suggest information that can be retrieved using Python code. "
+                       "After each step is done by others, check the progress and instruct the remaining steps. "
+                       "If a step fails, try to workaround.",
+        llm_config=llm_config,
+        description="Planner. Given a task, determine what information is needed to complete the task. "
+                    "After each step is done by others, check the progress and instruct the remaining steps."
+    )
+
+    critic = AgentSpec(
+        ConversableAgent,
+        name="Critic",
+        system_message="Critic. Double check plan, claims, code from other agents and provide feedback. "
+                       "Check whether the plan includes adding verifiable info such as source URL.",
+        llm_config=llm_config,
+        description="Critic. Provide feedback for improvement for the planner and writer. "
+                    "Provide feedback for planner to improve overall plan. "
+                    "Provide feedback for writer to improve overall financial report."
+    )
+
+    engineer = AgentSpec(
+        AssistantAgent,
+        name="Engineer",
+        system_message="""Engineer. You follow an approved plan. You write python/shell code to solve tasks. Wrap the code in a code block that specifies the script type. The user can't modify your code. So do not suggest incomplete code which requires others to modify. 
+Don't use a code block if it's not intended to be executed by the executor. Don't include multiple code blocks in one response. Do not ask others to copy and paste the result. Check the execution result returned by the executor. Create graphs and plots. 
+If the result indicates there is an error, fix the error and output the code again. Suggest the full code instead of partial code or code changes. If the error can't be fixed or if the task is not solved even after the code is executed successfully, analyze the problem, revisit your assumption, collect additional info you need, and think of a different approach to try. 
+Include code for saving plots, tables, graphs and any meaningful results. Always pass code you write to executor.""",
+        llm_config=llm_config,
+        code_execution_config=False,
+        description="Engineer. An engineer that writes code based on the plan provided by the planner."
+    )
+
+    executor = AgentSpec(
+        ConversableAgent,
+        name="Executor",
+        system_message="""Executor. You are a helpful AI assistant. Solve tasks using your coding and language skills.
+In the following cases, suggest python code (in a python coding block) or shell script (in a sh coding block) for the user to execute. 
+1. When you need to collect info, use the code to output the info you need, for example, browse or search the web, download/read a file, print the content of a webpage or a file, get the current date/time, check the operating system. After sufficient info is printed and the task is ready to be solved based on your language skill, you can solve the task by yourself. 
+2. When you need to perform some task with code, use the code to perform the task and output the result. Finish the task smartly. Solve the task step by step if you need to. 
+If a plan is not provided, explain your plan first. Be clear which step uses code, and which step uses your language skill. When using code, you must indicate the script type in the code block.""",
+        human_input_mode="NEVER",
+        code_execution_config={
+            "last_n_messages": 3,
+            "executor": make_executor(work_dir="coding"),
+        }
+    )
+
+    writer = AgentSpec(
+        ConversableAgent,
+        name="Writer",
+        system_message="Writer. Please write a financial report in markdown format (with relevant titles) "
+                       "and put the content in pseudo ```md``` code block. You take feedback from the admin "
+                       "and refine your financial report.",
+        llm_config=llm_config,
+        description="Writer. Write financial report based on the code execution results and take feedback from the admin to refine the financial report."
+    )
+
+    # Define allowed agent transitions
+    allowed_speaker_transitions_dict = {
+        "Admin": ["Planner", "Critic", "Engineer", "Executor", "Writer"],
+        "Planner": ["Admin"],
+        "Critic": ["Admin"],
+        "Engineer": ["Admin"],
+        "Executor": ["Admin"],
+        "Writer": ["Admin"],
+    }
+
+    # Everyone reports back to the Admin; the rules pick who the Admin hands over to next
+    speaker_selection = SpeakerStateMachine(through("Admin", {
+        None: "Planner",
+        "Planner": "Engineer",
+        "Engineer": "Executor",
+        "Executor": lambda turn: "Engineer" if turn.failed else "Writer",
+        # Critic review, another draft or done: left to the manager's LLM
+        "Writer": None,
+        "Critic": None,
+    }))
+
+    # GroupChat and GroupChatManager are created per session by the engine
+    return ChatEngine(
+        agents=[user_proxy, planner, critic, engineer, executor, writer],
+        transitions=allowed_speaker_transitions_dict,
+        speaker_selection=speaker_selection,
+        # Old rounds are compacted to fit a token budget; the Writer gets room for its drafts
+        compaction=Compaction(max_tokens=6000, budgets={"Writer": 12000}),
+        # Per-round latency, tokens and cost, exported under .cache/metrics
+        metrics=ChatMetrics("autogen_st_4"),
+        # Every round goes to a durable run log under .cache/runs, so a run can be resumed
+        checkpoints=Checkpoints(),
+        max_round=50,
+        manager_config=llm_config,
+        stream=True,
+        # Identical prompts (temperature 0, fixed seed) are answered from the local cache
+        cache=get_llm_cache(),
+        manager_kwargs={"code_execution_config": False},
+        # RECORD_RUNS=1 records every run for offline replay (tool/replay.py)
+        recorder=get_recorder("st_4_team:build_engine", {"model": model, "temperature": temperature, "seed": seed}),
+        # MODEL_ROUTING=1 picks each role's model from OAI_CONFIG_LIST, with failover (tool/router.py)
+        router=get_router(),
+    )
@@ -0,0 +1,30 @@
+# Shared fixtures. The tests import the repo's `tool` helpers, which are not
+# an installed package, so the repo root goes on sys.path first.
+
+import json
+import os
+import sys
+import urllib.request
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tool.mock_llm import MockLLM  # noqa: E402
+
+
+@pytest.fixture
+def mock_llm():
+    """A local OpenAI-compatible server answering at once."""
+    with MockLLM(latency=0.0, tokens_per_second=0) as mock:
+        yield mock
+
+
+def complete(url, request):
+    """POST a chat completion request to `url` and return the parsed response."""
+    data = json.dumps(request).encode("utf-8")
+    http_request = urllib.request.Request(url + "/chat/completions", data=data,
+                                          headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(http_request, timeout=10) as response:
+        return json.loads(response.read())
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tool.analytics import (PERIODS_PER_YEAR, beta, correlation_matrix, drawdowns, max_drawdown,
+                            performance_summary, resample_prices, returns, rolling_stats, sharpe_ratio,
+                            synthetic_prices, volatility)
+
+
+@pytest.fixture
+def prices():
+    # 6 tickers over 300 business days; two of them list partway through (leading NaN)
+    return synthetic_prices(tickers=6, days=300, seed=1)
+
+
+def assert_same(ours, expected):
+    pd.testing.assert_frame_equal(pd.DataFrame(ours), pd.DataFrame(expected), check_names=False,
+                                  check_freq=False, rtol=1e-9, atol=1e-12)
+
+
+def test_returns(prices):
+    assert_same(returns(prices), prices / prices.shift(1) - 1)
+    assert_same(returns(prices, "log", periods=5), np.log(prices / prices.shift(5)))
+    # A Series gives a Series
+    series = returns(prices["T0000"])
+    assert isinstance(series, pd.Series)
+    pd.testing.assert_series_equal(series, prices["T0000"].pct_change(fill_method=None), check_freq=False)
+    with pytest.raises(ValueError):
+        returns(prices, "arithmetic")
+
+
+def test_rolling_stats(prices):
+    stats = rolling_stats(prices, 20, stats=("mean", "std", "var", "min", "max", "sum"))
+    rolling = prices.rolling(20)
+    assert_same(stats["mean"], rolling.mean())
+    assert_same(stats["std"], rolling.std())
+    assert_same(stats["var"], rolling.var())
+    assert_same(stats["min"], rolling.min())
+    assert_same(stats["max"], rolling.max())
+    assert_same(stats["sum"], rolling.sum())
+    assert_same(rolling_stats(prices, 20, "mean", min_periods=5), prices.rolling(20, min_periods=5).mean())
+
+
+def test_volatility(prices):
+    log_returns = np.log(prices / prices.shift(1))
+    assert_same(volatility(prices, 21), log_returns.rolling(21).std() * np.sqrt(PERIODS_PER_YEAR))
+    pd.testing.assert_series_equal(volatility(prices, window=None), log_returns.std() * np.sqrt(PERIODS_PER_YEAR),
+                                   check_names=False)
+
+
+def test_drawdowns(prices):
+    assert_same(drawdowns(prices), prices / prices.cummax() - 1)
+
+
+def test_max_drawdown_dates():
+    index = pd.bdate_range("2024-01-01", periods=8)
+    prices = pd.DataFrame({"UP": [1.0, 2, 3, 4, 5, 6, 7, 8],
+                           "DIP": [10.0, 12, 9, 6, 8, 12, 13, 11],
+                           "LATE": [np.nan, np.nan, 5, 4, 3, 3.5, 4, 4.5]}, index=index)
+    result = max_drawdown(prices)
+
+    assert result.loc["UP", "max_drawdown"] == 0.0
+    assert result.loc["DIP", "max_drawdown"] == pytest.approx(6 / 12 - 1)
+    assert (result.loc["DIP", "peak"], result.loc["DIP", "trough"], result.loc["DIP", "recovery"]) == (
+        index[1], index[3], index[5])
+    assert result.loc["LATE", "max_drawdown"] == pytest.approx(3 / 5 - 1)
+    assert result.loc["LATE", "peak"] == index[2]
+    assert pd.isna(result.loc["LATE", "recovery"])
+    pd.testing.assert_series_equal(result["max_drawdown"], (prices / prices.cummax() - 1).min(), check_names=False)
+
+
+def test_beta(prices):
+    r = prices / prices.shift(1) - 1
+    market = r["T0000"]
+    expected = pd.Series({c: r[c].cov(market) / market[r[c].notna()].var() for c in prices})
+    pd.testing.assert_series_equal(beta(prices, "T0000"), expected, check_names=False)
+    assert beta(prices, "T0000")["T0000"] == pytest.approx(1.0)
+
+    rolling = beta(prices, prices["T0000"], window=60)
+    expected = r["T0001"].rolling(60).cov(market) / market.rolling(60).var()
+    pd.testing.assert_series_equal(rolling["T0001"], expected, check_names=False, check_freq=False)
+
+
+def test_sharpe_ratio(prices):
+    r = prices / prices.shift(1) - 1
+    pd.testing.assert_series_equal(sharpe_ratio(prices), r.mean() / r.std() * np.sqrt(PERIODS_PER_YEAR),
+                                   check_names=False)
+    daily = 1.03 ** (1 / PERIODS_PER_YEAR) - 1
+    expected = (r - daily).mean() / r.std() * np.sqrt(PERIODS_PER_YEAR)
+    pd.testing.assert_series_equal(sharpe_ratio(prices, risk_free=0.03), expected, check_names=False)
+
+
+def test_correlation_matrix(prices):
+    assert_same(correlation_matrix(prices), (prices / prices.shift(1) - 1).corr())
+    assert_same(correlation_matrix(prices, on="prices"), prices.corr())
+
+
+def test_resample_prices(prices):
+    for rule, how in (("M", "last"), ("M", "first"), ("W", "mean"), ("Q", "max"), ("Y", "sum")):
+        ours = resample_prices(prices, rule, how)
+        expected = getattr(prices.resample({"M": "ME", "W": "W", "Q": "QE", "Y": "YE"}[rule]), how)()
+        if how == "sum":
+            # pandas sums an all-NaN period to 0
+            expected = expected.where(prices.resample("YE").count() > 0)
+        # Ours are labelled with the period's last trading day, pandas' with its calendar end
+        np.testing.assert_allclose(ours.to_numpy(), expected.to_numpy(), rtol=1e-9)
+        assert list(ours.index) == list(prices.index.to_series().resample(expected.index.freq).last())
+    with pytest.raises(ValueError):
+        resample_prices(prices, "D")
+
+
+def test_performance_summary(prices):
+    summary = performance_summary(prices)
+    for ticker in prices:
+        column = prices[ticker].dropna()
+        row = summary.loc[ticker]
+        assert (row["start"], row["end"]) == (column.index[0], column.index[-1])
+        total = column.iloc[-1] / column.iloc[0] - 1
+        assert row["total_return"] == pytest.approx(total)
+        assert row["cagr"] == pytest.approx((1 + total) ** (PERIODS_PER_YEAR / (len(column) - 1)) - 1)
+        assert row["max_drawdown"] == pytest.approx((column / column.cummax() - 1).min())
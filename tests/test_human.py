@@ -0,0 +1,45 @@
+import asyncio
+from types import SimpleNamespace
+
+from tool.human import EXIT, HumanInput
+
+
+def make_agent():
+    return SimpleNamespace(name="Admin", human_input_mode="ALWAYS", _human_input=[])
+
+
+def test_reply_answers_the_waiting_agent():
+    human = HumanInput()
+    agent = make_agent()
+    human.attach([agent])
+
+    async def main():
+        task = asyncio.ensure_future(agent.a_get_human_input("?"))
+        await asyncio.sleep(0)
+        assert human.waiting
+        assert human.reply("go on")
+        return await task
+
+    assert asyncio.run(main()) == "go on"
+    assert not human.waiting
+    assert agent._human_input == ["go on"]
+
+
+def test_cancelled_wait_does_not_break_reply_or_close():
+    human = HumanInput()
+    agent = make_agent()
+    human.attach([agent])
+
+    async def main():
+        task = asyncio.ensure_future(agent.a_get_human_input("?"))
+        await asyncio.sleep(0)
+        assert human.waiting
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert not human.waiting
+    # Nobody is asking: kept for the next question, and close() does not raise
+    assert not human.reply("late")
+    human.close()
+    assert agent.get_human_input("?") == EXIT
@@ -0,0 +1,114 @@
+import copy
+import json
+import pickle
+import subprocess
+import sys
+import time
+
+from conftest import ROOT, complete
+from tool.llm_cache import LLMCache
+
+
+def key(request):
+    # As autogen's get_key(): the request parameters as sorted JSON
+    return json.dumps(request, sort_keys=True)
+
+
+def request(content, **params):
+    return dict({"model": "mock", "temperature": 0, "seed": 1234,
+                 "messages": [{"role": "system", "content": "Planner. Plan the task."},
+                              {"role": "user", "content": content}]}, **params)
+
+
+def cached_complete(cache, url, params):
+    """The completion for `params`, from the cache or the server."""
+    response = cache.get(key(params))
+    if response is None:
+        response = complete(url, params)
+        cache.set(key(params), response)
+    return response
+
+
+def test_hit_and_miss_with_normalized_messages(tmp_path, mock_llm):
+    cache = LLMCache(str(tmp_path / "cache.sqlite"))
+
+    first = cached_complete(cache, mock_llm.url, request("Compare AAPL and MSFT\n"))
+    assert mock_llm.requests == 1
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # Leading and trailing whitespace and the transport-only "stream" flag do not change the key
+    again = cached_complete(cache, mock_llm.url, request("  Compare AAPL and MSFT ", stream=False))
+    assert again == first
+    assert mock_llm.requests == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A different prompt, or different sampling parameters, are not the same request
+    cached_complete(cache, mock_llm.url, request("Compare AAPL and NVDA"))
+    cached_complete(cache, mock_llm.url, request("Compare AAPL and MSFT", temperature=1))
+    assert mock_llm.requests == 3
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    # Whitespace inside a message is part of it: code indented differently is another prompt
+    cached_complete(cache, mock_llm.url, request("Fix this:\nif x:\n    print(x)"))
+    cached_complete(cache, mock_llm.url, request("Fix this:\nif x:\nprint(x)"))
+    assert mock_llm.requests == 5
+    assert (cache.hits, cache.misses) == (1, 5)
+    assert cache.stats()["entries"] == 5
+
+
+def test_llm_configs_share_the_cache_when_copied(tmp_path):
+    # autogen deep-copies llm_configs, e.g. the manager's for speaker selection
+    cache = LLMCache(str(tmp_path / "cache.sqlite"))
+    config = copy.deepcopy({"model": "mock", "cache": cache})
+    assert config["cache"] is cache
+
+
+def test_lru_eviction_at_the_size_cap(tmp_path, mock_llm):
+    responses = {name: complete(mock_llm.url, request(name)) for name in ("a", "b", "c")}
+    sizes = {name: len(pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL))
+             for name, response in responses.items()}
+    # Room for any two of the three
+    cache = LLMCache(str(tmp_path / "cache.sqlite"), max_bytes=sum(sizes.values()) - 1)
+
+    cache.set(key(request("a")), responses["a"])
+    time.sleep(0.01)
+    cache.set(key(request("b")), responses["b"])
+    time.sleep(0.01)
+    # Using "a" makes "b" the least recently used
+    assert cache.get(key(request("a"))) == responses["a"]
+    time.sleep(0.01)
+    cache.set(key(request("c")), responses["c"])
+
+    assert cache.get(key(request("b"))) is None
+    assert cache.get(key(request("a"))) == responses["a"]
+    assert cache.get(key(request("c"))) == responses["c"]
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["entries"] == 2
+    assert stats["bytes"] <= cache.max_bytes
+
+
+def test_counters_are_shared_between_processes(tmp_path, mock_llm):
+    path = str(tmp_path / "cache.sqlite")
+    cache = LLMCache(path)
+    cached_complete(cache, mock_llm.url, request("Compare AAPL and MSFT"))
+
+    # Another server process on the same file: one hit, one miss
+    lookups = (
+        "import json, sys\n"
+        "from tool.llm_cache import LLMCache\n"
+        "cache = LLMCache(sys.argv[1])\n"
+        "hit = cache.get(sys.argv[2])\n"
+        "miss = cache.get(sys.argv[3])\n"
+        "print(json.dumps([hit is not None, miss is None]))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", lookups, path, key(request("Compare AAPL and MSFT")), key(request("Something else"))],
+        cwd=ROOT, capture_output=True, text=True, timeout=60, check=True)
+    assert json.loads(result.stdout) == [True, True]
+
+    stats = cache.stats()
+    # This process only counts its own lookups; the totals are everybody's
+    assert (stats["hits"], stats["misses"]) == (0, 1)
+    assert (stats["total_hits"], stats["total_misses"]) == (1, 2)
+    assert mock_llm.requests == 1
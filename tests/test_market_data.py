@@ -0,0 +1,160 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tool.fetch import FetchEngine
+from tool.market_data import FixtureProvider, MarketDataStore
+
+
+def write_bars(directory, ticker, start="2024-01-01", end="2024-12-31", offset=0.0):
+    """<TICKER>.csv with one bar per business day; Close counts up from 100 + offset."""
+    dates = pd.bdate_range(start, end, name="Date")
+    close = 100.0 + offset + np.arange(len(dates))
+    pd.DataFrame({"Open": close, "High": close + 1, "Low": close - 1, "Close": close,
+                  "Volume": 1000.0}, index=dates).to_csv(directory / f"{ticker}.csv")
+    return dates
+
+
+@pytest.fixture
+def store(tmp_path):
+    bars = tmp_path / "bars"
+    bars.mkdir()
+    provider = FixtureProvider(str(bars))
+    # No rate limit or backoff to wait on in the tests
+    engine = FetchEngine(provider, rate=1000.0, retries=1, backoff=0.0)
+    store = MarketDataStore(str(tmp_path / "store"), provider=provider, engine=engine)
+    store.bars = bars
+    return store
+
+
+def test_incremental_fetches_only_download_missing_ranges(store):
+    write_bars(store.bars, "AAPL")
+
+    store.ensure("AAPL", "2024-03-01", "2024-06-01")
+    assert store.provider.calls == 1
+
+    # Inside what is on disk already: nothing to fetch
+    assert store.missing_ranges("AAPL", "2024-04-01", "2024-05-01") == []
+    store.ensure("AAPL", "2024-04-01", "2024-05-01")
+    assert store.provider.calls == 1
+
+    # Wider on both sides: one fetch before and one after the covered range
+    assert store.missing_ranges("AAPL", "2024-01-01", "2024-09-01") == [
+        (pd.Timestamp("2024-01-01"), pd.Timestamp("2024-03-01")),
+        (pd.Timestamp("2024-06-01"), pd.Timestamp("2024-09-01"))]
+    store.ensure("AAPL", "2024-01-01", "2024-09-01")
+    assert store.provider.calls == 3
+    assert store.meta("AAPL")["start"] == "2024-01-01"
+    assert store.meta("AAPL")["end"] == "2024-09-01"
+
+    close = store.close_slice("AAPL", "2024-01-01", "2024-09-01")
+    assert store.provider.calls == 3
+    assert list(close.index) == list(pd.bdate_range("2024-01-01", "2024-08-31"))
+    assert close.is_monotonic_increasing
+
+
+def test_merge_adds_new_rows_and_keeps_the_newest_bar(store):
+    write_bars(store.bars, "MSFT")
+    store.ensure("MSFT", "2024-01-01", "2024-02-01")
+    rows = store.meta("MSFT")["rows"]
+
+    # A revised bar for the last day we have, and two days we do not
+    new = pd.DataFrame({"Open": 1.0, "High": 1.0, "Low": 1.0, "Close": [500.0, 501.0, 502.0],
+                        "Volume": 1.0},
+                       index=pd.DatetimeIndex(["2024-01-31", "2024-02-01", "2024-02-02"], name="Date"))
+    store.merge("MSFT", [new], "2024-01-31", "2024-02-05")
+
+    meta = store.meta("MSFT")
+    assert meta["rows"] == rows + 2
+    assert (meta["start"], meta["end"]) == ("2024-01-01", "2024-02-05")
+    close = store.close_slice("MSFT", "2024-01-01", "2024-02-05")
+    assert store.provider.calls == 1
+    assert close.index.is_unique
+    assert close.iloc[0] == 100.0
+    assert list(close.iloc[-3:]) == [500.0, 501.0, 502.0]
+
+
+def test_get_close_reads_memory_mapped_columns(store):
+    write_bars(store.bars, "AAPL")
+    write_bars(store.bars, "NVDA", offset=1000.0)
+
+    close = store.get_close("AAPL, NVDA", "2024-01-01", "2024-04-01")
+    # One batched round of fetches, none per symbol afterwards
+    assert store.provider.calls == 2
+    assert list(close.columns) == ["AAPL", "NVDA"]
+    assert list(close.index) == list(pd.bdate_range("2024-01-01", "2024-03-29"))
+    assert close["AAPL"].iloc[0] == 100.0
+    assert close["NVDA"].iloc[0] == 1100.0
+    assert close.attrs["failed"] == {}
+
+    # The slice is a view on the .npy file, not a copy
+    columns = store.arrays("AAPL")
+    assert isinstance(columns["Close"], np.memmap)
+    view = store.close_slice("AAPL", "2024-02-01", "2024-03-01")
+    assert np.shares_memory(view.to_numpy(), columns["Close"])
+
+    # Reading never fetches: outside what is on disk is simply empty
+    assert store.close_slice("AAPL", "2023-01-01", "2023-02-01").empty
+    assert store.close_slice("MSFT", "2024-01-01", "2024-02-01").empty
+    assert store.provider.calls == 2
+
+
+def test_failed_and_delisted_symbols_are_reported_separately(store, capsys):
+    write_bars(store.bars, "AAPL")
+
+    class Flaky(FixtureProvider):
+        def fetch(self, ticker, start, end):
+            if ticker == "BROKEN":
+                self.calls += 1
+                raise ConnectionError("server closed the connection")
+            return super().fetch(ticker, start, end)
+
+    store.provider = store.engine.provider = Flaky(str(store.bars))
+    # GONE has no bars at all, as a delisted symbol
+    close = store.get_close(["AAPL", "GONE", "BROKEN"], "2024-01-01", "2024-02-01")
+
+    failed = close.attrs["failed"]
+    assert set(failed) == {"GONE", "BROKEN"}
+    assert "delisted" in failed["GONE"]
+    assert failed["BROKEN"].startswith("ConnectionError")
+    assert close["AAPL"].notna().all()
+    assert close[["GONE", "BROKEN"]].isna().all().all()
+    assert "Failed to fetch: " in capsys.readouterr().out
+
+    # Failed symbols are not marked as covered, so the next call tries them again
+    assert store.meta("AAPL") is not None
+    assert store.meta("GONE") is None and store.meta("BROKEN") is None
+    assert store.missing_ranges("GONE", "2024-01-01", "2024-02-01") != []
+
+
+def test_tail_past_today_is_checked_once_a_day(store):
+    today = pd.Timestamp.now().normalize()
+    tickers = ["AAPL", "MSFT", "NVDA"]
+    for ticker in tickers:
+        write_bars(store.bars, ticker, start=today - pd.Timedelta(days=60), end=today - pd.Timedelta(days=1))
+    start, end = today - pd.Timedelta(days=30), today + pd.Timedelta(days=1)
+
+    store.get_close(tickers, start, end)
+    calls = store.provider.calls
+    assert store.meta("AAPL")["checked_through"] == str(end.date())
+
+    # Cached: the tail up to tomorrow was checked today already
+    close = store.get_close(tickers, start, end)
+    assert store.provider.calls == calls
+    assert close.attrs["failed"] == {}
+
+    # The next day, the tail is asked for again; no new bars is not an error, so no retries
+    for ticker in tickers:
+        path = os.path.join(store._dir(ticker), "meta.json")
+        with open(path) as f:
+            meta = json.load(f)
+        meta["checked_on"] = str((today - pd.Timedelta(days=1)).date())
+        with open(path, "w") as f:
+            json.dump(meta, f)
+    close = store.get_close(tickers, start, end)
+    assert store.provider.calls == calls + len(tickers)
+    assert close.attrs["failed"] == {}
+    assert close.notna().all().all()
@@ -0,0 +1,71 @@
+import json
+import threading
+
+import tool.metrics
+from tool.metrics import ChatMetrics, Registry
+
+
+def test_usage_is_kept_per_session_across_runs(tmp_path):
+    base = ChatMetrics("test", registry=Registry(str(tmp_path)))
+    first, second = base.copy(), base.copy()
+
+    first.begin("Planner")
+    first.llm_call("Planner", 0.5, 100, 20, 0.01, cached=False)
+    first.end("Planner", "Plan: ...")
+    first.new_run()
+    first.begin("Engineer")
+    first.llm_call("Engineer", 0.5, 200, 50, 0.02, cached=True)
+    first.end("Engineer", "```python\nprint(1)\n```")
+
+    second.begin("Planner")
+    second.llm_call("Planner", 0.5, 10, 2, 0.001, cached=False)
+    second.end("Planner", "Plan: ...")
+
+    assert first.usage_summary() == {"llm_calls": 2, "cached_calls": 1, "prompt_tokens": 300,
+                                     "completion_tokens": 70, "cost": 0.03}
+    assert second.usage_summary()["prompt_tokens"] == 10
+    assert base.usage_summary()["llm_calls"] == 0
+    # The summary rows are the current run's only
+    assert [row["agent"] for row in first.summary_rows()] == ["Engineer"]
+
+
+def test_concurrent_prometheus_writes_do_not_collide(tmp_path):
+    registry = Registry(str(tmp_path))
+    metrics = ChatMetrics("test", registry=registry)
+    metrics.begin("Planner")
+    metrics.end("Planner", "Plan: ...")
+    registry.observe(metrics.rounds[0])
+    errors = []
+
+    def write():
+        for _ in range(50):
+            try:
+                registry.write_prometheus()
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=write) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert 'autogen_rounds_total{app="test",agent="Planner"}' in (tmp_path / "test.prom").read_text()
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_rounds_log_is_rotated_past_the_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(tool.metrics, "MAX_LOG_BYTES", 2000)
+    registry = Registry(str(tmp_path))
+    metrics = ChatMetrics("test", registry=registry)
+    for _ in range(40):
+        metrics.begin("Planner")
+        metrics.end("Planner", "Plan: ...")
+    for record in metrics.rounds:
+        registry.observe(record)
+
+    current, rotated = tmp_path / "rounds.jsonl", tmp_path / "rounds.jsonl.1"
+    assert rotated.exists()
+    assert current.stat().st_size <= 2000 + len(json.dumps(metrics.rounds[0])) + 1
+    lines = rotated.read_text().splitlines() + current.read_text().splitlines()
+    assert all(json.loads(line)["app"] == "test" for line in lines)
@@ -0,0 +1,58 @@
+import pandas as pd
+
+from tool.market_data import FixtureProvider, MarketDataStore
+from tool.prefetch import Prefetcher, period_in, tickers_in
+
+PLAN = """Plan:
+1. Engineer: write Python code that uses get_stock_prices to GET DATA for NVDA and TSLA over the past
+   6 months, and SAVE the chart to a PNG file.
+2. Executor: run the code.
+3. Engineer: PLOT the data with matplotlib; use CLOSE prices, not OHLC averages.
+4. Scientist: summarize the results. Reply TERMINATE when done."""
+
+
+def test_plan_words_are_not_tickers():
+    assert tickers_in(PLAN) == ["NVDA", "TSLA"]
+    assert tickers_in("GET DATA for the stocks, then SAVE to a PNG") == []
+    assert tickers_in("PLOT the data for the last month and use CLOSE prices") == []
+    assert tickers_in("NOTE: the FINAL REPORT must be a MARKDOWN TABLE") == []
+
+
+def test_marked_and_named_symbols():
+    text = ("Compare Airbnb (ABNB) with $DDOG, BRK-B and the S&P 500 (^GSPC) since 2023. "
+            "Also fetch Apple and microsoft. CHART the daily RETURNS.")
+    assert tickers_in(text) == ["ABNB", "DDOG", "BRK-B", "^GSPC", "AAPL", "MSFT"]
+    # Abbreviations stay out even in parentheses
+    assert tickers_in("Prices in US dollars (USD) as a CSV file (CSV)") == []
+
+
+def test_symbols_already_in_the_store_count():
+    text = "Engineer: fetch ABNB and DDOG for the last quarter and PLOT them."
+    assert tickers_in(text) == []
+    assert tickers_in(text, known={"ABNB", "DDOG"}) == ["ABNB", "DDOG"]
+
+
+def test_period_of_a_plan():
+    today = pd.Timestamp("2024-07-01")
+    assert period_in(PLAN, today=today) == (today - pd.Timedelta(days=6 * 31), today)
+    assert period_in("from 2024-01-02 to 2024-03-01", today=today) == (
+        pd.Timestamp("2024-01-02"), pd.Timestamp("2024-03-02"))
+
+
+def test_scan_uses_the_store_tickers(tmp_path):
+    bars = tmp_path / "bars"
+    bars.mkdir()
+    dates = pd.bdate_range("2024-01-01", "2024-03-29", name="Date")
+    pd.DataFrame({"Open": 1.0, "High": 1.0, "Low": 1.0, "Close": 1.0, "Volume": 1.0},
+                 index=dates).to_csv(bars / "ABNB.csv")
+    store = MarketDataStore(str(tmp_path / "store"), provider=FixtureProvider(str(bars)))
+    prefetcher = Prefetcher(store=store)
+    try:
+        assert prefetcher.scan("Engineer: GET DATA for ABNB over the past month and PLOT the CLOSE") is None
+
+        store.ensure("ABNB", "2024-01-01", "2024-02-01")
+        assert store.tickers() == {"ABNB"}
+        tickers, start, end = prefetcher.scan("Engineer: GET DATA for ABNB over the past month and PLOT the CLOSE")
+        assert tickers == ["ABNB"]
+    finally:
+        prefetcher.close()
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from tool.worker_pool import RELEASED_NOTE, WorkerPool
+
+
+@pytest.fixture
+def pool():
+    # No preloads, and no release thread: the tests call release_idle() themselves
+    pool = WorkerPool(size=1, preload=(), idle_ttl=0)
+    yield pool
+    pool.shutdown()
+
+
+def run(pool, work_dir, code, conversation="chat"):
+    path = work_dir / "block.py"
+    path.write_text(code)
+    return pool.run(conversation, code, str(path), str(work_dir), timeout=30)
+
+
+def test_output_of_child_processes_and_fd_writes_is_kept(pool, tmp_path):
+    code = ("import os, subprocess, sys\n"
+            "print('from print')\n"
+            "os.write(1, b'from fd 1\\n')\n"
+            "os.write(2, b'from fd 2\\n')\n"
+            "subprocess.run([sys.executable, '-c', 'print(\"from a child\")'], check=True)\n")
+    exit_code, output, _, _ = run(pool, tmp_path, code)
+    assert exit_code == 0, output
+    for line in ("from print", "from fd 1", "from fd 2", "from a child"):
+        assert line in output
+
+    # The next block does not get the previous block's output again
+    exit_code, output, _, _ = run(pool, tmp_path, "print('again')")
+    assert output == "again\n"
+
+
+def test_idle_conversations_are_released(pool, tmp_path):
+    run(pool, tmp_path, "x = 1", conversation="idle")
+    run(pool, tmp_path, "y = 2", conversation="busy")
+    assert pool.stats()["conversations"] == 2
+
+    time.sleep(0.2)
+    run(pool, tmp_path, "y += 1", conversation="busy")
+    assert pool.release_idle(idle_ttl=0.1) == 1
+    assert pool.stats()["conversations"] == 1
+    assert pool.stats()["released"] == 1
+
+    # The released conversation starts over, and is told so
+    exit_code, output, _, _ = run(pool, tmp_path, "print('x' in globals())", conversation="idle")
+    assert exit_code == 0
+    assert output == RELEASED_NOTE + "False\n"
+    exit_code, output, _, _ = run(pool, tmp_path, "print(y)", conversation="busy")
+    assert output == "3\n"
+
+
+def test_conversations_do_not_share_modules_path_or_environment(pool, tmp_path):
+    dirs = {}
+    for name in ("a", "b"):
+        dirs[name] = tmp_path / name
+        dirs[name].mkdir()
+        (dirs[name] / "functions.py").write_text(f"SESSION = 'session {name}'\n")
+
+    code = "import functions, os, sys\nprint(functions.SESSION, os.environ.get('TICKER'), sys.path.count(os.getcwd()))"
+    run(pool, dirs["a"], "import os\nos.environ['TICKER'] = 'AAPL'", conversation="a")
+    assert run(pool, dirs["a"], code, conversation="a")[1] == "session a AAPL 1\n"
+    # Same worker, other conversation: its own functions.py, none of a's environment
+    assert run(pool, dirs["b"], code, conversation="b")[1] == "session b None 1\n"
+    assert run(pool, dirs["a"], code, conversation="a")[1] == "session a AAPL 1\n"
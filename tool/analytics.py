@@ -0,0 +1,438 @@
+# Vectorized financial analytics for the Executor's functions module.
+#
+# The Engineer used to write its own pandas code for returns, moving
+# averages, volatility and drawdowns on every run, often looping over tickers
+# and often getting it wrong, and every failure cost an Engineer/Executor
+# round trip. These work on a whole price frame at once (one column per
+# ticker, a date index, NaN where a ticker has no bar) with NumPy array
+# operations: cumulative sums for rolling windows, accumulate for running
+# maxima, matrix products for pairwise statistics and reduceat for resampling.
+#
+# executor_functions() exposes them to the agents the way get_stock_prices is
+# exposed; the Executor's functions module only gets small delegating stubs
+# (autogen copies function source, not modules):
+#
+#     make_executor(functions=[get_stock_prices, plot_stock_prices] + executor_functions())
+#     # in the Engineer's code: from functions import returns, max_drawdown
+#
+# Benchmark against the per-ticker pandas code they replace, checking that
+# the results agree:
+#
+#     python -m tool.analytics --tickers 500 --days 5000
+
+import argparse
+import inspect
+import textwrap
+import time
+
+import numpy as np
+import pandas as pd
+
+PERIODS_PER_YEAR = 252
+RULES = {"W": "W", "W-FRI": "W", "M": "M", "ME": "M", "Q": "Q", "QE": "Q", "Y": "Y", "YE": "Y", "A": "Y"}
+
+
+def _frame(prices):
+    """(float64 values, index, columns, whether `prices` was a Series)."""
+    if isinstance(prices, pd.Series):
+        return prices.to_numpy(dtype="float64")[:, None], prices.index, [prices.name], True
+    prices = pd.DataFrame(prices)
+    return prices.to_numpy(dtype="float64"), prices.index, prices.columns, False
+
+
+def _wrap(values, index, columns, series):
+    if series:
+        return pd.Series(values[:, 0], index=index, name=columns[0])
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def _rolling_sum(values, window):
+    """Sum over the last `window` rows of a 2-D array without NaN."""
+    total = np.cumsum(values, axis=0)
+    total[window:] = total[window:] - total[:-window]
+    return total
+
+
+def _mean_std(values):
+    """Mean and sample standard deviation of each column, skipping NaN (NaN below two values)."""
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(valid, values, 0.0).sum(axis=0) / count
+        deviation = np.where(valid, values - mean, 0.0)
+        std = np.sqrt((deviation * deviation).sum(axis=0) / (count - 1))
+    return np.where(count > 0, mean, np.nan), np.where(count > 1, std, np.nan)
+
+
+def _returns(values, kind="simple", periods=1):
+    out = np.full_like(values, np.nan)
+    if kind == "log":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[periods:] = np.log(values[periods:] / values[:-periods])
+    else:
+        out[periods:] = values[periods:] / values[:-periods] - 1.0
+    return out
+
+
+def returns(prices, kind="simple", periods=1):
+    """Period returns of each column: "simple" (p[t] / p[t-periods] - 1) or "log"."""
+    values, index, columns, series = _frame(prices)
+    if kind not in ("simple", "log"):
+        raise ValueError(f"kind must be 'simple' or 'log', not {kind!r}")
+    return _wrap(_returns(values, kind, periods), index, columns, series)
+
+
+def rolling_stats(prices, window=20, stats=("mean", "std"), min_periods=None):
+    """Rolling "mean", "std", "var", "min", "max" and/or "sum" over `window` rows.
+
+    One stat gives a frame like the input; several give a frame with the stat
+    as the first column level (rolling_stats(prices, 50)["mean"]). NaNs are
+    skipped; a window needs `min_periods` values (default `window`).
+    """
+    values, index, columns, series = _frame(prices)
+    stats = [stats] if isinstance(stats, str) else list(stats)
+    min_periods = window if min_periods is None else min_periods
+    valid = ~np.isnan(values)
+    count = _rolling_sum(valid.astype("float64"), window)
+    # Centred on each column's mean, so the sums of squares do not lose precision
+    offset = np.nan_to_num(_mean_std(values)[0])
+    centred = np.where(valid, values - offset, 0.0)
+    total = _rolling_sum(centred, window)
+    enough = count >= max(min_periods, 1)
+    results = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = total / count
+        if {"var", "std"} & set(stats):
+            var = (_rolling_sum(centred * centred, window) - total * mean) / (count - 1)
+            var = np.where(count > 1, np.maximum(var, 0.0), np.nan)
+    for stat in stats:
+        if stat == "mean":
+            out = mean + offset
+        elif stat == "sum":
+            out = _rolling_sum(np.where(valid, values, 0.0), window)
+        elif stat == "var":
+            out = var
+        elif stat == "std":
+            out = np.sqrt(var)
+        elif stat in ("min", "max"):
+            reduce = np.fmin if stat == "min" else np.fmax
+            out = np.full_like(values, np.nan)
+            if len(values) >= window:
+                windows = np.lib.stride_tricks.sliding_window_view(values, window, axis=0)
+                out[window - 1:] = reduce.reduce(windows, axis=-1)
+            # The first rows have shorter windows
+            head = reduce.accumulate(values[:window - 1], axis=0)
+            out[:window - 1] = head
+        else:
+            raise ValueError(f"Unknown stat {stat!r}")
+        results[stat] = _wrap(np.where(enough, out, np.nan), index, columns, series)
+    if len(stats) == 1:
+        return results[stats[0]]
+    return pd.concat(results, axis=1)
+
+
+def volatility(prices, window=21, periods_per_year=PERIODS_PER_YEAR):
+    """Annualized volatility of log returns: rolling over `window` rows, or one value per column if window is None."""
+    values, index, columns, series = _frame(prices)
+    log_returns = _returns(values, "log")
+    if window is None:
+        out = _mean_std(log_returns)[1] * np.sqrt(periods_per_year)
+        return pd.Series(out, index=columns, name="volatility") if not series else float(out[0])
+    std = rolling_stats(_wrap(log_returns, index, columns, series), window, "std")
+    return std * np.sqrt(periods_per_year)
+
+
+def drawdowns(prices):
+    """Drawdown of each column from its running peak (0 at a new high, -0.25 a quarter below it)."""
+    values, index, columns, series = _frame(prices)
+    peak = np.fmax.accumulate(values, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return _wrap(values / peak - 1.0, index, columns, series)
+
+
+def max_drawdown(prices):
+    """Per column: the deepest drawdown, the peak and trough dates, and the recovery date (NaT if none)."""
+    values, index, columns, _ = _frame(prices)
+    dates = pd.Index(index)
+    empty = ~(~np.isnan(values)).any(axis=0) if len(values) else np.ones(values.shape[1], dtype=bool)
+    if empty.all():
+        missing = [pd.NaT] * values.shape[1]
+        return pd.DataFrame({"max_drawdown": np.nan, "peak": missing, "trough": missing, "recovery": missing},
+                            index=pd.Index(columns, name="ticker"))
+    rows = np.arange(len(values))[:, None]
+    cols = np.arange(values.shape[1])
+    peak = np.fmax.accumulate(values, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        depth = values / peak - 1.0
+    trough = np.argmin(np.where(np.isnan(depth), np.inf, depth), axis=0)
+    # Row of the running peak at each row: the last row so far at the running maximum
+    peak_row = np.maximum.accumulate(np.where(values == peak, rows, 0), axis=0)[trough, cols]
+    # Recovery: the first row after the trough back at the peak's level
+    recovered = (values >= peak[trough, cols]) & (rows > trough)
+    recovery_row = np.argmax(recovered, axis=0)
+    return pd.DataFrame({
+        "max_drawdown": np.where(empty, np.nan, depth[trough, cols]),
+        "peak": dates.take(peak_row).where(~empty),
+        "trough": dates.take(trough).where(~empty),
+        "recovery": dates.take(recovery_row).where(~empty & recovered.any(axis=0)),
+    }, index=pd.Index(columns, name="ticker"))
+
+
+def beta(prices, benchmark, window=None):
+    """Beta of each column's returns against `benchmark` (a column name or a price Series).
+
+    Over the whole period (one value per column) or rolling over `window` rows.
+    Only rows where both returns exist count.
+    """
+    values, index, columns, series = _frame(prices)
+    if isinstance(benchmark, str) or not hasattr(benchmark, "__len__"):
+        market = pd.DataFrame(prices)[benchmark].to_numpy(dtype="float64")
+    else:
+        market = pd.Series(benchmark).reindex(index).to_numpy(dtype="float64")
+    r, m = _returns(values, "simple"), _returns(market[:, None], "simple")
+    both = ~np.isnan(r) & ~np.isnan(m)
+    r, m, n = np.where(both, r, 0.0), np.where(both, m, 0.0), both.astype("float64")
+
+    def sums(x):
+        return x.sum(axis=0) if window is None else _rolling_sum(x, window)
+
+    count, sum_r, sum_m = sums(n), sums(r), sums(m)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sums(r * m) - sum_r * sum_m / count
+        var = sums(m * m) - sum_m * sum_m / count
+        out = np.where(count > 1, cov / var, np.nan)
+    if window is None:
+        return pd.Series(out, index=columns, name="beta") if not series else float(out[0])
+    return _wrap(np.where(count >= window, out, np.nan), index, columns, series)
+
+
+def sharpe_ratio(prices, risk_free=0.0, periods_per_year=PERIODS_PER_YEAR):
+    """Annualized Sharpe ratio of each column's simple returns; `risk_free` is an annual rate."""
+    values, index, columns, series = _frame(prices)
+    excess = _returns(values, "simple") - ((1.0 + risk_free) ** (1.0 / periods_per_year) - 1.0)
+    mean, std = _mean_std(excess)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = mean / std * np.sqrt(periods_per_year)
+    return pd.Series(out, index=columns, name="sharpe") if not series else float(out[0])
+
+
+def correlation_matrix(prices, on="returns"):
+    """Pearson correlations between the columns' returns (or "prices"), over the rows both have."""
+    values, _, columns, _ = _frame(prices)
+    x = _returns(values, "simple") if on == "returns" else values
+    valid = (~np.isnan(x)).astype("float64")
+    x = np.where(valid > 0, x, 0.0)
+    # Pairwise sums over the rows where both columns have a value, as matrix products
+    n = valid.T @ valid
+    sum_x = x.T @ valid  # [i, j]: sum of column i over the rows column j has too
+    sum_xx = (x * x).T @ valid
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = x.T @ x - sum_x * sum_x.T / n
+        var_i = sum_xx - sum_x * sum_x / n
+        corr = cov / np.sqrt(var_i * var_i.T)
+    corr = np.where(n > 1, np.clip(corr, -1.0, 1.0), np.nan)
+    return pd.DataFrame(corr, index=columns, columns=columns)
+
+
+def _period_keys(index, rule):
+    days = np.asarray(index, dtype="datetime64[D]").astype("int64")
+    if rule == "W":
+        # 1970-01-01 was a Thursday; weeks start on Monday
+        return (days + 3) // 7
+    months = np.asarray(index, dtype="datetime64[M]").astype("int64")
+    if rule == "M":
+        return months
+    if rule == "Q":
+        return months // 3
+    return months // 12
+
+
+def resample_prices(prices, rule="M", how="last"):
+    """Prices per week ("W"), month ("M"), quarter ("Q") or year ("Y").
+
+    `how` is "last" (each column's last price in the period), "first", "mean",
+    "sum", "max" or "min". Periods are labelled with their last trading day.
+    """
+    values, index, columns, series = _frame(prices)
+    if rule not in RULES:
+        raise ValueError(f"rule must be one of {sorted(RULES)}, not {rule!r}")
+    if not len(values):
+        return _wrap(values, index, columns, series)
+    keys = _period_keys(index, RULES[rule])
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(values)] - 1
+    valid = ~np.isnan(values)
+    rows = np.arange(len(values))[:, None]
+    if how in ("last", "first"):
+        if how == "last":
+            # Last row with a value so far, and whether it falls in the same period
+            seen = np.maximum.accumulate(np.where(valid, rows, -1), axis=0)[ends]
+            in_period = seen >= starts[:, None]
+        else:
+            later = np.where(valid, rows, len(values))
+            seen = np.minimum.accumulate(later[::-1], axis=0)[::-1][starts]
+            in_period = seen <= ends[:, None]
+        picked = values[np.clip(seen, 0, len(values) - 1), np.arange(values.shape[1])]
+        out = np.where(in_period, picked, np.nan)
+    elif how in ("sum", "mean"):
+        total = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+        count = np.add.reduceat(valid.astype("float64"), starts, axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out = np.where(count > 0, total / count if how == "mean" else total, np.nan)
+    elif how in ("max", "min"):
+        out = (np.fmax if how == "max" else np.fmin).reduceat(values, starts, axis=0)
+    else:
+        raise ValueError(f"Unknown how {how!r}")
+    return _wrap(out, index[ends], columns, series)
+
+
+def performance_summary(prices, risk_free=0.0, periods_per_year=PERIODS_PER_YEAR):
+    """One row per column: first and last date, total return, CAGR, volatility, Sharpe and max drawdown."""
+    values, index, columns, _ = _frame(prices)
+    if not len(values):
+        return pd.DataFrame(index=pd.Index(columns, name="ticker"),
+                            columns=["start", "end", "total_return", "cagr", "volatility", "sharpe", "max_drawdown"])
+    valid = ~np.isnan(values)
+    cols = np.arange(values.shape[1])
+    first = np.argmax(valid, axis=0)
+    last = len(values) - 1 - np.argmax(valid[::-1], axis=0)
+    empty = ~valid.any(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        total = values[last, cols] / values[first, cols] - 1.0
+        years = (last - first) / periods_per_year
+        cagr = np.where(years > 0, (1.0 + total) ** (1.0 / years) - 1.0, np.nan)
+    frame = pd.DataFrame(values, index=index, columns=columns)
+    summary = pd.DataFrame({
+        "start": pd.Index(index).take(first).where(~empty),
+        "end": pd.Index(index).take(last).where(~empty),
+        "total_return": np.where(empty, np.nan, total),
+        "cagr": np.where(empty, np.nan, cagr),
+        "volatility": volatility(frame, window=None, periods_per_year=periods_per_year).to_numpy(),
+        "sharpe": sharpe_ratio(frame, risk_free, periods_per_year).to_numpy(),
+        "max_drawdown": max_drawdown(frame)["max_drawdown"].to_numpy(),
+    }, index=pd.Index(columns, name="ticker"))
+    return summary
+
+
+FUNCTIONS = [returns, rolling_stats, volatility, drawdowns, max_drawdown, beta, sharpe_ratio,
+             correlation_matrix, resample_prices, performance_summary]
+
+
+def _stub(func):
+    # What goes into the functions module: same signature and docstring, delegating here
+    signature = inspect.signature(func)
+    arguments = ", ".join(f"{name}={name}" for name in signature.parameters)
+    docstring = textwrap.indent(f'"""{inspect.getdoc(func)}\n"""', "    ")
+    return (f"def {func.__name__}{signature}:\n"
+            f"{docstring}\n"
+            f"    from tool.analytics import {func.__name__} as implementation\n"
+            f"    return implementation({arguments})\n")
+
+
+def executor_functions():
+    """The analytics as functions for a code executor (make_executor(functions=...))."""
+    from autogen.coding.func_with_reqs import FunctionWithRequirementsStr
+
+    return [FunctionWithRequirementsStr(_stub(func)) for func in FUNCTIONS]
+
+
+# What an agent writes without them: one ticker at a time, in pandas
+
+def _baseline_rolling(prices, window):
+    return pd.concat({"mean": pd.DataFrame({c: prices[c].rolling(window).mean() for c in prices}),
+                      "std": pd.DataFrame({c: prices[c].rolling(window).std() for c in prices})}, axis=1)
+
+
+def _baseline_max_drawdown(prices):
+    depth = {}
+    for column in prices:
+        worst, peak = 0.0, -np.inf
+        for price in prices[column].dropna():
+            peak = max(peak, price)
+            worst = min(worst, price / peak - 1.0)
+        depth[column] = worst
+    return pd.Series(depth)
+
+
+def _baseline_beta(prices, benchmark):
+    r = prices / prices.shift(1) - 1
+    return pd.Series({c: r[c].cov(r[benchmark]) / r[benchmark][r[c].notna()].var() for c in prices})
+
+
+def _baseline_sharpe(prices):
+    r = prices / prices.shift(1) - 1
+    return pd.Series({c: r[c].mean() / r[c].std() * np.sqrt(PERIODS_PER_YEAR) for c in prices})
+
+
+BENCHMARKS = [
+    # name, ours, baseline, how to compare (ours, baseline) -> (ours, baseline) arrays
+    ("returns", lambda p: returns(p), lambda p: pd.DataFrame({c: p[c] / p[c].shift(1) - 1 for c in p}), None),
+    ("rolling_stats", lambda p: rolling_stats(p, 50), lambda p: _baseline_rolling(p, 50), None),
+    ("volatility", lambda p: volatility(p, 21),
+     lambda p: pd.DataFrame({c: np.log(p[c] / p[c].shift(1)).rolling(21).std() * np.sqrt(PERIODS_PER_YEAR)
+                             for c in p}), None),
+    ("drawdowns", lambda p: drawdowns(p), lambda p: pd.DataFrame({c: p[c] / p[c].cummax() - 1 for c in p}), None),
+    ("max_drawdown", lambda p: max_drawdown(p), _baseline_max_drawdown,
+     lambda ours, base: (ours["max_drawdown"], base)),
+    ("beta", lambda p: beta(p, p.columns[0]), lambda p: _baseline_beta(p, p.columns[0]), None),
+    ("sharpe_ratio", lambda p: sharpe_ratio(p), _baseline_sharpe, None),
+    ("correlation_matrix", lambda p: correlation_matrix(p), lambda p: (p / p.shift(1) - 1).corr(), None),
+    ("resample_prices", lambda p: resample_prices(p, "M"), lambda p: p.resample("ME").last(),
+     lambda ours, base: (ours.to_numpy(), base.dropna(how="all").to_numpy())),
+    ("performance_summary", lambda p: performance_summary(p), None, None),
+]
+
+
+def synthetic_prices(tickers=100, days=2500, seed=0):
+    """Random-walk closes on business days; a third of the tickers list partway through."""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range("2000-01-03", periods=days, name="Date")
+    steps = rng.normal(0.0003, 0.02, size=(days, tickers))
+    values = 100.0 * np.exp(np.cumsum(steps, axis=0))
+    listed = rng.integers(0, days // 2, size=tickers)
+    listed[: tickers - tickers // 3] = 0
+    values[np.arange(days)[:, None] < listed] = np.nan
+    return pd.DataFrame(values, index=index, columns=[f"T{i:04d}" for i in range(tickers)])
+
+
+def _timed(fn, prices, repeat):
+    best, result = np.inf, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(prices)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def bench(tickers=100, days=2500, repeat=3, skip_baseline=()):
+    prices = synthetic_prices(tickers, days)
+    rows = []
+    for name, ours, baseline, compare in BENCHMARKS:
+        seconds, result = _timed(ours, prices, repeat)
+        row = {"function": name, "ms": seconds * 1000, "baseline_ms": None, "speedup": None, "max_diff": None}
+        if baseline is not None and name not in skip_baseline:
+            base_seconds, expected = _timed(baseline, prices, 1 if name == "max_drawdown" else repeat)
+            left, right = compare(result, expected) if compare else (result, expected)
+            left, right = np.asarray(left, dtype="float64"), np.asarray(right, dtype="float64")
+            both = ~np.isnan(left) & ~np.isnan(right)
+            row.update(baseline_ms=base_seconds * 1000, speedup=base_seconds / seconds,
+                       # NaN in one and not the other counts as a mismatch
+                       max_diff=float(np.max(np.abs(left[both] - right[both]), initial=0.0))
+                       if np.array_equal(np.isnan(left), np.isnan(right)) else float("inf"))
+        rows.append(row)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the analytics against per-ticker pandas code")
+    parser.add_argument("--tickers", type=int, default=100)
+    parser.add_argument("--days", type=int, default=2500)
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    args = parser.parse_args()
+
+    print(f"{args.tickers} tickers x {args.days} days")
+    print(f"{'function':<22}{'ms':>10}{'baseline ms':>14}{'speedup':>10}{'max diff':>12}")
+    for row in bench(args.tickers, args.days, args.repeat):
+        baseline = f"{row['baseline_ms']:14.1f}{row['speedup']:9.1f}x{row['max_diff']:12.2e}" \
+            if row["baseline_ms"] is not None else ""
+        print(f"{row['function']:<22}{row['ms']:10.1f}{baseline}")
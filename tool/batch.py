@@ -0,0 +1,244 @@
+# Headless batch runs: one pipeline over a file of tasks, no UI.
+#
+#     python -m tool.batch tasks.jsonl --out reports --concurrency 8 --timeout 1200
+#     python -m tool.batch tickers.csv --template "Write a financial report on {ticker}"
+#
+# The task file is JSONL (one {"id": ..., "task": ...} object, or a plain
+# string, per line) or CSV with a header row. Rows without a "task" are
+# formatted into --template, so a CSV of tickers is enough. Every task gets a
+# fresh session of the pipeline (the report team by default, see PIPELINES in
+# tool/jobs.py) with its own code work dir, and up to `concurrency` of them
+# run at once on the shared loop. A task that runs past `timeout` seconds is
+# cancelled. Each task writes to <out>/<id>/:
+#
+#     report.md       the Writer's last report
+#     work/           the files the Executor's code created (charts, tables)
+#     messages.jsonl  the conversation
+#     result.json     status, timings, rounds, tokens, cost and checkpoint run id
+#
+# and the batch writes its throughput report to <out>/summary.json. Tasks
+# whose result.json says "done" are skipped on the next invocation, so an
+# interrupted overnight batch picks up where it stopped (--force reruns them).
+#
+#     from tool.batch import read_tasks, run_batch
+#     summary = run_batch(read_tasks("tasks.jsonl"), "reports", concurrency=8)
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+import shutil
+import time
+
+from tool.checkpoints import SKIPPED_PREFIXES
+from tool.jobs import load_pipeline
+from tool.loop import ChatRun, submit
+from tool.metrics import percentile
+from tool.streaming import quiet_token_stream
+from tool.transcript import parse
+
+DEFAULT_CONFIG = {"model": "gpt-4o-mini", "temperature": 0, "seed": 1234}
+REPORT_LANGUAGES = ("md", "markdown")
+
+
+def read_tasks(path, template=None):
+    """[{"id", "task", ...}] from a JSONL or CSV task file."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    tasks, seen = [], set()
+    for i, row in enumerate(rows):
+        row = {"task": row} if isinstance(row, str) else dict(row)
+        if not row.get("task"):
+            if template is None:
+                raise ValueError(f"{path}: row {i + 1} has no task and there is no template")
+            row["task"] = template.format(**row)
+        # Ids name the output directories
+        task_id = re.sub(r"[^\w.-]+", "_", str(row.get("id") or row.get("ticker") or f"task-{i + 1:04d}"))
+        if task_id in seen:
+            task_id = f"{task_id}-{i + 1}"
+        seen.add(task_id)
+        row["id"] = task_id
+        tasks.append(row)
+    return tasks
+
+
+def final_report(messages, writer="Writer"):
+    """The markdown of the last report `writer` sent, or None."""
+    for message in reversed(messages):
+        if message.get("name") != writer or not message.get("content"):
+            continue
+        blocks = parse(message["content"])
+        reports = [block[2] for block in blocks if block[0] == "code" and block[1] in REPORT_LANGUAGES]
+        # The Writer is asked for a ```md``` block; take the whole message if it did not use one
+        return reports[-1] if reports else message["content"].replace("TERMINATE", "").strip()
+    return None
+
+
+def _done(directory):
+    try:
+        with open(os.path.join(directory, "result.json"), encoding="utf-8") as f:
+            return json.load(f).get("status") == "done"
+    except (OSError, ValueError):
+        return False
+
+
+def _write_json(path, data):
+    with open(path + ".part", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(path + ".part", path)
+
+
+class Batch:
+    """Runs tasks through one pipeline engine, `concurrency` at a time."""
+
+    def __init__(self, out, pipeline="report", config=None, concurrency=4, timeout=None, writer="Writer"):
+        self.out = out
+        self.pipeline = pipeline
+        self.config = dict(config or DEFAULT_CONFIG)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.writer = writer
+        self.results = []
+        self._finished = 0
+        self._total = 0
+
+    async def run(self, tasks, force=False):
+        """Run `tasks`; returns the throughput summary (also written to <out>/summary.json)."""
+        os.makedirs(self.out, exist_ok=True)
+        _, build = load_pipeline(self.pipeline)
+        # Built once: the agents' definitions and OpenAI clients are shared by every task
+        engine = build(**self.config)
+        todo = [task for task in tasks if force or not _done(os.path.join(self.out, task["id"]))]
+        self._total = len(todo)
+        slots = asyncio.Semaphore(self.concurrency)
+        started = time.time()
+        self.results = await asyncio.gather(*(self._task(engine, task, slots) for task in todo))
+        summary = self.summary(time.time() - started, skipped=len(tasks) - len(todo))
+        _write_json(os.path.join(self.out, "summary.json"), summary)
+        return summary
+
+    async def _task(self, engine, task, slots):
+        async with slots:
+            directory = os.path.join(self.out, task["id"])
+            work_dir = os.path.join(directory, "work")
+            if os.path.isdir(work_dir):
+                # Left over from an earlier attempt
+                shutil.rmtree(work_dir)
+            os.makedirs(work_dir)
+            session = engine.new_session(work_dir=work_dir)
+            run = ChatRun(task=task["task"], context=quiet_token_stream)
+            run.id = task["id"]
+            chat = session.a_initiate_chat(message=f"Admin initiated the task: {task['task']}")
+            try:
+                await asyncio.wait_for(run._main(chat), self.timeout)
+                status = run.status
+            except asyncio.TimeoutError:
+                status = "timeout"
+            finally:
+                for agent in session.agents.values():
+                    if hasattr(agent.code_executor, "restart"):
+                        # Free the task's variables on the worker pool
+                        agent.code_executor.restart()
+            result = self._save(directory, task, session, run, status)
+        self._finished += 1
+        print(f"[batch] {self._finished}/{self._total} {task['id']}: {result['status']} in {result['seconds']:.0f}s, "
+              f"{result['rounds']} rounds" + (f" ({result['error']})" if result["error"] else ""), flush=True)
+        return result
+
+    def _save(self, directory, task, session, run, status):
+        messages = run.messages
+        report = final_report(messages, self.writer)
+        if status == "done" and report is None:
+            status = "no report"
+        if report is not None:
+            with open(os.path.join(directory, "report.md"), "w", encoding="utf-8") as f:
+                f.write(report + "\n")
+        with open(os.path.join(directory, "messages.jsonl"), "w", encoding="utf-8") as f:
+            for message in messages:
+                f.write(json.dumps(message, default=str) + "\n")
+        rounds = list(session.metrics.rounds) if session.metrics is not None else []
+        work_dir = os.path.join(directory, "work")
+        artifacts = sorted(os.path.relpath(os.path.join(base, name), work_dir)
+                           for base, _, names in os.walk(work_dir) for name in names
+                           if not name.startswith(SKIPPED_PREFIXES) and "__pycache__" not in base)
+        result = {
+            "id": task["id"],
+            "task": task["task"],
+            "status": status,
+            "error": str(run.error) if run.error is not None else None,
+            "seconds": (run.finished or time.time()) - (run.started or time.time()),
+            "messages": len(messages),
+            "rounds": len(rounds),
+            "llm_calls": sum(r["llm_calls"] for r in rounds),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in rounds),
+            "completion_tokens": sum(r["completion_tokens"] for r in rounds),
+            "cost": sum(r["cost"] for r in rounds),
+            "exec_time": sum(r["exec_time"] for r in rounds),
+            "ttft": {name: sum(values) / len(values) for name, values in run.ttft.items()},
+            "artifacts": artifacts,
+            # tool/checkpoints.py can resume a timed out or failed run from here
+            "run_id": session.run_id,
+        }
+        _write_json(os.path.join(directory, "result.json"), result)
+        return result
+
+    def summary(self, wall_time, skipped=0):
+        """Throughput and totals of the tasks run by this batch."""
+        results = self.results
+        seconds = [r["seconds"] for r in results]
+        statuses = {}
+        for r in results:
+            statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+        rounds = sum(r["rounds"] for r in results)
+        return {
+            "pipeline": self.pipeline,
+            "config": self.config,
+            "concurrency": self.concurrency,
+            "timeout": self.timeout,
+            "tasks": len(results),
+            "skipped": skipped,
+            "statuses": statuses,
+            "wall_time": round(wall_time, 1),
+            "tasks_per_hour": round(len(results) / wall_time * 3600, 1) if wall_time else 0.0,
+            "task_seconds": {"p50": round(percentile(seconds, 0.5), 1), "p95": round(percentile(seconds, 0.95), 1),
+                             "max": round(max(seconds, default=0.0), 1)},
+            "rounds": rounds,
+            "rounds_per_minute": round(rounds / wall_time * 60, 1) if wall_time else 0.0,
+            "prompt_tokens": sum(r["prompt_tokens"] for r in results),
+            "completion_tokens": sum(r["completion_tokens"] for r in results),
+            "cost": round(sum(r["cost"] for r in results), 4),
+        }
+
+
+def run_batch(tasks, out, force=False, **kwargs):
+    """Run `tasks` (see read_tasks) from any thread; returns the summary. kwargs go to Batch."""
+    return submit(Batch(out, **kwargs).run(tasks, force=force)).result()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a pipeline over a JSONL/CSV task file without a UI")
+    parser.add_argument("tasks", help="JSONL or CSV task file")
+    parser.add_argument("--out", default="batch_output", help="output directory")
+    parser.add_argument("--template", help='task for rows without one, e.g. "Write a financial report on {ticker}"')
+    parser.add_argument("--pipeline", default="report")
+    parser.add_argument("--config", default=json.dumps(DEFAULT_CONFIG), help="llm_config as JSON")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, help="seconds per task")
+    parser.add_argument("--force", action="store_true", help="rerun tasks that are done already")
+    args = parser.parse_args()
+
+    tasks = read_tasks(args.tasks, args.template)
+    future = submit(Batch(args.out, pipeline=args.pipeline, config=json.loads(args.config),
+                          concurrency=args.concurrency, timeout=args.timeout).run(tasks, force=args.force))
+    try:
+        summary = future.result()
+    except KeyboardInterrupt:
+        future.cancel()
+        print("[batch] interrupted; finished tasks are kept, run again to do the rest")
+    else:
+        print(json.dumps(summary, indent=2))
@@ -0,0 +1,286 @@
+# Benchmarks of whole group-chat runs against a local mock LLM.
+#
+# Starts tool/mock_llm.py on a free port, points the OpenAI clients at it
+# (OPENAI_BASE_URL) and runs the agent graphs of autogen_st_3.py,
+# autogen_st_4.py and autogen_panel_2.py end to end: rule-based and LLM
+# speaker selection, streaming, compaction, metrics, checkpoints, the event
+# bus and real code execution on the worker pool. Only the LLM is scripted,
+# with a fixed latency to the first token and token rate, so what is left of a
+# run's time is ours:
+#
+#     python -m tool.bench --runs 5 --latency 0.05 --tokens-per-second 500
+#     python -m tool.bench --graphs st_3 --runs 20 --concurrency 4 --out bench_st_3.json
+#
+# Per graph it reports rounds/sec, end-to-end latency (p50/p95), framework
+# overhead per round (run time not spent in the mock LLM or in executed code),
+# UI overhead per round (time the front end's event handler spends on the
+# run's events) and this process's memory growth over the runs. The results, with the
+# settings and commit they were taken at, go to a JSON file (--out) for
+# regression tracking. LLM and code execution caches are bypassed; every call
+# reaches the mock and every code block runs.
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+from tool.checkpoints import Checkpoints
+from tool.events import MESSAGE, SPEAKER, TOKEN, get_bus
+from tool.jobs import load_pipeline
+from tool.llm_cache import NoCache
+from tool.loop import ChatRun, submit
+from tool.metrics import ChatMetrics, Registry, percentile
+from tool.mock_llm import MockLLM, Script
+from tool.streaming import PanelSink, quiet_token_stream
+from tool.transcript import Transcript
+from tool.worker_pool import rss_mb
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TASK = "Write a financial report on the simulated stock prices"
+
+# Graph name -> (builder, its arguments, the UI whose overhead is measured)
+GRAPHS = {
+    "st_3": ("report_team:build_engine", {"model": "gpt-4o-mini", "temperature": 0, "seed": 1234}, "streamlit"),
+    "st_4": ("st_4_team:build_engine", {"model": "gpt-4o-mini", "temperature": 0, "seed": 1234}, "streamlit"),
+    "panel_2": ("panel_2_team:build_engine", {"model": "gpt-4-turbo", "human_input_mode": "NEVER"}, "panel"),
+}
+
+
+class StreamlitUI:
+    # What the Streamlit apps do per message between reruns (tool/transcript.py)
+    def __init__(self):
+        self.transcript = Transcript()
+
+    def __call__(self, event):
+        if event.kind == MESSAGE:
+            self.transcript.update([{"name": event.name, "content": event.content}])
+            self.transcript.window()
+
+
+def _panel_ui():
+    # The Panel apps' sink on a ChatInterface that is not served
+    try:
+        import panel as pn
+    except ImportError:
+        return None
+    return PanelSink(pn.chat.ChatInterface(), {})
+
+
+class _Timed:
+    def __init__(self, handler):
+        self.handler = handler
+        self.seconds = 0.0
+
+    def __call__(self, event):
+        started = time.perf_counter()
+        self.handler(event)
+        self.seconds += time.perf_counter() - started
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _quantiles(values):
+    return {"p50": round(percentile(values, 0.5), 3), "p95": round(percentile(values, 0.95), 3),
+            "max": round(max(values, default=0.0), 3)}
+
+
+def isolate(engine, app, directory):
+    """Keep `engine` off the apps' caches: no LLM cache, and metrics and run logs under `directory`."""
+    engine.cache = NoCache()
+    engine.metrics = ChatMetrics(app, registry=Registry(os.path.join(directory, "metrics")))
+    if engine.checkpoints is not None:
+        engine.checkpoints = Checkpoints(os.path.join(directory, "runs"))
+    # Not recorded either (RECORD_RUNS, tool/replay.py)
+    engine.recorder = None
+    return engine
+
+
+@contextmanager
+def environ(**values):
+    """Set environment variables for the duration, then put back the old values (or unset them)."""
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+class GraphBench:
+    """Runs one graph's engine against the mock and collects per-run numbers."""
+
+    def __init__(self, name, mock, directory):
+        builder, config, self.ui = GRAPHS[name]
+        self.name = name
+        self.mock = mock
+        self.directory = directory
+        _, build = load_pipeline(builder)
+        self.engine = isolate(build(**config), f"bench_{name}", directory)
+        self.runs = 0
+
+    def _ui_handler(self):
+        if self.ui == "streamlit":
+            return StreamlitUI()
+        return _panel_ui()
+
+    async def run_one(self):
+        self.runs += 1
+        session = self.engine.new_session(work_dir=os.path.join(self.directory, f"{self.name}-{self.runs}"))
+        self.mock.script.learn(session.agents.values())
+        run = ChatRun(task=TASK, context=quiet_token_stream)
+        handler = self._ui_handler()
+        ui = _Timed(handler) if handler is not None else None
+        bus = get_bus()
+        subscription = None
+        if ui is not None:
+            subscription = bus.subscribe(ui, kinds=(MESSAGE, SPEAKER, TOKEN), run=run, threaded=True,
+                                         name=f"bench {self.ui}")
+        try:
+            # _main drains the UI's queue before it returns
+            await run._main(session.a_initiate_chat(message=f"Admin initiated the task: {TASK}"))
+        finally:
+            if subscription is not None:
+                bus.unsubscribe(subscription)
+            for agent in session.agents.values():
+                if hasattr(agent.code_executor, "restart"):
+                    agent.code_executor.restart()
+        rounds = list(session.metrics.rounds)
+        ttft = [value for values in run.ttft.values() for value in values]
+        return {
+            "status": run.status,
+            "error": str(run.error) if run.error is not None else None,
+            "seconds": (run.finished or time.time()) - (run.started or time.time()),
+            "rounds": len(rounds),
+            "exec_seconds": sum(r["exec_time"] for r in rounds),
+            "ui_seconds": ui.seconds if ui is not None else None,
+            "ttft": sum(ttft) / len(ttft) if ttft else None,
+        }
+
+    async def measure(self, runs, warmup=0, concurrency=1):
+        for _ in range(warmup):
+            # Worker pool start, imports and first connections
+            await self.run_one()
+        gc.collect()
+        memory = [rss_mb()]
+        before = self.mock.stats()
+        started = time.perf_counter()
+        results = []
+        for start in range(0, runs, concurrency):
+            results += await asyncio.gather(*(self.run_one() for _ in range(min(concurrency, runs - start))))
+            gc.collect()
+            memory.append(rss_mb())
+        wall = time.perf_counter() - started
+        after = self.mock.stats()
+        return self.report(results, wall, memory, before, after, concurrency)
+
+    def report(self, results, wall, memory, before, after, concurrency):
+        rounds = sum(r["rounds"] for r in results)
+        seconds = [r["seconds"] for r in results]
+        llm_seconds = after["busy_seconds"] - before["busy_seconds"]
+        exec_seconds = sum(r["exec_seconds"] for r in results)
+        ui_seconds = [r["ui_seconds"] for r in results if r["ui_seconds"] is not None]
+        ttft = [r["ttft"] for r in results if r["ttft"] is not None]
+        failed = [r for r in results if r["status"] != "done"]
+
+        def per_round(total):
+            return round(total / rounds * 1000, 3) if rounds else None
+
+        return {
+            "runs": len(results),
+            "failed": len(failed),
+            "first_error": next((r["error"] for r in failed if r["error"]), None),
+            "concurrency": concurrency,
+            "rounds": rounds,
+            "rounds_per_run": round(rounds / len(results), 1) if results else 0,
+            "wall_seconds": round(wall, 3),
+            "rounds_per_second": round(rounds / wall, 3) if wall else None,
+            "latency_seconds": _quantiles(seconds),
+            "llm_requests": after["requests"] - before["requests"],
+            "llm_seconds": round(llm_seconds, 3),
+            "exec_seconds": round(exec_seconds, 3),
+            # Summed over runs, so this holds with concurrent runs as well
+            "framework_overhead_per_round_ms": per_round(sum(seconds) - llm_seconds - exec_seconds),
+            "ui": self.ui if ui_seconds else None,
+            "ui_overhead_per_round_ms": per_round(sum(ui_seconds)) if ui_seconds else None,
+            "ttft_seconds": round(sum(ttft) / len(ttft), 4) if ttft else None,
+            "memory_mb": {"start": round(memory[0], 1), "end": round(memory[-1], 1),
+                          "growth": round(memory[-1] - memory[0], 1),
+                          "growth_per_run": round((memory[-1] - memory[0]) / len(results), 3) if results else 0},
+        }
+
+
+async def bench(graphs, runs, warmup, concurrency, mock, directory):
+    results = {}
+    for name in graphs:
+        graph = GraphBench(name, mock, directory)
+        results[name] = await graph.measure(runs, warmup=warmup, concurrency=concurrency)
+        print(f"[bench] {name}: {results[name]['rounds_per_second']} rounds/s, "
+              f"p50 {results[name]['latency_seconds']['p50']}s per run, "
+              f"{results[name]['framework_overhead_per_round_ms']} ms overhead/round, "
+              f"{results[name]['ui_overhead_per_round_ms']} ms UI/round, "
+              f"+{results[name]['memory_mb']['growth']} MB", flush=True)
+    return results
+
+
+def main(graphs=tuple(GRAPHS), runs=5, warmup=1, concurrency=1, latency=0.05, tokens_per_second=500.0,
+         out="bench_results.json", keep=False):
+    """Run the benchmarks and write the results to `out`; returns them."""
+    directory = tempfile.mkdtemp(prefix="bench-")
+    with MockLLM(Script(), latency=latency, tokens_per_second=tokens_per_second) as mock:
+        # The engines' OpenAI clients are created when they are built, so before that;
+        # EXEC_CACHE=0: every run executes its code (tool/exec_cache.py)
+        try:
+            with environ(OPENAI_BASE_URL=mock.url, OPENAI_API_KEY="mock", EXEC_CACHE="0"):
+                graph_results = submit(bench(graphs, runs, warmup, concurrency, mock, directory)).result()
+        finally:
+            if not keep:
+                shutil.rmtree(directory, ignore_errors=True)
+        results = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {"runs": runs, "warmup": warmup, "concurrency": concurrency, "latency": latency,
+                         "tokens_per_second": tokens_per_second,
+                         "executor": os.environ.get("CODE_EXECUTOR", "pool")},
+            "mock": mock.stats(),
+            "graphs": graph_results,
+        }
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the agent graphs against a local mock LLM")
+    parser.add_argument("--graphs", nargs="+", choices=list(GRAPHS), default=list(GRAPHS))
+    parser.add_argument("--runs", type=int, default=5, help="measured runs per graph")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured runs per graph first")
+    parser.add_argument("--concurrency", type=int, default=1, help="runs at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock seconds to the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=500.0, help="mock token rate")
+    parser.add_argument("--out", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--keep", action="store_true", help="keep the work dirs, run logs and metrics")
+    args = parser.parse_args()
+
+    results = main(args.graphs, args.runs, args.warmup, args.concurrency, args.latency, args.tokens_per_second,
+                   args.out, args.keep)
+    print(f"Results written to {args.out}")
@@ -0,0 +1,257 @@
+# Durable, resumable group-chat runs.
+#
+# Every message an agent sends to the manager is appended to a per-run log,
+# .cache/runs/<run id>/log.jsonl (or CHECKPOINT_DIR), together with the
+# speaker and the files the Executor's code created or changed in that round.
+# Changed files are copied into the run's artifacts/ directory, named by
+# content hash. Each line is flushed and fsynced before the chat moves on,
+# so a run that dies at round 38 can pick up at round 38:
+#
+#     chat = engine.new_session()
+#     await chat.a_resume(run_id)                    # carry on where it stopped
+#     await chat.a_resume(run_id, upto=12)           # or from an earlier round
+#     await chat.a_resume(run_id, message="Shorter") # with Admin feedback
+#
+# Resuming rebuilds groupchat.messages and every agent's history through
+# GroupChatManager.a_resume() and restores the logged artifacts into the work
+# dir; no LLM call is repeated. Log lines are {"type": "start" | "round" |
+# "resume", ...}. A "resume" line with `upto` drops the rounds after it, so
+# the log can branch from any checkpoint; a "start" line begins it over.
+#
+#     python -m tool.checkpoints [run id]   # list runs, or show one
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DIR = os.environ.get("CHECKPOINT_DIR", os.path.join(ROOT, ".cache", "runs"))
+MAX_ARTIFACT_BYTES = 50 * 1024 * 1024
+# Generated code files and bookkeeping are not artifacts
+SKIPPED_PREFIXES = ("tmp_code_", "functions.py", "__pycache__")
+MESSAGE_FIELDS = ("content", "role", "name", "tool_calls", "function_call", "tool_responses")
+
+
+def _hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _message(sender, message):
+    """The message as GroupChat stores it."""
+    if not isinstance(message, dict):
+        message = {"content": message}
+    message = {key: message[key] for key in MESSAGE_FIELDS if key in message}
+    if message.get("role") not in ("tool", "function"):
+        # Received by the manager, so "user" as in groupchat.messages
+        message["role"] = "user"
+    message["name"] = sender.name
+    return message
+
+
+class RunLog:
+    """The append-only log and artifact store of one run."""
+
+    def __init__(self, run_id, directory=DEFAULT_DIR):
+        self.run_id = run_id
+        self.directory = os.path.join(directory, run_id)
+        self.path = os.path.join(self.directory, "log.jsonl")
+        self.artifacts = os.path.join(self.directory, "artifacts")
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def append(self, entry):
+        line = json.dumps(dict(entry, time=time.time()), default=str) + "\n"
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def entries(self):
+        if not self.exists():
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            # A line cut short by a crash is not a checkpoint
+            return [json.loads(line) for line in f if line.endswith("\n")]
+
+    def rounds(self, upto=None):
+        """Round entries of the current branch, oldest first (the first `upto` of them)."""
+        rounds = []
+        for entry in self.entries():
+            if entry["type"] == "start":
+                # The run was started over under the same id
+                rounds = []
+            elif entry["type"] == "round":
+                rounds.append(entry)
+            elif entry["type"] == "resume" and entry.get("upto") is not None:
+                del rounds[entry["upto"]:]
+        return rounds if upto is None else rounds[:upto]
+
+    def store(self, path):
+        """Copy `path` into the artifact store; returns its hash."""
+        digest = _hash(path)
+        target = os.path.join(self.artifacts, digest)
+        if not os.path.exists(target):
+            os.makedirs(self.artifacts, exist_ok=True)
+            shutil.copyfile(path, target + ".part")
+            os.replace(target + ".part", target)
+        return digest
+
+    def restore(self, rounds, work_dirs):
+        """Put the latest logged version of each artifact back; returns how many were written."""
+        latest = {}
+        for entry in rounds:
+            for artifact in entry.get("artifacts", []):
+                latest[(artifact["work_dir"], artifact["path"])] = artifact["sha256"]
+        restored = 0
+        for (work_dir, path), digest in latest.items():
+            if work_dir not in work_dirs:
+                continue
+            target = os.path.join(work_dir, path)
+            source = os.path.join(self.artifacts, digest)
+            if not os.path.exists(source) or (os.path.exists(target) and _hash(target) == digest):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            restored += 1
+        return restored
+
+
+class Checkpoints:
+    """Logs the rounds of one session's runs and rebuilds a chat from them."""
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        self.log = None
+        self.work_dirs = []
+        self._seen = {}  # work dir -> {relative path: (mtime, size)}
+        self._skip = False
+        self._lock = threading.Lock()
+
+    def copy(self):
+        """Same directory, no run (one per session)."""
+        return Checkpoints(self.directory)
+
+    def track(self, agents):
+        """Log what `agents` send, and the files their code executors write."""
+        for agent in agents:
+            agent.register_hook("process_message_before_send", self._record)
+            executor = getattr(agent, "code_executor", None)
+            work_dir = getattr(executor, "work_dir", None)
+            if work_dir is not None and os.path.abspath(work_dir) not in self.work_dirs:
+                self.work_dirs.append(os.path.abspath(work_dir))
+        for work_dir in self.work_dirs:
+            self._seen[work_dir] = self._scan(work_dir)
+
+    @property
+    def run_id(self):
+        return self.log.run_id if self.log is not None else None
+
+    def start(self, message, run_id=None):
+        """Begin a new run log; returns its id."""
+        self.log = RunLog(run_id or uuid.uuid4().hex[:12], self.directory)
+        self.log.append({"type": "start", "run": self.log.run_id, "task": message})
+        return self.log.run_id
+
+    def resume(self, run_id, upto=None, skip=False):
+        """Switch to `run_id`'s log; returns (messages, artifacts restored)."""
+        log = RunLog(run_id, self.directory)
+        if not log.exists():
+            raise FileNotFoundError(f"No checkpoint log for run {run_id} in {self.directory}")
+        rounds = log.rounds(upto)
+        restored = log.restore(rounds, self.work_dirs)
+        log.append({"type": "resume", "upto": len(rounds)})
+        with self._lock:
+            self.log = log
+            # With skip, the next message is the restored last one, sent again to restart the chat
+            self._skip = skip
+        for work_dir in self.work_dirs:
+            self._seen[work_dir] = self._scan(work_dir)
+        return [entry["message"] for entry in rounds], restored
+
+    # Recording
+
+    def _scan(self, work_dir):
+        files = {}
+        for base, dirs, names in os.walk(work_dir):
+            dirs[:] = [d for d in dirs if not d.startswith((".",) + SKIPPED_PREFIXES)]
+            for name in names:
+                if name.startswith(SKIPPED_PREFIXES):
+                    continue
+                path = os.path.join(base, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[os.path.relpath(path, work_dir)] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def _artifacts(self):
+        artifacts = []
+        for work_dir in self.work_dirs:
+            files = self._scan(work_dir)
+            seen = self._seen.get(work_dir, {})
+            for path, (mtime, size) in files.items():
+                if seen.get(path) == (mtime, size) or size > MAX_ARTIFACT_BYTES:
+                    continue
+                try:
+                    digest = self.log.store(os.path.join(work_dir, path))
+                except OSError:
+                    continue
+                artifacts.append({"work_dir": work_dir, "path": path, "size": size, "sha256": digest})
+            self._seen[work_dir] = files
+        return artifacts
+
+    def _record(self, sender, message, recipient, silent):
+        with self._lock:
+            if self.log is None:
+                return message
+            if self._skip:
+                self._skip = False
+                return message
+            self.log.append({"type": "round", "speaker": sender.name, "message": _message(sender, message),
+                             "artifacts": self._artifacts()})
+        return message
+
+
+def runs(directory=DEFAULT_DIR):
+    """(run id, task, rounds, last modified) of every logged run, newest first."""
+    found = []
+    if not os.path.isdir(directory):
+        return found
+    for run_id in os.listdir(directory):
+        log = RunLog(run_id, directory)
+        if not log.exists():
+            continue
+        entries = log.entries()
+        task = next((e.get("task") for e in entries if e["type"] == "start"), None)
+        found.append((run_id, task, len(log.rounds()), os.path.getmtime(log.path)))
+    return sorted(found, key=lambda run: run[3], reverse=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="List checkpointed runs or show one")
+    parser.add_argument("run", nargs="?")
+    parser.add_argument("--dir", default=DEFAULT_DIR)
+    args = parser.parse_args()
+    if args.run is None:
+        for run_id, task, rounds, modified in runs(args.dir):
+            print(f"{run_id}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(modified))}  "
+                  f"{rounds:3d} rounds  {(task or '')[:60]}")
+    else:
+        for i, entry in enumerate(RunLog(args.run, args.dir).rounds()):
+            files = ", ".join(a["path"] for a in entry.get("artifacts", []))
+            content = str(entry["message"].get("content") or "").strip().replace("\n", " ")
+            print(f"{i:3d} {entry['speaker']:>10}: {content[:90]}" + (f"  [{files}]" if files else ""))
@@ -0,0 +1,241 @@
+# Token-budgeted context compaction for the group chats.
+#
+# Every agent re-sends the whole group chat on every turn: full Executor
+# output, each version of the Engineer's code, every report draft. Prompt
+# tokens (and latency) grow quadratically over a 50-round run. A Compactor is
+# registered on an agent as a "process_all_messages_before_reply" hook (the
+# same hook autogen's TransformMessages capability uses), so it only changes
+# what is sent to the LLM, never the stored history.
+#
+# When the history is over the agent's token budget it is compacted in steps,
+# stopping as soon as it fits:
+#
+#   1. superseded content: older execution results, older code blocks and
+#      report drafts that a later message from the same agent replaces
+#   2. long old messages are cut down to their head and tail
+#   3. the oldest rounds are dropped (the task message is always kept) and
+#      replaced by a one-line note of who said what
+#
+# The last `keep_recent` messages are never touched, so the Executor still
+# sees the code it has to run and every agent sees the latest results.
+#
+#     compaction = Compaction(max_tokens=6000, budgets={"Writer": 12000})
+#     compaction.add_to_agents([planner, engineer, writer])
+#     ...
+#     print(compaction.summary())
+
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+
+CODE_BLOCK = re.compile(r"```[ \t]*(\w+)?[ \t]*\r?\n(.*?)\r?\n[ \t]*```", re.DOTALL)
+EXECUTION_RESULT = re.compile(r"^\s*exitcode: -?\d+")
+
+DEFAULT_MAX_TOKENS = 6000
+MESSAGE_OVERHEAD = 4  # role/name framing the API adds per message
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    """Tokens in `text` (cl100k_base; about 4 characters per token without tiktoken)."""
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def content_text(message):
+    content = message.get("content")
+    if isinstance(content, list):
+        # Multimodal content: only the text parts count
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def message_tokens(message):
+    return count_tokens(content_text(message)) + MESSAGE_OVERHEAD
+
+
+def history_tokens(messages):
+    return sum(message_tokens(message) for message in messages)
+
+
+def _replace(message, content):
+    message = dict(message)
+    message["content"] = content
+    return message
+
+
+def _cut(text, max_tokens):
+    """Keep the head and tail of `text` so it is about `max_tokens` long."""
+    keep = max_tokens * 4
+    if len(text) <= keep:
+        return text
+    head = text[: keep * 2 // 3]
+    tail = text[-(keep // 3):]
+    elided = count_tokens(text[len(head):len(text) - len(tail)])
+    return f"{head}\n[... {elided} tokens elided ...]\n{tail}"
+
+
+class Compactor:
+    """Fits one agent's history into `max_tokens` before each LLM call."""
+
+    def __init__(self, max_tokens=DEFAULT_MAX_TOKENS, keep_recent=4, max_message_tokens=400,
+                 draft_authors=("Writer",)):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.max_message_tokens = max_message_tokens
+        self.draft_authors = set(draft_authors)
+        self.calls = 0
+        self.compacted = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    @property
+    def saved(self):
+        return self.tokens_in - self.tokens_out
+
+    def add_to_agent(self, agent):
+        agent.register_hook(hookable_method="process_all_messages_before_reply", hook=self)
+
+    def __call__(self, messages):
+        before = history_tokens(messages)
+        after = before
+        if before > self.max_tokens and len(messages) > self.keep_recent + 1:
+            messages = self.compact(messages)
+            after = history_tokens(messages)
+            self.compacted += 1
+        self.calls += 1
+        self.tokens_in += before
+        self.tokens_out += after
+        return messages
+
+    def compact(self, messages):
+        messages = list(messages)
+        # Index of the first message that is kept as is; messages[0] is the task
+        recent = max(1, len(messages) - self.keep_recent)
+        for step in (self._drop_superseded, self._cut_long, self._drop_oldest):
+            messages, recent = step(messages, recent)
+            if history_tokens(messages) <= self.max_tokens:
+                break
+        return messages
+
+    def _drop_superseded(self, messages, recent):
+        last_result = max((i for i, m in enumerate(messages) if EXECUTION_RESULT.match(content_text(m))), default=None)
+        last_code = {}
+        last_draft = {}
+        for i, message in enumerate(messages):
+            name = message.get("name")
+            if CODE_BLOCK.search(content_text(message)):
+                last_code[name] = i
+            if name in self.draft_authors:
+                last_draft[name] = i
+
+        out = []
+        for i, message in enumerate(messages):
+            text = content_text(message)
+            name = message.get("name")
+            if i == 0 or i >= recent or not isinstance(message.get("content"), str):
+                out.append(message)
+            elif EXECUTION_RESULT.match(text) and i != last_result:
+                first_line = text.strip().splitlines()[0]
+                out.append(_replace(message, f"{first_line}\n[earlier execution output omitted]"))
+            elif name in self.draft_authors and i != last_draft[name]:
+                out.append(_replace(message, "[earlier draft omitted; superseded by a later version]"))
+            elif CODE_BLOCK.search(text) and i != last_code.get(name):
+                out.append(_replace(message, CODE_BLOCK.sub("```\n# [superseded code omitted]\n```", text)))
+            else:
+                out.append(message)
+        return out, recent
+
+    def _cut_long(self, messages, recent):
+        out = []
+        for i, message in enumerate(messages):
+            if 0 < i < recent and isinstance(message.get("content"), str) \
+                    and message_tokens(message) > self.max_message_tokens:
+                message = _replace(message, _cut(message["content"], self.max_message_tokens))
+            out.append(message)
+        return out, recent
+
+    def _drop_oldest(self, messages, recent):
+        total = history_tokens(messages)
+        dropped = Counter()
+        first = 1
+        while first < recent and total > self.max_tokens:
+            total -= message_tokens(messages[first])
+            dropped[messages[first].get("name") or messages[first].get("role")] += 1
+            first += 1
+        if not dropped:
+            return messages, recent
+        who = ", ".join(f"{name} x{n}" for name, n in dropped.items())
+        note = {"role": "user", "content": f"[{sum(dropped.values())} earlier messages omitted to save context: {who}]"}
+        messages = [messages[0], note] + messages[first:]
+        return messages, recent - first + 2
+
+
+class Compaction:
+    """Compactors for a set of agents, with per-agent budgets and totals."""
+
+    def __init__(self, max_tokens=DEFAULT_MAX_TOKENS, budgets=None, **compactor_kwargs):
+        self.max_tokens = max_tokens
+        self.budgets = dict(budgets or {})
+        self.compactor_kwargs = compactor_kwargs
+        self.compactors = {}
+        self._lock = threading.Lock()
+
+    def copy(self):
+        """Same budgets, no agents and fresh counters (one per conversation)."""
+        return Compaction(self.max_tokens, self.budgets, **self.compactor_kwargs)
+
+    def add_to_agents(self, agents):
+        for agent in agents:
+            if not agent.llm_config:
+                # Only agents that call the LLM send the history anywhere
+                continue
+            compactor = Compactor(self.budgets.get(agent.name, self.max_tokens), **self.compactor_kwargs)
+            compactor.add_to_agent(agent)
+            with self._lock:
+                self.compactors[agent.name] = compactor
+
+    def reset(self):
+        for compactor in self.compactors.values():
+            compactor.calls = compactor.compacted = compactor.tokens_in = compactor.tokens_out = 0
+
+    def stats(self):
+        per_agent = {name: {"calls": c.calls, "compacted": c.compacted, "tokens_in": c.tokens_in,
+                            "tokens_out": c.tokens_out, "saved": c.saved}
+                     for name, c in self.compactors.items()}
+        tokens_in = sum(s["tokens_in"] for s in per_agent.values())
+        saved = sum(s["saved"] for s in per_agent.values())
+        return {"tokens_in": tokens_in, "saved": saved, "agents": per_agent}
+
+    def summary(self):
+        stats = self.stats()
+        share = stats["saved"] / stats["tokens_in"] if stats["tokens_in"] else 0.0
+        return f"Context compaction: {stats['saved']} prompt tokens saved ({share:.0%})"
+
+
+if __name__ == '__main__':
+    # Compact a synthetic 50-round history and report the savings
+    history = [{"role": "user", "name": "Admin", "content": "Write a report on NVDA and AMD."}]
+    for round_ in range(12):
+        history.append({"role": "user", "name": "Engineer",
+                        "content": f"```python\n# attempt {round_}\n" + "print('x')\n" * 60 + "```"})
+        history.append({"role": "user", "name": "Executor",
+                        "content": f"exitcode: {round_ % 2} (execution)\nCode output: " + "row 1.0 2.0 3.0\n" * 200})
+        history.append({"role": "user", "name": "Writer", "content": "# Report\n" + "Some analysis. " * 300})
+    compactor = Compactor(max_tokens=6000)
+    for n in range(2, len(history) + 1):
+        compactor(history[:n])
+    print(f"{compactor.calls} calls, {compactor.tokens_in} -> {compactor.tokens_out} tokens "
+          f"({compactor.saved / compactor.tokens_in:.0%} saved), last prompt {history_tokens(compactor.compact(history))} tokens")
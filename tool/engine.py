@@ -0,0 +1,406 @@
+# Build the agent team once per process and hand out cheap per-session chats.
+#
+# Streamlit reruns the whole script on every widget interaction. Building six
+# agents (each with its own OpenAI client), the transition graph, the GroupChat
+# and the GroupChatManager on every rerun is what makes the apps sluggish. The
+# ChatEngine keeps the expensive parts (agent definitions and LLM clients) and
+# new_session() stamps out fresh agents, GroupChat and manager that reuse them.
+#
+# Typical use from a Streamlit script:
+#
+#     @st.cache_resource
+#     def get_engine(model, temperature, seed):
+#         llm_config = {"model": model, "temperature": temperature, "seed": seed}
+#         return ChatEngine(agents=[AgentSpec(...), ...], transitions={...})
+#
+#     if "chat" not in st.session_state:
+#         st.session_state["chat"] = get_engine(**llm_config).new_session(work_dir=session_work_dir())
+#
+# Sessions share nothing mutable: each has its own agents, history, GroupChat,
+# manager and code executor, so concurrent users never see each other's
+# messages. Code execution runs on a worker thread (a_execute_code) so that
+# one session's code does not hold up the other sessions on the shared loop.
+# The OpenAI clients are the one exception: their total_usage_summary and
+# actual_usage_summary (and agent.get_total_usage()) add up every session's
+# calls in the process. A session's own usage is session.usage(), kept by
+# its ChatMetrics.
+#
+# Every session's agents publish to the event bus (tool/events.py), which is
+# how their messages reach the UI.
+#
+# With `checkpoints` (tool/checkpoints.py) every round goes to a durable run
+# log. a_continue() carries on the current conversation (Admin feedback),
+# and a_resume() rebuilds a session from a logged run, e.g. after a restart.
+#
+# With a `recorder` (tool/replay.py) every LLM call, code execution and
+# message of a session's runs is recorded, or served from a recording.
+#
+# With a `router` (tool/router.py) each agent's calls go to the config-list
+# entries of its role's route instead of the one model of its llm_config.
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+import autogen
+from autogen import OpenAIWrapper
+
+from tool.events import track as track_events
+from tool.router import SPEAKER_SELECTION
+from tool.streaming import begin_reply
+
+
+async def a_execute_code(recipient, messages, sender, config):
+    """Reply function: the agent's code execution, off the event loop.
+
+    autogen runs the synchronous code execution reply on the loop itself.
+    The IOStream and current run are carried into the thread.
+    """
+    call = functools.partial(recipient.generate_code_execution_reply, messages, sender)
+    return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, call)
+
+
+def session_work_dir(name=None, root="coding"):
+    """A work dir of the session's own under `root`, named `name` or a fresh id.
+
+    Sessions sharing one dir overwrite each other's charts, CSVs and output
+    spill files, and the execution cache would take them for its own artifacts.
+    """
+    path = os.path.join(root, name or uuid.uuid4().hex[:12])
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def config_key(llm_config):
+    """Stable key for an llm_config dict (used to share clients and caches)."""
+    return json.dumps(llm_config, sort_keys=True, default=str)
+
+
+class AgentSpec:
+    """Immutable definition of an agent: its class and constructor arguments."""
+
+    def __init__(self, cls, name, **kwargs):
+        self.cls = cls
+        self.name = name
+        self.kwargs = kwargs
+
+    @property
+    def llm_config(self):
+        return self.kwargs.get("llm_config", False)
+
+
+class ChatAlreadyRunning(RuntimeError):
+    pass
+
+
+class ChatSession:
+    """One conversation: fresh agents, GroupChat and manager for a single user."""
+
+    def __init__(self, engine, agents, groupchat, manager, speaker_selection=None, compaction=None,
+                 metrics=None, checkpoints=None, recorder=None, human_input=None, cache=None):
+        self.engine = engine
+        self.agents = agents
+        self.groupchat = groupchat
+        self.manager = manager
+        # This session's SpeakerStateMachine, if the engine has one
+        self.speaker_selection = speaker_selection
+        # This session's Compaction (context budgets per agent), if any
+        self.compaction = compaction
+        # This session's ChatMetrics (per-round latency, tokens, cost), if any
+        self.metrics = metrics
+        # This session's Checkpoints (durable per-run log), if any
+        self.checkpoints = checkpoints
+        # This session's Recorder or Replayer, if any; it sees every LLM call through the cache
+        self.recorder = recorder
+        if cache is None:
+            cache = recorder.cache(engine.cache) if recorder is not None else engine.cache
+        self.cache = cache
+        # This session's HumanInput (answers typed in a chat UI), if any
+        self.human_input = human_input
+        self._running = False
+        self._running_lock = threading.Lock()
+
+    @property
+    def running(self):
+        """Whether a chat is running in this session right now."""
+        return self._running
+
+    @contextmanager
+    def _exclusive(self):
+        # Two chats driving the same agents and GroupChat would interleave into one history
+        with self._running_lock:
+            if self._running:
+                raise ChatAlreadyRunning("A chat is already running in this session")
+            self._running = True
+        try:
+            yield
+        finally:
+            self._running = False
+
+    def usage(self):
+        """LLM calls, tokens and cost of this session's runs, or None without metrics."""
+        if self.metrics is None:
+            return None
+        return self.metrics.usage_summary()
+
+    @property
+    def user_proxy(self):
+        return self.agents[self.engine.specs[0].name]
+
+    @property
+    def messages(self):
+        return self.groupchat.messages
+
+    def __getitem__(self, name):
+        return self.agents[name]
+
+    @property
+    def run_id(self):
+        return self.checkpoints.run_id if self.checkpoints is not None else None
+
+    async def a_initiate_chat(self, message, run_id=None, **kwargs):
+        """Start a new conversation (and run log, under `run_id` if given)."""
+        with self._exclusive():
+            return await self._a_initiate_chat(message, run_id, **kwargs)
+
+    async def _a_initiate_chat(self, message, run_id=None, **kwargs):
+        kwargs.setdefault("cache", self.cache)
+        self._begin_run(message, run_id)
+        try:
+            return await self.user_proxy.a_initiate_chat(self.manager, message=message, **kwargs)
+        finally:
+            self._end_run()
+
+    def initiate_chat(self, message, run_id=None, **kwargs):
+        kwargs.setdefault("cache", self.cache)
+        with self._exclusive():
+            self._begin_run(message, run_id)
+            try:
+                return self.user_proxy.initiate_chat(self.manager, message=message, **kwargs)
+            finally:
+                self._end_run()
+
+    async def a_continue(self, message):
+        """The Admin's `message` as the next round of this conversation, not a new one."""
+        with self._exclusive():
+            return await self._a_continue(message)
+
+    async def _a_continue(self, message):
+        if not self.groupchat.messages:
+            if self.run_id is None:
+                return await self._a_initiate_chat(message)
+            # A session that lost its state but still has its log
+            return await self._a_resume(self.run_id, message=message)
+        if self.metrics is not None:
+            self.metrics.new_run()
+        if self.recorder is not None:
+            self.recorder.follow_up(message)
+        try:
+            return await self.user_proxy.a_initiate_chat(self.manager, message=message, clear_history=False,
+                                                         cache=self.cache)
+        finally:
+            self._end_run()
+
+    async def a_resume(self, run_id, upto=None, message=None):
+        """Rebuild this session from `run_id`'s log and carry on.
+
+        `upto` resumes from that round instead of the last one; `message` is
+        Admin feedback to continue with. No LLM call is replayed: histories
+        come from the log and the logged artifacts are put back in the work dir.
+        """
+        with self._exclusive():
+            return await self._a_resume(run_id, upto, message)
+
+    async def _a_resume(self, run_id, upto=None, message=None):
+        if self.checkpoints is None:
+            raise ValueError("This engine has no checkpoints to resume from")
+        messages, _ = self.checkpoints.resume(run_id, upto=upto, skip=message is None)
+        if message is not None:
+            messages.append({"content": message, "role": "user", "name": self.user_proxy.name})
+        for agent in self.agents.values():
+            if hasattr(agent.code_executor, "restart"):
+                # Worker variables from before the resume are gone either way
+                agent.code_executor.restart()
+        if self.metrics is not None:
+            self.metrics.new_run()
+        try:
+            last_agent, last_message = await self.manager.a_resume(messages, remove_termination_string="TERMINATE",
+                                                                   silent=True)
+            return await last_agent.a_initiate_chat(self.manager, message=last_message, clear_history=False,
+                                                    cache=self.cache)
+        finally:
+            self._end_run()
+
+    def _begin_run(self, message, run_id=None):
+        if self.metrics is not None:
+            self.metrics.new_run()
+        if self.checkpoints is not None:
+            self.checkpoints.start(message, run_id)
+        if self.recorder is not None:
+            self.recorder.start(message, self.run_id or run_id)
+
+    def _end_run(self):
+        if self.metrics is not None:
+            self.metrics.flush()
+
+
+class ChatEngine:
+    """Shared, already-built agent definitions for one app and one config.
+
+    The first spec is the agent that starts the conversation (the Admin).
+    `transitions` maps an agent name to the names it may hand over to.
+    `reply_funcs` is a list of (reply_func, config) pairs registered on every
+    agent of every new session; the session is added to each config as
+    config["session"] so callbacks know which conversation they belong to.
+    With `stream=True` the agents (not the manager) stream their completions
+    to the current IOStream, see tool/streaming.py. `cache` (e.g. an LLMCache)
+    is used for every chat started from a session. `speaker_selection` is a
+    SpeakerStateMachine (tool/speaker.py) and `compaction` a Compaction
+    (tool/compaction.py); `metrics` a ChatMetrics (tool/metrics.py) that
+    tracks every agent and `checkpoints` a Checkpoints (tool/checkpoints.py)
+    that logs every round. Each session gets its own copy of all four, and
+    of `recorder` (a Recorder or Replayer from tool/replay.py), which also
+    wraps every session's code executors. With a `router` (tool/router.py)
+    the model of each agent (and of speaker selection) is picked per role
+    from the config list, keeping `llm_config`'s other parameters.
+    """
+
+    def __init__(self, agents, transitions=None, speaker_transitions_type="allowed", max_round=50,
+                 manager_config=None, manager_kwargs=None, reply_funcs=(), stream=False, cache=None,
+                 speaker_selection=None, compaction=None, metrics=None, checkpoints=None, recorder=None,
+                 router=None, **groupchat_kwargs):
+        self.specs = list(agents)
+        self.transitions = transitions
+        self.speaker_transitions_type = speaker_transitions_type
+        self.max_round = max_round
+        self.manager_config = manager_config
+        self.manager_kwargs = manager_kwargs or {}
+        self.reply_funcs = list(reply_funcs)
+        if stream:
+            self.reply_funcs.append((begin_reply, None))
+        self.stream = stream
+        self.cache = cache
+        self.speaker_selection = speaker_selection
+        self.compaction = compaction
+        self.metrics = metrics
+        self.checkpoints = checkpoints
+        self.recorder = recorder
+        self.router = router
+        self.groupchat_kwargs = groupchat_kwargs
+
+        # One OpenAIWrapper per distinct llm_config, shared by every session
+        # (with a router, one RoutedClient per route and llm_config instead),
+        # so their usage summaries are process-wide, not per session
+        self.clients = {}
+        for spec in self.specs:
+            if spec.llm_config and router is None:
+                llm_config = self.agent_config(spec.llm_config)
+                key = config_key(llm_config)
+                if key not in self.clients:
+                    self.clients[key] = OpenAIWrapper(**llm_config)
+
+    def agent_config(self, llm_config):
+        if self.stream:
+            return dict(llm_config, stream=True)
+        return dict(llm_config)
+
+    def client_for(self, llm_config, role=None):
+        if self.router is not None:
+            return self.router.client(role, llm_config)
+        return self.clients[config_key(llm_config)]
+
+    def build_agent(self, spec, work_dir=None, recorder=None):
+        kwargs = dict(spec.kwargs)
+        llm_config = kwargs.pop("llm_config", False)
+        code_execution_config = kwargs.get("code_execution_config")
+        if code_execution_config and hasattr(code_execution_config.get("executor"), "session_copy"):
+            # Each session runs its code in its own work dir (and keeps its own variables on the worker pool)
+            kwargs["code_execution_config"] = dict(code_execution_config,
+                                                   executor=code_execution_config["executor"].session_copy(work_dir))
+        if recorder is not None and code_execution_config and "executor" in code_execution_config:
+            # Code runs are recorded (or served from a recording)
+            config = kwargs["code_execution_config"]
+            kwargs["code_execution_config"] = dict(config, executor=recorder.wrap(spec.name, config["executor"]))
+        # Skip building a new OpenAI client and attach the shared one instead
+        agent = spec.cls(name=spec.name, llm_config=False, **kwargs)
+        if llm_config:
+            agent.llm_config = self.agent_config(llm_config)
+            agent.client = self.client_for(agent.llm_config, spec.name)
+            if self.router is not None:
+                agent.llm_config = self.router.llm_config(spec.name, agent.llm_config)
+        if kwargs.get("code_execution_config"):
+            agent.register_reply([autogen.Agent, None], reply_func=a_execute_code, ignore_async_in_sync_chat=True)
+        return agent
+
+    def new_session(self, work_dir=None, human_input=None):
+        """A new conversation; its code runs in `work_dir` instead of the executor's own if given.
+
+        Agents that ask for human input get it from `human_input` (a HumanInput) instead of the console.
+        """
+        recorder = self.recorder.copy() if self.recorder is not None else None
+        agents = {spec.name: self.build_agent(spec, work_dir, recorder) for spec in self.specs}
+
+        groupchat_kwargs = dict(self.groupchat_kwargs)
+        if self.transitions is not None:
+            groupchat_kwargs["allowed_or_disallowed_speaker_transitions"] = {
+                agents[name]: [agents[n] for n in names] for name, names in self.transitions.items()
+            }
+            groupchat_kwargs["speaker_transitions_type"] = self.speaker_transitions_type
+        speaker_selection = None
+        if self.speaker_selection is not None:
+            speaker_selection = self.speaker_selection.copy()
+            groupchat_kwargs["speaker_selection_method"] = speaker_selection
+
+        groupchat = autogen.GroupChat(
+            agents=list(agents.values()),
+            messages=[],
+            max_round=self.max_round,
+            **groupchat_kwargs,
+        )
+        manager_config = self.manager_config
+        if self.router is not None and manager_config:
+            # Speaker selection gets its route's entries, healthiest first as of now
+            manager_config = self.router.llm_config(SPEAKER_SELECTION, manager_config)
+        cache = recorder.cache(self.cache) if recorder is not None else self.cache
+        if manager_config and cache is not None:
+            # autogen runs speaker selection with cache=None on agents built from this
+            # llm_config, whose entries take precedence: so these calls use the cache too
+            manager_config = dict(manager_config, cache=cache)
+        manager = autogen.GroupChatManager(
+            groupchat=groupchat,
+            llm_config=manager_config,
+            **self.manager_kwargs,
+        )
+        compaction = None
+        if self.compaction is not None:
+            compaction = self.compaction.copy()
+            compaction.add_to_agents(agents.values())
+        metrics = None
+        if self.metrics is not None:
+            metrics = self.metrics.copy()
+            metrics.track(agents.values())
+        checkpoints = None
+        if self.checkpoints is not None:
+            checkpoints = self.checkpoints.copy()
+            checkpoints.track(agents.values())
+        # Messages, turns and code runs go to the event bus for the UI, logs and metrics
+        track_events(agents.values())
+        if human_input is not None:
+            human_input.attach(agents.values())
+        # After human_input, so that what the person types is recorded too
+        if recorder is not None:
+            recorder.track(agents.values())
+        session = ChatSession(self, agents, groupchat, manager, speaker_selection=speaker_selection,
+                              compaction=compaction, metrics=metrics, checkpoints=checkpoints, recorder=recorder,
+                              human_input=human_input, cache=cache)
+
+        for reply_func, config in self.reply_funcs:
+            config = dict(config or {}, session=session)
+            for agent in agents.values():
+                agent.register_reply([autogen.Agent, None], reply_func=reply_func, config=config)
+        return session
@@ -0,0 +1,373 @@
+# Typed chat events between the agents and whoever shows or records them.
+#
+# Agents publish events; front ends, logs and metrics subscribe. Publishing
+# never waits on a subscriber. Each subscription has its own bounded queue,
+# and a consumer task on the background loop (tool/loop.py) drains it, in a
+# worker thread for `threaded` handlers (Panel widgets, SQLite, files), so a
+# slow front end does not hold up the conversation:
+#
+#     bus = get_bus()
+#     bus.subscribe(handler, kinds=(MESSAGE, TOKEN), run=run, threaded=True)
+#     track(agents)   # publish what these agents do (ChatEngine does this)
+#
+# Event kinds: MESSAGE (an agent sent a message), SPEAKER (an agent starts its
+# reply), CODE_STARTED / CODE_FINISHED (an Executor runs code blocks), TOKEN
+# (a streamed chunk; data["text"] is the text so far), TERMINATED (a run ended;
+# content is its status) and ROUND (a finished ChatMetrics record).
+#
+# Backpressure: a full queue drops TOKEN events (the next one carries the whole
+# text anyway) and keeps everything else. Before an agent starts its next
+# reply it waits, up to `max_wait` seconds, until the queues that see its run
+# have room again, so a stalled subscriber slows the chat down a round at a
+# time instead of letting its queue grow without bound.
+#
+# EVENT_LOG=<path> adds a sink that appends every event but tokens to a JSONL
+# file.
+
+import asyncio
+import atexit
+import contextvars
+import inspect
+import json
+import os
+import threading
+import time
+import traceback
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+from tool.loop import current_run, get_loop
+
+MESSAGE = "message"
+SPEAKER = "speaker"
+CODE_STARTED = "code_started"
+CODE_FINISHED = "code_finished"
+TOKEN = "token"
+TERMINATED = "terminated"
+ROUND = "round"
+KINDS = (MESSAGE, SPEAKER, CODE_STARTED, CODE_FINISHED, TOKEN, TERMINATED, ROUND)
+
+LOSSY = (TOKEN,)
+DEFAULT_MAXSIZE = 256
+DEFAULT_MAX_WAIT = 2.0
+
+Event = namedtuple("Event", "kind run name content data time")
+
+_bus = None
+_bus_lock = threading.Lock()
+_scope = contextvars.ContextVar("event_scope", default=None)
+
+
+@contextmanager
+def scope(key):
+    """Tag the events published in this context with `key` instead of the current ChatRun."""
+    token = _scope.set(key)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope():
+    """What events published here belong to: the scope key, the ChatRun, or None."""
+    key = _scope.get()
+    return key if key is not None else current_run()
+
+
+class Subscription:
+    """One subscriber's queue, handler and counters."""
+
+    def __init__(self, handler, kinds=None, run=None, maxsize=DEFAULT_MAXSIZE, threaded=False, name=None):
+        self.handler = handler
+        self.kinds = frozenset(kinds) if kinds is not None else None
+        self.run = run  # only this run's events (None: every run)
+        self.maxsize = maxsize
+        self.threaded = threaded
+        self.name = name or getattr(handler, "__name__", "subscriber")
+        self.queue = deque()
+        self.delivered = 0
+        self.dropped = 0
+        self.max_queued = 0
+        self.lag = 0.0  # seconds from publish to handled, last event
+        self.task = None
+        self._wake = None
+
+    def accepts(self, kind, run):
+        return (self.kinds is None or kind in self.kinds) and (self.run is None or self.run is run)
+
+    @property
+    def full(self):
+        return len(self.queue) >= self.maxsize
+
+
+class EventBus:
+    """Fan-out of events to bounded, per-subscriber queues on the background loop."""
+
+    def __init__(self, loop=None):
+        self._loop = loop
+        self._subscriptions = ()  # replaced, not mutated, so publishers can read it without the lock
+        self._lock = threading.Lock()
+        self._pending = {}  # run -> events queued or being handled
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            self._loop = get_loop()
+        return self._loop
+
+    def subscribe(self, handler, kinds=None, run=None, maxsize=DEFAULT_MAXSIZE, threaded=False, name=None):
+        """Call `handler(event)` for every matching event, in order; returns the Subscription."""
+        subscription = Subscription(handler, kinds, run, maxsize, threaded, name)
+        with self._lock:
+            self._subscriptions = self._subscriptions + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+        self.loop.call_soon_threadsafe(self._discard, subscription)
+
+    def _discard(self, subscription):
+        if subscription.task is not None:
+            subscription.task.cancel()
+        for event in subscription.queue:
+            self._handled(event)
+        subscription.queue.clear()
+
+    def wants(self, kind, run=None):
+        return any(s.accepts(kind, run) for s in self._subscriptions)
+
+    def publish(self, kind, name=None, content=None, run=None, **data):
+        """Queue an event for the subscribers; never blocks. `run` defaults to current_scope()."""
+        run = current_scope() if run is None else run
+        if not self.wants(kind, run):
+            return
+        event = Event(kind, run, name, content, data, time.time())
+        loop = self.loop
+        if _running_loop() is loop:
+            self._deliver(event)
+        else:
+            loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event):
+        for subscription in self._subscriptions:
+            if not subscription.accepts(event.kind, event.run):
+                continue
+            if subscription.full and event.kind in LOSSY:
+                subscription.dropped += 1
+                continue
+            subscription.queue.append(event)
+            subscription.max_queued = max(subscription.max_queued, len(subscription.queue))
+            self._pending[event.run] = self._pending.get(event.run, 0) + 1
+            if subscription.task is None:
+                subscription._wake = asyncio.Event()
+                subscription.task = self.loop.create_task(self._consume(subscription))
+            subscription._wake.set()
+
+    async def _consume(self, subscription):
+        loop = asyncio.get_running_loop()
+        while True:
+            while not subscription.queue:
+                subscription._wake.clear()
+                await subscription._wake.wait()
+            event = subscription.queue.popleft()
+            try:
+                if subscription.threaded:
+                    await loop.run_in_executor(None, subscription.handler, event)
+                else:
+                    result = subscription.handler(event)
+                    if inspect.isawaitable(result):
+                        await result
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # A broken subscriber must not take the others down
+                traceback.print_exc()
+            finally:
+                subscription.delivered += 1
+                subscription.lag = time.time() - event.time
+                self._handled(event)
+
+    def _handled(self, event):
+        left = self._pending.get(event.run, 1) - 1
+        if left:
+            self._pending[event.run] = left
+        else:
+            self._pending.pop(event.run, None)
+
+    def has_room(self, run=None):
+        """False while a queue that sees `run`'s events is full."""
+        return not any(s.full for s in self._subscriptions if s.run is None or s.run is run)
+
+    async def wait_for_room(self, run=None, max_wait=DEFAULT_MAX_WAIT):
+        """Wait until no queue that sees `run`'s events is full (at most `max_wait` s)."""
+        if self.has_room(run):
+            return True
+        if _running_loop() is not self.loop:
+            return await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(self.wait_for_room(run, max_wait), self.loop))
+        started = time.monotonic()
+        self.waits += 1
+        try:
+            while time.monotonic() - started < max_wait:
+                await asyncio.sleep(0.01)
+                if self.has_room(run):
+                    return True
+            return False
+        finally:
+            self.wait_seconds += time.monotonic() - started
+
+    async def drain(self, run=None, timeout=5.0):
+        """Wait until every event of `run` published so far has been handled."""
+        if _running_loop() is not self.loop:
+            return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.drain(run, timeout), self.loop))
+        started = time.monotonic()
+        while self._pending.get(run) and time.monotonic() - started < timeout:
+            await asyncio.sleep(0.01)
+        return not self._pending.get(run)
+
+    def close(self, timeout=1.0):
+        """Stop the consumer tasks (at exit; queued events are dropped)."""
+        async def cancel():
+            tasks = [s.task for s in self._subscriptions if s.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._loop is not None and self._loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(cancel(), self._loop).result(timeout)
+            except Exception:
+                pass
+
+    def stats(self):
+        """Per subscriber: events handled, dropped, queued now and at most, last lag."""
+        return [{"subscriber": s.name, "delivered": s.delivered, "dropped": s.dropped, "queued": len(s.queue),
+                 "max queued": s.max_queued, "lag (s)": round(s.lag, 4)} for s in self._subscriptions]
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def get_bus():
+    """The process-wide EventBus (with the EVENT_LOG sink when that is set)."""
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = EventBus()
+            atexit.register(_bus.close)
+            if os.environ.get("EVENT_LOG"):
+                _bus.subscribe(LogSink(os.environ["EVENT_LOG"]), kinds=set(KINDS) - set(LOSSY), threaded=True,
+                               maxsize=10000, name="log")
+    return _bus
+
+
+def publish(kind, name=None, content=None, run=None, **data):
+    get_bus().publish(kind, name, content, run, **data)
+
+
+class LogSink:
+    """Appends events to a JSONL file."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def __call__(self, event):
+        run = event.run
+        record = {"kind": event.kind, "run": getattr(run, "id", None) or (None if run is None else str(run)),
+                  "name": event.name, "content": event.content, "time": event.time,
+                  **{k: v for k, v in event.data.items() if k != "metrics"}}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+# Publishing from agents
+
+def _content(message):
+    return message if isinstance(message, str) or message is None else message.get("content")
+
+
+def _announce(recipient, messages=None, sender=None, config=None):
+    publish(SPEAKER, recipient.name)
+    executor = recipient.code_executor
+    content = _content(messages[-1]) if messages else None
+    if executor is not None and isinstance(content, str):
+        blocks = executor.code_extractor.extract_code_blocks(content)
+        if blocks:
+            publish(CODE_STARTED, recipient.name, languages=[b.language for b in blocks])
+    bus = get_bus()
+    if _running_loop() is None and not bus.has_room(current_scope()):
+        # A synchronous chat: wait here (async chats wait in _a_wait_for_room)
+        asyncio.run_coroutine_threadsafe(bus.wait_for_room(current_scope(), config["max_wait"]),
+                                         bus.loop).result()
+    return False, None
+
+
+async def _a_wait_for_room(recipient, messages=None, sender=None, config=None):
+    await get_bus().wait_for_room(current_scope(), config["max_wait"])
+    return False, None
+
+
+def _sent(sender, message, recipient, silent):
+    content = _content(message)
+    publish(MESSAGE, sender.name, content, recipient=recipient.name)
+    if sender.code_executor is not None and isinstance(content, str) and content.startswith("exitcode:"):
+        # "exitcode: 0 (execution succeeded)\nCode output: ..."
+        words = content[len("exitcode:"):].split(None, 1)
+        exit_code = int(words[0]) if words and words[0].lstrip("-").isdigit() else None
+        publish(CODE_FINISHED, sender.name, exit_code=exit_code)
+    return message
+
+
+def track(agents, max_wait=DEFAULT_MAX_WAIT):
+    """Publish the messages, turns and code runs of `agents` (autogen ConversableAgents)."""
+    from autogen import Agent
+
+    config = {"max_wait": max_wait}
+    for agent in agents:
+        agent.register_reply([Agent, None], reply_func=_a_wait_for_room, config=config,
+                             ignore_async_in_sync_chat=True)
+        agent.register_reply([Agent, None], reply_func=_announce, config=config)
+        agent.register_hook("process_message_before_send", _sent)
+
+
+if __name__ == '__main__':
+    # A subscriber that takes 20 ms per event vs an agent publishing 200 messages
+    bus = EventBus()
+    run = object()
+
+    def slow(event):
+        time.sleep(0.02)
+
+    bus.subscribe(slow, kinds=(MESSAGE,), run=run, maxsize=16, threaded=True, name="slow ui")
+    bus.subscribe(lambda event: None, run=run, name="fast log")
+
+    async def agent():
+        started = time.perf_counter()
+        publish_time = 0.0
+        for i in range(200):
+            t = time.perf_counter()
+            bus.publish(MESSAGE, "Engineer", f"message {i}", run=run)
+            for _ in range(20):
+                bus.publish(TOKEN, "Engineer", "tok", run=run, text="tok" * 20)
+            publish_time += time.perf_counter() - t
+            if i % 10 == 9:
+                # A new round: back off while the slow subscriber catches up
+                await bus.wait_for_room(run)
+        await bus.drain(run, timeout=30)
+        return publish_time, time.perf_counter() - started
+
+    publish_time, total = asyncio.run_coroutine_threadsafe(agent(), bus.loop).result()
+    stats = bus.stats()
+    bus.close()
+    print(f"published 4,200 events in {publish_time * 1000:.1f} ms; all handled after {total:.2f}s "
+          f"({bus.waits} backpressure waits, {bus.wait_seconds:.2f}s)")
+    for row in stats:
+        print(row)
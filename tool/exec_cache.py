@@ -0,0 +1,493 @@
+# Content-addressed cache of code execution results.
+#
+# Critic feedback and Planner retries often have the Engineer send the same
+# code again, byte for byte or with different whitespace, and the Executor
+# ran it again, download included. CachingExecutor wraps an executor and
+# looks each batch of code blocks up by a hash of:
+#
+#   - the normalized code (Python by its syntax tree, so whitespace and
+#     comments do not count; other languages with whitespace collapsed) and
+#     its `# filename:`,
+#   - the contents of the work-dir files the code names in string literals,
+#   - the executor's functions module,
+#   - the version (range and row count) of every ticker the code names that
+#     is in the local market-data store (tool/market_data.py).
+#
+# A hit returns the stored exit code and output at once and puts the files
+# the run produced (plots, CSVs, reports in coding/) back into the work dir.
+# Entries are stored under the key seen before the run and the one seen after
+# it, since files it wrote or data it fetched are inputs to the next identical
+# run. Code that reads the clock or the network (now(), today(), yfinance,
+# requests, get_stock_prices, which checks the latest bars once a day) or names
+# a date of today or later expires after VOLATILE_TTL, failures after
+# FAILURE_TTL, the rest after DEFAULT_TTL; timeouts are not cached. The
+# market-data version in the key includes the day the store last checked a
+# ticker's tail, so a new day's bars make a new key.
+#
+# The pool executor keeps variables between blocks, so only blocks that do
+# not read names defined by earlier blocks are cached, and blocks answered
+# from the cache are run quietly before the next block that is not, so the
+# variables they define exist. The index is one SQLite file shared by all
+# processes; artifact contents are stored once per hash under blobs/.
+#
+#     python -m tool.exec_cache                         # stats
+#     python -m tool.exec_cache --invalidate yfinance   # drop entries whose code mentions it
+#     python -m tool.exec_cache --clear
+#
+# EXEC_CACHE=0 turns it off for the apps (make_executor in tool/executors.py).
+
+import argparse
+import ast
+import builtins
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import symtable
+import threading
+import time
+import uuid
+
+from autogen.code_utils import PYTHON_VARIANTS
+from autogen.coding.base import CommandLineCodeResult
+
+from tool.market_data import DEFAULT_DIR as MARKET_DATA_DIR
+
+DEFAULT_PATH = os.path.join(".cache", "exec_cache")
+DEFAULT_TTL = 24 * 3600.0
+VOLATILE_TTL = 15 * 60.0
+FAILURE_TTL = 5 * 60.0
+TIMEOUT_EXIT_CODE = 124
+MAX_INPUT_BYTES = 64 * 1024 * 1024  # larger inputs are fingerprinted by size and mtime
+MAX_ARTIFACT_BYTES = 100 * 1024 * 1024  # runs producing more than this are not cached
+
+VOLATILE = re.compile(r"\b(?:now|today|utcnow)\s*\(|\btime\.time\s*\(|\byfinance\b|\byf\.|\brequests\.|"
+                      r"\burllib\b|\bhttpx\b|\bcurl\b|\bwget\b|\bpip\s+install\b|\bget_stock_prices\b")
+DATE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+FILENAME = re.compile(r"^\s*#\s*filename:\s*(\S+)", re.MULTILINE)
+SKIPPED = ("__pycache__", ".ipynb_checkpoints")
+BUILTIN_NAMES = set(dir(builtins)) | {"__file__", "__name__", "__builtins__", "__doc__"}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def normalize_code(language, code):
+    """The part of a code block that decides what it does."""
+    if language.lower() in PYTHON_VARIANTS:
+        try:
+            return ast.dump(ast.parse(code))
+        except SyntaxError:
+            pass
+    return "\n".join(" ".join(line.split()) for line in code.splitlines() if line.strip())
+
+
+def reads_today(code, today=None):
+    """Whether the code names a date of today or later, whose bars may still change."""
+    today = today or time.strftime("%Y-%m-%d")
+    return any(date >= today for date in DATE.findall(code))
+
+
+def free_names(code):
+    """Names a Python block reads without defining or importing them (and that are not builtins)."""
+    try:
+        table = symtable.symtable(code, "<block>", "exec")
+    except (SyntaxError, ValueError):
+        return set()
+    defined = {symbol.get_name() for symbol in table.get_symbols()
+               if symbol.is_assigned() or symbol.is_imported() or symbol.is_namespace()}
+    free = set()
+    scopes = [table]
+    while scopes:
+        scope = scopes.pop()
+        scopes += scope.get_children()
+        for symbol in scope.get_symbols():
+            if symbol.is_referenced() and (scope is table or symbol.is_global()):
+                free.add(symbol.get_name())
+    return free - defined - BUILTIN_NAMES
+
+
+def _literals(language, code):
+    """String literals of a Python block, or the words of any other block."""
+    if language.lower() in PYTHON_VARIANTS:
+        try:
+            return {node.value for node in ast.walk(ast.parse(code))
+                    if isinstance(node, ast.Constant) and isinstance(node.value, str) and len(node.value) < 400}
+        except SyntaxError:
+            pass
+    return set(code.split())
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    if stat.st_size > MAX_INPUT_BYTES:
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    return _sha256_file(path)
+
+
+def snapshot(work_dir):
+    """{relative path: (size, mtime)} of the files in the work dir."""
+    files = {}
+    for root, dirs, names in os.walk(work_dir):
+        dirs[:] = [d for d in dirs if d not in SKIPPED and not d.startswith(".")]
+        for name in names:
+            if name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[os.path.relpath(path, work_dir)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+class ExecCache:
+    """SQLite index of execution results plus a content-addressed store of the files they produced."""
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, volatile_ttl=VOLATILE_TTL, failure_ttl=FAILURE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.volatile_ttl = volatile_ttl
+        self.failure_ttl = failure_ttl
+        self.blobs = os.path.join(path, "blobs")
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.seconds_saved = 0.0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        os.makedirs(self.blobs, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, code TEXT NOT NULL, exit_code INTEGER NOT NULL, output TEXT NOT NULL,"
+            " code_file TEXT, artifacts TEXT NOT NULL, seconds REAL NOT NULL, created REAL NOT NULL,"
+            " expires REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.path, "index.sqlite"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # Keys
+
+    def key(self, code_blocks, work_dir, functions=""):
+        """Hash of the normalized blocks and the current versions of everything they read."""
+        blocks, inputs, data = [], {}, {}
+        for block in code_blocks:
+            match = FILENAME.search(block.code)
+            blocks.append([block.language.lower(), normalize_code(block.language, block.code),
+                           match.group(1) if match else None])
+            for literal in _literals(block.language, block.code):
+                if "\n" in literal or not literal.strip():
+                    continue
+                path = os.path.join(work_dir, literal)
+                if os.path.isfile(path):
+                    inputs[literal] = _file_version(path)
+                for word in re.split(r"[\s,]+", literal):
+                    meta = os.path.join(MARKET_DATA_DIR, word.upper().replace("/", "_"), "meta.json")
+                    if word and len(word) <= 12 and os.path.isfile(meta):
+                        with open(meta) as f:
+                            version = json.load(f)
+                        data[word.upper()] = [version.get("start"), version.get("end"), version.get("rows"),
+                                              version.get("checked_on")]
+        material = {"blocks": blocks, "inputs": inputs, "data": data,
+                    "functions": hashlib.sha256(functions.encode("utf-8")).hexdigest()}
+        return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def ttl_for(self, code_blocks, exit_code):
+        if exit_code != 0:
+            return self.failure_ttl
+        if any(VOLATILE.search(block.code) or reads_today(block.code) for block in code_blocks):
+            return self.volatile_ttl
+        return self.ttl
+
+    # Lookups
+
+    def count_uncacheable(self):
+        with self._lock:
+            self.uncacheable += 1
+
+    def get(self, key, work_dir):
+        """The stored CommandLineCodeResult with its files restored into `work_dir`, or None."""
+        conn = self._conn()
+        row = conn.execute("SELECT exit_code, output, code_file, artifacts, seconds FROM entries "
+                           "WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        if row is not None and not self._restore(json.loads(row[3]), work_dir):
+            # A blob went missing (pruned by another process); run the code again
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.seconds_saved += row[4]
+        if row is None:
+            return None
+        conn.execute("UPDATE entries SET hits = hits + 1 WHERE key = ?", (key,))
+        exit_code, output, code_file, _, _ = row
+        if code_file:
+            code_file = os.path.join(work_dir, code_file)
+        return CommandLineCodeResult(exit_code=exit_code, output=output, code_file=code_file)
+
+    def set(self, keys, code_blocks, result, artifacts, seconds, work_dir):
+        """Store `result` and the files in `artifacts` (paths relative to `work_dir`) under every key."""
+        if result.exit_code == TIMEOUT_EXIT_CODE:
+            return False
+        stored = []
+        total = 0
+        for relative in sorted(artifacts):
+            path = os.path.join(work_dir, relative)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            total += size
+            if total > MAX_ARTIFACT_BYTES:
+                return False
+            stored.append({"path": relative, "sha": self._store_blob(path), "size": size})
+        code_file = result.code_file
+        if code_file and os.path.isabs(code_file):
+            code_file = os.path.relpath(code_file, work_dir)
+        now = time.time()
+        expires = now + self.ttl_for(code_blocks, result.exit_code)
+        code = "\n\n".join(block.code for block in code_blocks)
+        conn = self._conn()
+        for key in dict.fromkeys(keys):
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, code, exit_code, output, code_file, artifacts, seconds,"
+                " created, expires) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, code, result.exit_code, result.output, code_file, json.dumps(stored), seconds, now, expires))
+        return True
+
+    def _blob(self, sha):
+        return os.path.join(self.blobs, sha[:2], sha)
+
+    def _store_blob(self, path):
+        sha = _sha256_file(path)
+        blob = self._blob(sha)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            tmp = f"{blob}.{uuid.uuid4().hex}.tmp"
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, blob)
+        return sha
+
+    def _restore(self, artifacts, work_dir):
+        if not all(os.path.exists(self._blob(artifact["sha"])) for artifact in artifacts):
+            return False
+        for artifact in artifacts:
+            path = os.path.join(work_dir, artifact["path"])
+            if os.path.isfile(path) and os.path.getsize(path) == artifact["size"] \
+                    and _sha256_file(path) == artifact["sha"]:
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            shutil.copyfile(self._blob(artifact["sha"]), tmp)
+            os.replace(tmp, path)
+        return True
+
+    # Invalidation
+
+    def invalidate(self, match=None, before=None):
+        """Drop entries whose code contains `match` and/or that were created before `before`; returns how many."""
+        clauses, params = [], []
+        if match is not None:
+            clauses.append("instr(code, ?) > 0")
+            params.append(match)
+        if before is not None:
+            clauses.append("created < ?")
+            params.append(before)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        count = self._conn().execute("DELETE FROM entries" + where, params).rowcount
+        self.prune()
+        return count
+
+    def clear(self):
+        return self.invalidate()
+
+    def prune(self):
+        """Drop expired entries and the blobs no entry refers to any more."""
+        conn = self._conn()
+        conn.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),))
+        used = set()
+        for (artifacts,) in conn.execute("SELECT artifacts FROM entries"):
+            used.update(artifact["sha"] for artifact in json.loads(artifacts))
+        for root, _, names in os.walk(self.blobs):
+            for name in names:
+                if name not in used and not name.endswith(".tmp"):
+                    os.remove(os.path.join(root, name))
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def stats(self):
+        conn = self._conn()
+        entries, expired, hits = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(expires <= ?), 0), COALESCE(SUM(hits), 0) FROM entries",
+            (time.time(),)).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "uncacheable": self.uncacheable,
+            "seconds_saved": round(self.seconds_saved, 3),
+            "entries": entries,
+            "expired": expired,
+            "total_hits": hits,
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"Code cache: {stats['hits']} hits, {stats['misses']} misses, {stats['uncacheable']} not cacheable, "
+                f"{stats['seconds_saved']:.1f}s of execution saved")
+
+
+def _functions_source(executor):
+    functions = getattr(executor, "functions", None)
+    if not functions:
+        return ""
+    from autogen.coding.func_with_reqs import _build_python_functions_file
+
+    return _build_python_functions_file(functions)
+
+
+class CachingExecutor:
+    """A code executor that answers repeated code from an ExecCache; everything else is the wrapped one's."""
+
+    def __init__(self, inner, cache):
+        self.inner = inner
+        self.cache = cache
+        # Blocks answered from the cache whose variables the worker does not have yet,
+        # and the blocks the worker has run (their variables are there already)
+        self._skipped = []
+        self._ran = set()
+        self._functions = None
+
+    def __getattr__(self, attribute):
+        return getattr(self.inner, attribute)
+
+    @property
+    def code_extractor(self):
+        return self.inner.code_extractor
+
+    @property
+    def session_copy(self):
+        # Only where the wrapped executor has one (ChatEngine checks with hasattr)
+        copy = self.inner.session_copy
+        return lambda work_dir=None: CachingExecutor(copy(work_dir), self.cache)
+
+    @property
+    def work_dir(self):
+        return str(self.inner.work_dir)
+
+    @property
+    def stateful(self):
+        # The pool executor keeps each conversation's variables
+        return hasattr(self.inner, "conversation_id")
+
+    def cacheable(self, code_blocks):
+        if not self.stateful:
+            return True
+        return not any(free_names(block.code) for block in code_blocks
+                       if block.language.lower() in PYTHON_VARIANTS)
+
+    def execute_code_blocks(self, code_blocks):
+        if self._functions is None:
+            self._functions = _functions_source(self.inner)
+        work_dir = self.work_dir
+        if not self.cacheable(code_blocks):
+            self.cache.count_uncacheable()
+            return self._run(code_blocks)
+        before_key = self.cache.key(code_blocks, work_dir, self._functions)
+        result = self.cache.get(before_key, work_dir)
+        if result is not None:
+            if self.stateful:
+                self._skipped += [block for block in code_blocks if self._id(block) not in self._ran]
+            return result
+        before = snapshot(work_dir)
+        started = time.perf_counter()
+        result = self._run(code_blocks)
+        seconds = time.perf_counter() - started
+        after = snapshot(work_dir)
+        artifacts = [path for path, version in after.items()
+                     if before.get(path) != version and os.path.basename(path) != "functions.py"]
+        after_key = self.cache.key(code_blocks, work_dir, self._functions)
+        self.cache.set([before_key, after_key], code_blocks, result, artifacts, seconds, work_dir)
+        return result
+
+    def _id(self, block):
+        return hashlib.sha256(normalize_code(block.language, block.code).encode("utf-8")).hexdigest()
+
+    def _run(self, code_blocks):
+        self._ran.update(self._id(block) for block in code_blocks)
+        if self._skipped:
+            # Define what the cached blocks would have, without showing their output again
+            skipped, self._skipped = self._skipped, []
+            stream = getattr(self.inner, "stream", None)
+            if stream is not None:
+                self.inner.stream = False
+            try:
+                self.inner.execute_code_blocks(skipped)
+            finally:
+                if stream is not None:
+                    self.inner.stream = stream
+        return self.inner.execute_code_blocks(code_blocks)
+
+    def restart(self):
+        self._skipped = []
+        self._ran = set()
+        self.inner.restart()
+
+
+def get_exec_cache(path=DEFAULT_PATH):
+    """Process-wide ExecCache for `path`, or None when EXEC_CACHE=0."""
+    if os.environ.get("EXEC_CACHE", "1").lower() in ("0", "off", "false", "no"):
+        return None
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = ExecCache(path)
+        return cache
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Code execution cache: stats and invalidation")
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--invalidate", metavar="TEXT", help="drop entries whose code contains TEXT")
+    parser.add_argument("--older-than", type=float, metavar="HOURS", help="drop entries older than this")
+    parser.add_argument("--clear", action="store_true", help="drop every entry")
+    args = parser.parse_args()
+
+    cache = ExecCache(args.path)
+    if args.clear:
+        print(f"Dropped {cache.clear()} entries")
+    elif args.invalidate is not None or args.older_than is not None:
+        before = time.time() - args.older_than * 3600 if args.older_than is not None else None
+        print(f"Dropped {cache.invalidate(args.invalidate, before)} entries")
+    else:
+        cache.prune()
+        print(json.dumps(cache.stats(), indent=2))
@@ -0,0 +1,171 @@
+# Code executors for the Executor agents.
+#
+# PoolCodeExecutor is a LocalCommandLineCodeExecutor whose Python blocks run
+# on a warm worker from tool/worker_pool.py instead of a fresh interpreter;
+# shell blocks, `# filename:` handling, the functions module and execution
+# policies behave as in LocalCommandLineCodeExecutor. Each executor is one
+# conversation: variables survive from one block to the next.
+#
+# Only a bounded head and tail of each block's output go into the message; the
+# full output is spilled to output/ in the work dir (tool/output.py). While a
+# block runs, its output is shown live through the current IOStream.
+#
+# make_executor() picks the executor for the apps; CODE_EXECUTOR=local goes
+# back to a fresh interpreter per block (LocalCodeExecutor). Either kind makes
+# a session_copy() per ChatEngine session, in the session's own work dir. Repeated code is answered from the
+# execution cache (tool/exec_cache.py) unless EXEC_CACHE=0.
+
+import os
+import statistics
+import uuid
+from collections import Counter
+from hashlib import md5
+
+from autogen.code_utils import PYTHON_VARIANTS
+from autogen.coding import LocalCommandLineCodeExecutor
+from autogen.coding.base import CommandLineCodeResult
+from autogen.coding.utils import _get_file_name_from_content, silence_pip
+from autogen.io import IOStream
+
+from tool.exec_cache import CachingExecutor, get_exec_cache
+from tool.output import DEFAULT_MAX_CHARS, bound_text, spill_path
+from tool.streaming import TokenStream
+from tool.worker_pool import get_worker_pool
+
+
+def stream_output(chunk):
+    """Pass live code output to the current IOStream."""
+    iostream = IOStream.get_default()
+    if isinstance(iostream, TokenStream):
+        iostream.output(chunk)
+    else:
+        iostream.print(chunk, end="", flush=True)
+
+
+class LocalCodeExecutor(LocalCommandLineCodeExecutor):
+    """LocalCommandLineCodeExecutor that ChatEngine can copy into each session's work dir."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._kwargs = kwargs
+
+    def session_copy(self, work_dir=None):
+        """The same executor in `work_dir` (a fresh interpreter per block keeps no state to separate)."""
+        if work_dir is None:
+            return self
+        return LocalCodeExecutor(**dict(self._kwargs, work_dir=work_dir))
+
+
+class PoolCodeExecutor(LocalCommandLineCodeExecutor):
+    """Runs Python blocks on a warm, stateful worker; everything else as usual."""
+
+    def __init__(self, pool=None, conversation_id=None, max_output_chars=DEFAULT_MAX_CHARS, stream=True,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self._kwargs = kwargs
+        self.pool = pool
+        self.conversation_id = conversation_id or uuid.uuid4().hex
+        self.max_output_chars = max_output_chars
+        self.stream = stream
+        self.latencies = []  # (language, seconds) per executed block
+        self.output_stats = Counter()  # bytes printed and bytes/tokens kept out of messages
+
+    def session_copy(self, work_dir=None):
+        """A new conversation on the same pool (used by ChatEngine per session), in `work_dir` if given."""
+        kwargs = dict(self._kwargs, work_dir=work_dir) if work_dir is not None else self._kwargs
+        return PoolCodeExecutor(pool=self.pool, max_output_chars=self.max_output_chars, stream=self.stream,
+                                **kwargs)
+
+    def _pool(self):
+        if self.pool is None:
+            self.pool = get_worker_pool()
+        return self.pool
+
+    def _execute_code_dont_check_setup(self, code_blocks):
+        output = ""
+        exit_code = 0
+        file_names = []
+        for code_block in code_blocks:
+            lang, code = code_block.language.lower(), code_block.code
+            if lang not in PYTHON_VARIANTS:
+                # Shell and friends: a subprocess, as before
+                result = super()._execute_code_dont_check_setup([code_block])
+                block_output, stats = bound_text(
+                    result.output, spill_path(self._work_dir, result.code_file or f"{lang}_output"),
+                    max_chars=self.max_output_chars, relative_to=self._work_dir)
+                self.output_stats.update(stats)
+                output += block_output
+                exit_code = result.exit_code
+                if result.code_file:
+                    file_names.append(result.code_file)
+                if exit_code != 0:
+                    break
+                continue
+
+            LocalCommandLineCodeExecutor.sanitize_command("python", code)
+            code = silence_pip(code, "python")
+            try:
+                filename = _get_file_name_from_content(code, self._work_dir)
+            except ValueError:
+                return CommandLineCodeResult(exit_code=1, output="Filename is not in the workspace")
+            if filename is None:
+                filename = f"tmp_code_{md5(code.encode()).hexdigest()}.py"
+            written_file = (self._work_dir / filename).resolve()
+            written_file.write_text(code, encoding="utf-8")
+            file_names.append(str(written_file))
+
+            if not self.execution_policies.get("python", False):
+                output += f"Code saved to {written_file}\n"
+                continue
+
+            exit_code, block_output, seconds, stats = self._pool().run(
+                self.conversation_id, code, str(written_file), str(self._work_dir), timeout=float(self._timeout),
+                on_output=stream_output if self.stream else None, max_chars=self.max_output_chars)
+            self.latencies.append(("python", seconds))
+            self.output_stats.update(stats)
+            output += block_output
+            if exit_code != 0:
+                break
+
+        return CommandLineCodeResult(exit_code=exit_code, output=output,
+                                     code_file=file_names[0] if file_names else None)
+
+    def restart(self):
+        """Forget this conversation's variables."""
+        self._pool().drop(self.conversation_id)
+
+    def latency_summary(self):
+        seconds = [s for _, s in self.latencies]
+        if not seconds:
+            return "No code blocks run yet"
+        return (f"{len(seconds)} code blocks, median {statistics.median(seconds):.2f}s, "
+                f"max {max(seconds):.2f}s per block")
+
+    def output_summary(self):
+        stats = self.output_stats
+        return (f"Code output: {stats['bytes']:,} bytes printed, {stats['bytes_saved']:,} bytes "
+                f"(~{stats['tokens_saved']:,} tokens) kept out of the chat, {stats['spilled']} outputs spilled to files")
+
+
+def make_executor(cache=True, **kwargs):
+    """PoolCodeExecutor, or LocalCodeExecutor when CODE_EXECUTOR=local.
+
+    `cache` is an ExecCache, True for the shared one (if EXEC_CACHE allows) or False.
+    """
+    if os.environ.get("CODE_EXECUTOR", "pool") == "local":
+        executor = LocalCodeExecutor(**kwargs)
+    else:
+        executor = PoolCodeExecutor(**kwargs)
+    if cache is True:
+        cache = get_exec_cache()
+    return CachingExecutor(executor, cache) if cache else executor
+
+
+def output_summary(executor):
+    """The executor's output summary, or None if it does not keep one."""
+    # Through the cache and recording wrappers
+    while not isinstance(executor, PoolCodeExecutor) and hasattr(executor, "inner"):
+        executor = executor.inner
+    if isinstance(executor, PoolCodeExecutor):
+        return executor.output_summary()
+    return None
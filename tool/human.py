@@ -0,0 +1,136 @@
+# Human input for agents, answered from a chat UI.
+#
+# autogen asks for human input through the agent's get_human_input /
+# a_get_human_input, which read from the console. HumanInput replaces both on
+# the agents it is attached to: an agent that asks shows its prompt in the UI
+# (on_prompt) and waits on a future of its own, without holding a thread or
+# the event loop, until the UI's callback calls reply() from any thread or
+# loop. One HumanInput per session, so any number of sessions can each have
+# a chat waiting on its person at the same time:
+#
+#     human = HumanInput(on_prompt=show)        # show(agent_name, prompt)
+#     chat = engine.new_session(human_input=human)
+#     ...
+#     human.reply(text)    # in the chat widget's callback
+#     human.close()        # when the session ends: a waiting agent gets "exit"
+#
+# A reply that comes while nobody is asking is kept for the next question.
+
+import asyncio
+import inspect
+import threading
+from collections import deque
+from concurrent.futures import CancelledError, Future, InvalidStateError
+
+EXIT = "exit"  # autogen ends the conversation on this reply
+
+
+class HumanInput:
+    """One session's answers from a person to the agents that ask for them."""
+
+    def __init__(self, on_prompt=None):
+        # on_prompt(agent name, prompt) is called when an agent asks; async chats may pass a coroutine function
+        self.on_prompt = on_prompt
+        self.closed = False
+        self._pending = None  # the Future of the agent waiting now
+        self._replies = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        """Whether an agent is waiting for a reply right now."""
+        with self._lock:
+            return self._pending is not None
+
+    def attach(self, agents):
+        """Take over the human input of the agents that ask for it (human_input_mode other than NEVER)."""
+        for agent in agents:
+            if agent.human_input_mode != "NEVER":
+                agent.get_human_input = self._getter(agent)
+                agent.a_get_human_input = self._async_getter(agent)
+
+    def _getter(self, agent):
+        # For synchronous chats, run on a thread of their own: blocks that thread until the reply
+        def get_human_input(prompt):
+            future = self._ask()
+            try:
+                if self.on_prompt is not None:
+                    self.on_prompt(agent.name, prompt)
+                return self._answer(agent, future)
+            finally:
+                self._forget(future)
+
+        return get_human_input
+
+    def _async_getter(self, agent):
+        async def a_get_human_input(prompt):
+            future = self._ask()
+            try:
+                if self.on_prompt is not None:
+                    shown = self.on_prompt(agent.name, prompt)
+                    if inspect.isawaitable(shown):
+                        await shown
+                try:
+                    await asyncio.wrap_future(future)
+                except CancelledError:
+                    pass
+                return self._answer(agent, future)
+            finally:
+                # The chat task may be cancelled while waiting: nobody waits on this future any more
+                self._forget(future)
+
+        return a_get_human_input
+
+    def _ask(self):
+        future = Future()
+        with self._lock:
+            if self.closed:
+                future.set_result(EXIT)
+            elif self._replies:
+                future.set_result(self._replies.popleft())
+            else:
+                self._pending = future
+        return future
+
+    def _answer(self, agent, future):
+        try:
+            reply = future.result()
+        except CancelledError:
+            reply = EXIT
+        self._forget(future)
+        # As autogen's own get_human_input does
+        agent._human_input.append(reply)
+        return reply
+
+    def _forget(self, future):
+        with self._lock:
+            if self._pending is future:
+                self._pending = None
+
+    def reply(self, text):
+        """Answer the waiting agent, or the next one to ask; returns whether an agent was waiting."""
+        with self._lock:
+            future, self._pending = self._pending, None
+            if future is None or future.done():
+                self._replies.append(text)
+                return False
+        try:
+            future.set_result(text)
+        except InvalidStateError:
+            # Cancelled since: keep the text for the next question
+            with self._lock:
+                self._replies.append(text)
+            return False
+        return True
+
+    def close(self):
+        """The person is gone: the waiting agent and any that ask later get "exit"."""
+        with self._lock:
+            self.closed = True
+            future, self._pending = self._pending, None
+            self._replies.clear()
+        if future is not None and not future.done():
+            try:
+                future.set_result(EXIT)
+            except InvalidStateError:
+                pass
@@ -0,0 +1,546 @@
+# Durable job queue and worker tier for report runs.
+#
+# In-process runs (tool/loop.py) die with the Streamlit/Panel process, and the
+# UI cannot be scaled apart from the agents. With the job queue the UI only
+# submits a task and renders what the job posts. The chats run in separate
+# worker processes, as many as the box has room for, sharing one SQLite
+# database (JOB_DB, default .cache/jobs.sqlite):
+#
+#     python -m tool.jobs work --processes 4 --concurrency 4   # worker tier
+#     JOB_QUEUE=1 streamlit run autogen_st_3.py                # thin client
+#
+#     python -m tool.jobs submit "Write a report on NVDA"      # prints the job id
+#     python -m tool.jobs stream <job id>                      # follow its messages
+#     python -m tool.jobs status
+#
+# A job names a pipeline: a "module:function" in PIPELINES that builds a
+# ChatEngine from the job's llm_config. Workers heartbeat. The running jobs
+# of a worker that stops heartbeating go back to the queue (up to
+# MAX_ATTEMPTS runs), so a crashed or restarted worker does not lose them.
+# Follow-up jobs (Admin feedback) go to the worker that still holds the
+# conversation when it is alive; any other worker, and a requeued job,
+# rebuild the conversation from its checkpoint log (tool/checkpoints.py)
+# under the job's session id.
+
+import argparse
+import asyncio
+import functools
+import importlib
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from tool.checkpoints import RunLog
+from tool.events import MESSAGE, get_bus
+from tool.loop import ChatRun, get_loop, submit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PATH = os.path.join(".cache", "jobs.sqlite")
+PIPELINES = {"report": "report_team:build_engine"}
+ACTIVE = ("queued", "running", "cancelling")
+MAX_ATTEMPTS = 3
+HEARTBEAT = 5  # seconds between worker heartbeats
+STALE_AFTER = 30  # a worker not seen for this long is presumed dead
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    pipeline TEXT NOT NULL,
+    config TEXT NOT NULL,
+    task TEXT,
+    message TEXT NOT NULL,
+    session TEXT NOT NULL,
+    affinity TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    live TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS messages (
+    job TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (job, seq)
+);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    pid INTEGER,
+    started REAL,
+    seen REAL
+);
+"""
+
+
+def _job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    for key in ("config", "live", "result"):
+        job[key] = json.loads(job[key]) if job[key] else None
+    return job
+
+
+class JobStore:
+    """The job queue, job messages and worker heartbeats in one SQLite file."""
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("JOB_DB", DEFAULT_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        # One connection per thread; agents post messages from several threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # Client side
+
+    def submit(self, task, pipeline="report", config=None, message=None, session=None, affinity=None):
+        """Queue a job; returns its id. Follow-ups pass the `session` to continue."""
+        job_id = uuid.uuid4().hex[:12]
+        self._conn().execute(
+            "INSERT INTO jobs (id, pipeline, config, task, message, session, affinity, status, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?)",
+            (job_id, pipeline, json.dumps(config or {}), task, message or task, session or job_id, affinity,
+             time.time()))
+        return job_id
+
+    def get(self, job_id):
+        return _job(self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def position(self, job_id):
+        """1-based place of a queued job in the queue, 0 otherwise."""
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created <= "
+            "(SELECT created FROM jobs WHERE id = ? AND status = 'queued')", (job_id,)).fetchone()
+        return row[0]
+
+    def messages(self, job_id, since=0):
+        rows = self._conn().execute(
+            "SELECT body FROM messages WHERE job = ? AND seq >= ? ORDER BY seq", (job_id, since))
+        return [json.loads(body) for body, in rows]
+
+    def stream(self, job_id, since=0, poll=0.25):
+        """Yield the job's messages as they are posted, until it has finished."""
+        while True:
+            job = self.get(job_id)
+            messages = self.messages(job_id, since)
+            yield from messages
+            since += len(messages)
+            if job is None or job["status"] not in ACTIVE:
+                if not messages:
+                    return
+                continue
+            time.sleep(poll)
+
+    def cancel(self, job_id):
+        conn = self._conn()
+        cancelled = conn.execute("UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+                                 (time.time(), job_id)).rowcount
+        if not cancelled:
+            # The worker running it notices on its next poll
+            conn.execute("UPDATE jobs SET status = 'cancelling' WHERE id = ? AND status = 'running'", (job_id,))
+
+    def stats(self):
+        conn = self._conn()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        workers = conn.execute("SELECT COUNT(*) FROM workers WHERE seen > ?", (time.time() - STALE_AFTER,)).fetchone()[0]
+        return {"jobs": counts, "workers": workers}
+
+    # Worker side
+
+    def heartbeat(self, worker_id):
+        self._conn().execute("INSERT INTO workers (id, pid, started, seen) VALUES (?, ?, ?, ?) "
+                             "ON CONFLICT(id) DO UPDATE SET seen = excluded.seen",
+                             (worker_id, os.getpid(), time.time(), time.time()))
+
+    def claim(self, worker_id, pipelines=None):
+        """Take the oldest queued job this worker may run, or None."""
+        conn = self._conn()
+        fresh = time.time() - STALE_AFTER
+        names = list(pipelines or PIPELINES)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' AND pipeline IN (%s) "
+                "AND (affinity IS NULL OR affinity = ? OR affinity NOT IN (SELECT id FROM workers WHERE seen > ?)) "
+                "ORDER BY created LIMIT 1" % ",".join("?" * len(names)),
+                (*names, worker_id, fresh)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', worker = ?, started = ?, attempts = attempts + 1 "
+                             "WHERE id = ?", (worker_id, time.time(), row[0]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row[0]) if row is not None else None
+
+    def post(self, job_id, message):
+        self._conn().execute(
+            "INSERT INTO messages (job, seq, body) "
+            "SELECT ?, COALESCE(MAX(seq) + 1, 0), ? FROM messages WHERE job = ?",
+            (job_id, json.dumps(message, default=str), job_id))
+
+    def set_live(self, job_id, live):
+        self._conn().execute("UPDATE jobs SET live = ? WHERE id = ?", (json.dumps(live, default=str), job_id))
+
+    def statuses(self, job_ids):
+        if not job_ids:
+            return {}
+        rows = self._conn().execute("SELECT id, status FROM jobs WHERE id IN (%s)" % ",".join("?" * len(job_ids)),
+                                    list(job_ids))
+        return dict(rows.fetchall())
+
+    def finish(self, job_id, status, error=None, result=None, live=None):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, finished = ?, error = ?, result = ?, live = ? WHERE id = ?",
+            (status, time.time(), error, json.dumps(result, default=str) if result is not None else None,
+             json.dumps(live) if live else None, job_id))
+
+    def requeue_stale(self):
+        """Put the jobs of dead workers back in the queue; returns how many."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, attempts FROM jobs WHERE status IN ('running', 'cancelling') "
+                "AND worker NOT IN (SELECT id FROM workers WHERE seen > ?)", (time.time() - STALE_AFTER,)).fetchall()
+            for job_id, attempts in rows:
+                if attempts >= MAX_ATTEMPTS:
+                    conn.execute("UPDATE jobs SET status = 'failed', finished = ?, error = ?, live = NULL WHERE id = ?",
+                                 (time.time(), f"Lost its worker {attempts} times", job_id))
+                    continue
+                # It starts over, so drop what the lost run posted
+                conn.execute("DELETE FROM messages WHERE job = ?", (job_id,))
+                conn.execute("UPDATE jobs SET status = 'queued', worker = NULL, started = NULL, live = NULL "
+                             "WHERE id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """Process-wide JobStore on JOB_DB."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JobStore()
+        return _store
+
+
+class JobRun:
+    """A job as a UI sees it: the attributes the apps read from a ChatRun."""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.id = job_id
+        # UI bookkeeping, kept across reruns like ChatRun.state
+        self.state = {}
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the job (once per rerun)."""
+        self.job = self.store.get(self.id) or {"status": "failed", "error": f"Unknown job {self.id}"}
+        prompt = (self.job.get("live") or {}).get("admin_prompt")
+        if prompt and prompt != self.state.get("admin_prompt_seen"):
+            self.state["admin_prompt_seen"] = self.state["admin_prompt"] = prompt
+
+    @property
+    def task(self):
+        return self.job.get("task")
+
+    @property
+    def status(self):
+        return self.job["status"]
+
+    @property
+    def running(self):
+        return self.status in ACTIVE
+
+    @property
+    def position(self):
+        return self.store.position(self.id)
+
+    @property
+    def messages(self):
+        return self.store.messages(self.id)
+
+    def messages_since(self, index):
+        return self.store.messages(self.id, index)
+
+    @property
+    def partial(self):
+        return (self.job.get("live") or {}).get("partial")
+
+    @property
+    def ttft(self):
+        return (self.job.get("live") or {}).get("ttft") or {}
+
+    @property
+    def error(self):
+        return self.job.get("error")
+
+    @property
+    def summaries(self):
+        return (self.job.get("result") or {}).get("summaries", [])
+
+    @property
+    def metrics_rows(self):
+        return (self.job.get("result") or {}).get("metrics", [])
+
+    def follow_up(self, message):
+        """Queue `message` (Admin feedback) in this job's conversation; returns the new JobRun."""
+        job_id = self.store.submit(self.task, pipeline=self.job["pipeline"], config=self.job["config"],
+                                   message=message, session=self.job["session"], affinity=self.job["worker"])
+        return JobRun(self.store, job_id)
+
+    def cancel(self):
+        self.store.cancel(self.id)
+
+
+def load_pipeline(name):
+    """The module and engine builder of a pipeline ("report" or "module:function")."""
+    module_name, function = PIPELINES.get(name, name).split(":")
+    module = importlib.import_module(module_name)
+    return module, getattr(module, function)
+
+
+class JobWorker:
+    """Claims jobs and runs up to `concurrency` of them at once on the shared loop."""
+
+    def __init__(self, store, concurrency=4, pipelines=None, poll=0.5, max_sessions=32):
+        self.store = store
+        self.concurrency = concurrency
+        self.pipelines = list(pipelines or PIPELINES)
+        self.poll = poll
+        self.max_sessions = max_sessions
+        self.id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.engines = {}
+        self.sessions = OrderedDict()  # conversation (root job id) -> ChatSession
+        self.active = {}  # job id -> (asyncio task, ChatRun)
+        self._live = {}
+        self.completed = 0
+
+    def engine_for(self, pipeline, config):
+        key = (pipeline, json.dumps(config, sort_keys=True))
+        if key not in self.engines:
+            module, build = load_pipeline(pipeline)
+            self.engines[key] = module, build(**config)
+        return self.engines[key]
+
+    async def serve(self, stop):
+        loop = asyncio.get_running_loop()
+        beat = 0.0
+        while not stop.is_set() or self.active:
+            if time.monotonic() - beat >= HEARTBEAT:
+                beat = time.monotonic()
+                await loop.run_in_executor(None, self.store.heartbeat, self.id)
+                await loop.run_in_executor(None, self.store.requeue_stale)
+            while not stop.is_set() and len(self.active) < self.concurrency:
+                job = await loop.run_in_executor(None, self.store.claim, self.id, self.pipelines)
+                if job is None:
+                    break
+                run = ChatRun(task=job["task"], context=_token_stream)
+                run.id = job["id"]
+                self.active[job["id"]] = (asyncio.ensure_future(self._run(job, run)), run)
+            await self._sync(loop)
+            await asyncio.sleep(self.poll)
+
+    async def _sync(self, loop):
+        # Publish what the UI shows while a job runs, and pick up cancellations;
+        # the SQLite calls go to a worker thread, not the loop the chats run on
+        active = list(self.active.items())
+        if not active:
+            return
+        statuses = await loop.run_in_executor(None, self.store.statuses, [job_id for job_id, _ in active])
+        updates = {}
+        for job_id, (task, run) in active:
+            if statuses.get(job_id) == "cancelling":
+                task.cancel()
+            live = {"partial": run.partial, "ttft": run.ttft, "admin_prompt": run.state.get("admin_prompt")}
+            if live != self._live.get(job_id):
+                self._live[job_id] = updates[job_id] = json.loads(json.dumps(live, default=str))
+        if updates:
+            await loop.run_in_executor(None, self._set_live, updates)
+
+    def _set_live(self, updates):
+        for job_id, live in updates.items():
+            self.store.set_live(job_id, live)
+
+    async def _run(self, job, run):
+        job_id = job["id"]
+        result = None
+        sink = None
+        try:
+            module, engine = self.engine_for(job["pipeline"], job["config"])
+            session = self.sessions.pop(job["session"], None)
+            message = job["message"]
+            if session is not None:
+                chat = session.a_continue(message=message)
+            else:
+                # One work dir per conversation, so follow-ups find its files
+                from tool.engine import session_work_dir
+                session = engine.new_session(work_dir=session_work_dir(job["session"]))
+                if _resumable(session, job):
+                    # A follow-up on a conversation this worker does not hold, or a
+                    # requeued job: rebuild it from its run log, no LLM calls replayed
+                    follow_up = job["session"] != job_id
+                    chat = session.a_resume(job["session"], message=message if follow_up else None)
+                else:
+                    chat = session.a_initiate_chat(message=message, run_id=job["session"])
+            self.sessions[job["session"]] = session
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            # Written to SQLite on a worker thread, not on the loop the chats run on
+            sink = get_bus().subscribe(
+                lambda event: self.store.post(job_id, {"name": event.name, "content": event.content}),
+                kinds=(MESSAGE,), run=run, threaded=True, name="job store")
+            await run._main(chat)
+            summaries = getattr(module, "summaries", None)
+            result = {"summaries": summaries(session) if summaries else [],
+                      "metrics": session.metrics.summary_rows() if session.metrics is not None else []}
+            status, error = run.status, (str(run.error) if run.error is not None else None)
+        except asyncio.CancelledError:
+            status, error = "cancelled", None
+        except Exception as e:
+            status, error = "failed", f"{type(e).__name__}: {e}"
+        finally:
+            if sink is not None:
+                get_bus().unsubscribe(sink)
+            self.active.pop(job_id, None)
+            self._live.pop(job_id, None)
+        # A prompt for Admin feedback outlives the run
+        prompt = run.state.get("admin_prompt")
+        # A write and a commit: on a worker thread, like the other store calls of the worker
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self.store.finish, job_id, status, error=error, result=result,
+                                    live={"admin_prompt": prompt} if prompt else None))
+        self.completed += 1
+
+
+def _resumable(session, job):
+    if session.checkpoints is None:
+        return False
+    rounds = RunLog(job["session"], session.checkpoints.directory).rounds()
+    # A requeued first job resumes only once its log has more than the task
+    return bool(rounds) and (job["session"] != job["id"] or len(rounds) > 1)
+
+
+def _token_stream(run):
+    # Imported late: tool.streaming needs autogen, the client side does not
+    from tool.streaming import token_stream
+    return token_stream(run)
+
+
+def work(concurrency, pipelines=None):
+    """Run one worker in this process until SIGINT/SIGTERM."""
+    worker = JobWorker(get_job_store(), concurrency=concurrency, pipelines=pipelines)
+    stop = asyncio.Event()
+    future = submit(_serve(worker, stop))
+
+    def shutdown(*_):
+        print(f"[jobs] worker {worker.id} finishing its {len(worker.active)} running jobs", flush=True)
+        get_loop().call_soon_threadsafe(stop.set)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    print(f"[jobs] worker {worker.id} up, {concurrency} concurrent jobs", flush=True)
+    while not future.done():
+        time.sleep(0.5)
+    future.result()
+    print(f"[jobs] worker {worker.id} stopped after {worker.completed} jobs", flush=True)
+
+
+async def _serve(worker, stop):
+    await worker.serve(stop)
+
+
+def spawn(processes, concurrency, pipelines=None):
+    """Start `processes` worker processes and restart any that exit until interrupted."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (ROOT, os.getcwd(), env.get("PYTHONPATH")) if p)
+    command = [sys.executable, "-m", "tool.jobs", "work", "--processes", "1", "--concurrency", str(concurrency)]
+    for pipeline in pipelines or ():
+        command += ["--pipeline", pipeline]
+    children = [subprocess.Popen(command, env=env) for _ in range(processes)]
+    try:
+        while True:
+            time.sleep(1)
+            for i, child in enumerate(children):
+                if child.poll() is not None:
+                    print(f"[jobs] worker process {child.pid} exited ({child.returncode}); restarting", flush=True)
+                    children[i] = subprocess.Popen(command, env=env)
+    except KeyboardInterrupt:
+        # Let the workers finish their running jobs; a second Ctrl-C does not cut that short
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for child in children:
+            child.send_signal(signal.SIGTERM)
+        for child in children:
+            child.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Durable job queue for report runs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker_args = commands.add_parser("work", help="run job workers")
+    worker_args.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    worker_args.add_argument("--concurrency", type=int, default=4, help="concurrent jobs per process")
+    worker_args.add_argument("--pipeline", action="append", dest="pipelines",
+                             help="pipeline to take jobs for (default: all in PIPELINES)")
+    submit_args = commands.add_parser("submit", help="queue a task and print its job id")
+    submit_args.add_argument("task")
+    submit_args.add_argument("--pipeline", default="report")
+    submit_args.add_argument("--config", default='{"model": "gpt-4o-mini", "temperature": 0, "seed": 1234}',
+                             help="llm_config as JSON")
+    stream_args = commands.add_parser("stream", help="print a job's messages as they come in")
+    stream_args.add_argument("job")
+    cancel_args = commands.add_parser("cancel", help="cancel a job")
+    cancel_args.add_argument("job")
+    commands.add_parser("status", help="job counts and live workers")
+    args = parser.parse_args()
+
+    if args.command == "work":
+        if args.processes > 1:
+            spawn(args.processes, args.concurrency, args.pipelines)
+        else:
+            work(args.concurrency, args.pipelines)
+    elif args.command == "submit":
+        print(get_job_store().submit(args.task, pipeline=args.pipeline, config=json.loads(args.config),
+                                     message=f"Admin initiated the task: {args.task}"))
+    elif args.command == "stream":
+        for message in get_job_store().stream(args.job):
+            print(f"{message['name']}: {message['content']}\n", flush=True)
+        job = get_job_store().get(args.job)
+        print(f"[{job['status']}]" + (f" {job['error']}" if job["error"] else ""))
+    elif args.command == "cancel":
+        get_job_store().cancel(args.job)
+    else:
+        print(json.dumps(get_job_store().stats(), indent=2))
@@ -0,0 +1,243 @@
+# Disk-backed LLM completion cache with a size cap and LRU eviction.
+#
+# All apps pin temperature=0 and a seed, so identical requests give identical
+# answers. LLMCache implements autogen's cache protocol (get/set/close and the
+# context manager methods), so it can be passed as `cache=` to
+# initiate_chat()/a_initiate_chat(); the GroupChatManager hands it to every
+# agent in the group chat. autogen 0.2 makes its speaker-selection calls
+# ("auto") on agents of its own with cache=None, but builds them from the
+# manager's llm_config, whose entries override that: ChatEngine puts the
+# session's cache there (tool/engine.py), so those calls are cached too.
+# autogen deep-copies llm_configs; the caches return themselves instead.
+#
+# Entries live in one SQLite file in WAL mode, so several Streamlit/Panel
+# worker processes can share it safely. Keys are normalized before hashing:
+# leading and trailing whitespace of messages and empty fields are ignored
+# and transport-only parameters ("stream") are dropped, so a streamed and a
+# non-streamed request for the same prompt share an entry. Whitespace inside
+# a message (code indentation, line breaks) is part of the prompt.
+#
+# To exercise it without the network, point the llm_config at any local
+# OpenAI-compatible server ({"base_url": "http://127.0.0.1:8000/v1", ...}).
+
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.path.join(".cache", "llm_cache.sqlite")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Request parameters that do not change the completion
+IGNORED_PARAMS = ("stream", "cache", "cache_seed", "agent", "context")
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def normalize_messages(messages):
+    normalized = []
+    for message in messages:
+        message = {k: v for k, v in message.items() if v not in (None, "", [], {})}
+        if isinstance(message.get("content"), str):
+            message["content"] = message["content"].strip()
+        normalized.append(message)
+    return normalized
+
+
+def normalize_key(key):
+    """Hash of the request with model, parameters and normalized messages."""
+    try:
+        params = json.loads(key)
+    except (TypeError, ValueError):
+        params = None
+    if isinstance(params, dict):
+        params = {k: v for k, v in params.items() if k not in IGNORED_PARAMS}
+        if isinstance(params.get("messages"), list):
+            params["messages"] = normalize_messages(params["messages"])
+        key = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(str(key).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """SQLite-backed completion cache shared by threads and processes."""
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES, max_entries=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, conn, name, n=1):
+        conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, n),
+        )
+
+    # autogen cache protocol
+
+    def get(self, key, default=None):
+        conn = self._conn()
+        digest = normalize_key(key)
+        row = conn.execute("SELECT value FROM entries WHERE key = ?", (digest,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            self._count(conn, "misses")
+            return default
+        conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), digest))
+        self._count(conn, "hits")
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            # Written by an incompatible library version; treat as a miss
+            return default
+
+    def set(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (normalize_key(key), data, len(data), now, now),
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # autogen wraps every lookup in `with cache:`; the cache is shared by the
+        # whole process, so keep the connection open and let close() end it
+        pass
+
+    def __deepcopy__(self, memo):
+        # Shared, not copied, when autogen copies an llm_config holding it
+        return self
+
+    # Size management
+
+    def _over_limit(self, count, total):
+        if count <= 1:
+            return False
+        return total > self.max_bytes or bool(self.max_entries and count > self.max_entries)
+
+    def _evict(self, conn):
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        evicted = 0
+        while self._over_limit(count, total):
+            # Drop the least recently used entries in small batches
+            rows = conn.execute("SELECT key, size FROM entries ORDER BY last_access LIMIT 32").fetchall()
+            for key, size in rows:
+                if not self._over_limit(count, total):
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                count -= 1
+                total -= size
+                evicted += 1
+        if evicted:
+            self._count(conn, "evictions", evicted)
+            with self._lock:
+                self.evictions += evicted
+
+    def clear(self):
+        self._conn().execute("DELETE FROM entries")
+
+    def stats(self):
+        """Counters for this process plus totals shared by all processes."""
+        conn = self._conn()
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        shared = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": total,
+            "total_hits": shared.get("hits", 0),
+            "total_misses": shared.get("misses", 0),
+            "total_evictions": shared.get("evictions", 0),
+        }
+
+
+class NoCache:
+    """autogen's cache protocol without hits, so every completion is requested."""
+
+    def get(self, key, default=None):
+        return default
+
+    def set(self, key, value):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def get_llm_cache(path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES, max_entries=None):
+    """Process-wide LLMCache for `path` (created on first use)."""
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = LLMCache(path, max_bytes=max_bytes, max_entries=max_entries)
+        return cache
+
+
+if __name__ == '__main__':
+    print(get_llm_cache().stats())
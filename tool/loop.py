@@ -0,0 +1,285 @@
+# One long-lived asyncio loop per server process, running on its own thread.
+#
+# Chat runs are submitted to the loop as tasks instead of blocking the
+# Streamlit script thread in run_until_complete() for the whole conversation.
+# The messages the agents send reach the ChatRun of the task they run in
+# (current_run()) through the event bus (tool/events.py), and the UI polls
+# run.messages on each rerun.
+#
+# Admission caps how many runs the process works on at once (MAX_RUNNING_CHATS,
+# default 8). Runs beyond that wait in a bounded FIFO queue (MAX_QUEUED_CHATS,
+# default 32) and know their position in it; when the queue is full as well,
+# start_run() returns a run that is rejected straight away.
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+_loop = None
+_lock = threading.Lock()
+_current_run = contextvars.ContextVar("current_run", default=None)
+
+
+def get_loop():
+    """Return the shared background event loop, starting it on first use."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            # LLM calls and code execution block a thread each; the default
+            # pool (CPUs + 4 threads) would serialize concurrent chats
+            loop.set_default_executor(ThreadPoolExecutor(int(os.environ.get("LOOP_THREADS", 64)),
+                                                         thread_name_prefix="autogen-worker"))
+            thread = threading.Thread(target=loop.run_forever, name="autogen-loop", daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the background loop; returns a concurrent Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def current_run():
+    """The ChatRun of the conversation the caller is executing in, if any."""
+    return _current_run.get()
+
+
+class ServerBusy(RuntimeError):
+    pass
+
+
+class Admission:
+    """At most `max_running` runs at a time; up to `max_queued` more wait in line."""
+
+    def __init__(self, max_running=8, max_queued=32):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+
+    def enter(self, run):
+        """Admit `run` or queue it (called from the UI thread); raises ServerBusy."""
+        with self._lock:
+            if self.running < self.max_running and not self._queue:
+                self.running += 1
+                self.admitted += 1
+                run._admitted = True
+            elif len(self._queue) < self.max_queued:
+                self._queue.append(run)
+                run.status = "queued"
+                run.queued = time.time()
+            else:
+                self.rejected += 1
+                raise ServerBusy(f"The server is busy ({self.running} chats running, "
+                                 f"{len(self._queue)} waiting). Please try again in a minute.")
+
+    async def wait(self, run):
+        """Return once `run` has a slot (on the loop thread)."""
+        with self._lock:
+            if run._admitted:
+                return
+            run._slot = asyncio.get_running_loop().create_future()
+        try:
+            await run._slot
+        except asyncio.CancelledError:
+            self.leave(run)
+            raise
+
+    def leave(self, run):
+        """Give up `run`'s slot or place in the queue and admit the next run."""
+        with self._lock:
+            if run in self._queue:
+                self._queue.remove(run)
+                return
+            if not run._admitted:
+                return
+            run._admitted = False
+            self.running -= 1
+            while self._queue and self.running < self.max_running:
+                waiting = self._queue.popleft()
+                self.running += 1
+                self.admitted += 1
+                waiting._admitted = True
+                if waiting._slot is not None:
+                    # Futures are resolved on the loop they belong to
+                    waiting._slot.get_loop().call_soon_threadsafe(_resolve, waiting._slot)
+
+    def position(self, run):
+        """1-based place of `run` in the queue, or 0 if it is not waiting."""
+        with self._lock:
+            try:
+                return self._queue.index(run) + 1
+            except ValueError:
+                return 0
+
+    def stats(self):
+        with self._lock:
+            return {"running": self.running, "queued": len(self._queue), "max_running": self.max_running,
+                    "max_queued": self.max_queued, "admitted": self.admitted, "rejected": self.rejected}
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+_admission = None
+
+
+def get_admission():
+    """The process-wide Admission, sized from MAX_RUNNING_CHATS / MAX_QUEUED_CHATS."""
+    global _admission
+    with _lock:
+        if _admission is None:
+            _admission = Admission(int(os.environ.get("MAX_RUNNING_CHATS", 8)),
+                                   int(os.environ.get("MAX_QUEUED_CHATS", 32)))
+    return _admission
+
+
+class ChatRun:
+    """State of one chat run, shared between the loop thread and the UI."""
+
+    def __init__(self, task=None, context=None, admission=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.task = task
+        # Optional callable(run) -> context manager entered inside the run task
+        self.context = context
+        self.admission = admission
+        self.status = "pending"
+        self.queued = None
+        self.error = None
+        self.result = None
+        self.started = None
+        self.finished = None
+        # App-specific flags set from agent callbacks (e.g. an Admin prompt)
+        self.state = {}
+        # Message currently being streamed ({"name", "content"}) and time-to-first-token per agent
+        self.partial = None
+        self.ttft = {}
+        self.future = None
+        self._messages = []
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._admitted = False
+        self._slot = None
+
+    @property
+    def running(self):
+        return self.status in ("pending", "queued", "running")
+
+    @property
+    def position(self):
+        """Place in the admission queue (1 = next), 0 once running."""
+        if self.status != "queued" or self.admission is None:
+            return 0
+        return self.admission.position(self)
+
+    @property
+    def messages(self):
+        with self._lock:
+            return list(self._messages)
+
+    def messages_since(self, index):
+        with self._lock:
+            return self._messages[index:]
+
+    def post(self, name, content, **extra):
+        message = dict(extra, name=name, content=content)
+        with self._lock:
+            self._messages.append(message)
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(message)
+
+    def subscribe(self, callback):
+        """Call `callback(message)` for every message posted from now on."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def wait(self, timeout=None):
+        if self.future is None:
+            # Rejected before it was started
+            return self.result
+        return self.future.result(timeout)
+
+    def cancel(self):
+        if self.future is not None:
+            self.future.cancel()
+        if self.admission is not None:
+            self.admission.leave(self)
+
+    async def _main(self, coro):
+        _current_run.set(self)
+        # Imported here: tool.events builds on this module
+        from tool.events import MESSAGE, TERMINATED, get_bus
+        try:
+            if self.admission is not None:
+                await self.admission.wait(self)
+        except asyncio.CancelledError:
+            coro.close()
+            self.status = "cancelled"
+            raise
+        self.status = "running"
+        self.started = time.time()
+        bus = get_bus()
+        sink = bus.subscribe(self._on_event, kinds=(MESSAGE,), run=self, name="run")
+        status = "failed"
+        try:
+            if self.context is not None:
+                with self.context(self):
+                    self.result = await coro
+            else:
+                self.result = await coro
+            status = "done"
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception as e:
+            # If the context failed, the chat never started
+            coro.close()
+            self.error = e
+            traceback.print_exc()
+        finally:
+            self.finished = time.time()
+            if self.admission is not None:
+                self.admission.leave(self)
+            bus.publish(TERMINATED, content=status, run=self)
+            # Subscribers (the UI, the job store) get every message before the run shows as over
+            await bus.drain(self)
+            bus.unsubscribe(sink)
+            self.status = status
+        return self.result
+
+    def _on_event(self, event):
+        self.post(event.name, event.content)
+
+
+def start_run(coro, task=None, context=None, admission=None):
+    """Run a chat coroutine (e.g. user_proxy.a_initiate_chat(...)) in the background.
+
+    The run waits for a slot from `admission` (the process-wide Admission by
+    default). If there is no room in its queue either, the run comes back
+    with status "rejected" and a ServerBusy error.
+    """
+    run = ChatRun(task=task, context=context, admission=admission or get_admission())
+    try:
+        run.admission.enter(run)
+    except ServerBusy as e:
+        coro.close()
+        run.status = "rejected"
+        run.error = e
+        run.finished = time.time()
+        return run
+    run.future = submit(run._main(coro))
+    return run
@@ -0,0 +1,453 @@
+# Incremental local market-data store behind get_stock_prices.
+#
+# OHLCV history is kept per ticker as one .npy file per column (columnar, so
+# a Close slice is contiguous) plus a dates.npy index and a meta.json with the
+# date range already fetched. Requests only download the part of the range
+# that is missing, merge it in and rewrite the files atomically. Reads use
+# memory-mapped arrays, so close_slice() hands back a view without copying.
+#
+# Today's bar is not final, so coverage stops at today. A request reaching
+# past it records that the tail was checked (checked_on/checked_through in
+# meta.json), and the same tail is not asked for again until the next day.
+#
+# Where the data comes from is pluggable: YahooProvider wraps yf.download,
+# FixtureProvider serves <TICKER>.csv files from a directory (for tests and
+# offline runs). The store lives under .cache/market_data at the repo root,
+# or MARKET_DATA_DIR if set, so executor subprocesses share it too.
+#
+# Prefetching (tool/prefetch.py) leaves a prefetch.json marker next to the
+# ticker's files while and after it warms them. get_close() claims the marker
+# when the Executor asks for that ticker, waiting for a download still in
+# flight rather than starting a second one, and appends the outcome (hit,
+# late, stale or miss, and the seconds saved) to prefetch.jsonl in the root.
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+FIELDS = ("Open", "High", "Low", "Close", "Volume")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DIR = os.environ.get("MARKET_DATA_DIR", os.path.join(ROOT, ".cache", "market_data"))
+PREFETCH_LOG = "prefetch.jsonl"
+PREFETCH_TTL = 3600.0  # a prefetch nobody asked for within an hour was not for this chat
+PREFETCH_WAIT = 30.0
+MAX_LOG_BYTES = 1 << 20
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def to_day(value):
+    """Normalize a date-like value to a tz-naive midnight Timestamp."""
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert(None)
+    return ts.normalize()
+
+
+def to_days(index):
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert(None)
+    return index.normalize()
+
+
+def as_symbols(stock_symbols):
+    if isinstance(stock_symbols, str):
+        return [s for s in stock_symbols.replace(",", " ").split() if s]
+    return list(stock_symbols)
+
+
+def empty_frame():
+    return pd.DataFrame({field: pd.Series(dtype="float64") for field in FIELDS},
+                        index=pd.DatetimeIndex([], name="Date"))
+
+
+class Provider:
+    """Source of daily OHLCV bars; fetch() covers [start, end) like yf.download."""
+
+    name = "provider"
+
+    def fetch(self, ticker, start, end):
+        raise NotImplementedError
+
+
+class YahooProvider(Provider):
+    name = "yahoo"
+
+    def fetch(self, ticker, start, end):
+        import yfinance as yf
+
+        data = yf.download(ticker, start=start, end=end, progress=False, auto_adjust=False)
+        if data is None or data.empty:
+            return empty_frame()
+        if isinstance(data.columns, pd.MultiIndex):
+            # Newer yfinance returns (field, ticker) columns even for one ticker
+            data = data.xs(ticker, axis=1, level=-1) if ticker in data.columns.get_level_values(-1) \
+                else data.droplevel(-1, axis=1)
+        return data.reindex(columns=list(FIELDS))
+
+    def fetch_many(self, tickers, start, end):
+        import yfinance as yf
+
+        data = yf.download(list(tickers), start=start, end=end, progress=False, auto_adjust=False,
+                           group_by="ticker", threads=False)
+        frames = {}
+        for ticker in tickers:
+            if isinstance(data.columns, pd.MultiIndex):
+                if ticker not in data.columns.get_level_values(0):
+                    frames[ticker] = empty_frame()
+                    continue
+                frame = data[ticker]
+            else:
+                frame = data if len(tickers) == 1 else empty_frame()
+            frames[ticker] = frame.dropna(how="all").reindex(columns=list(FIELDS))
+        return frames
+
+
+class FixtureProvider(Provider):
+    """Serves <directory>/<TICKER>.csv (Date,Open,High,Low,Close,Volume)."""
+
+    name = "fixture"
+
+    def __init__(self, directory, latency=0.0):
+        self.directory = directory
+        self.latency = latency
+        self.calls = 0
+
+    def fetch(self, ticker, start, end):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        path = os.path.join(self.directory, f"{ticker}.csv")
+        if not os.path.exists(path):
+            return empty_frame()
+        data = pd.read_csv(path, index_col=0, parse_dates=True)
+        data = data.loc[(data.index >= to_day(start)) & (data.index < to_day(end))]
+        return data.reindex(columns=list(FIELDS))
+
+
+class MarketDataStore:
+    """Per-ticker columnar OHLCV store that only fetches missing date ranges."""
+
+    def __init__(self, root=DEFAULT_DIR, provider=None, engine=None):
+        self.root = root
+        self.provider = provider or YahooProvider()
+        # FetchEngine used by ensure_many(); built from the provider on first use
+        self.engine = engine
+        self.fetches = 0
+        self._lock = threading.Lock()
+        self._ticker_locks = {}
+        self._arrays = {}  # ticker -> (meta mtime, {column: memmap})
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, ticker):
+        return os.path.join(self.root, ticker.upper().replace("/", "_"))
+
+    @contextmanager
+    def _locked(self, ticker):
+        os.makedirs(self._dir(ticker), exist_ok=True)
+        with self._lock:
+            ticker_lock = self._ticker_locks.setdefault(ticker, threading.Lock())
+        with ticker_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self._dir(ticker), ".lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # On-disk layout
+
+    def meta(self, ticker):
+        path = os.path.join(self._dir(ticker), "meta.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def tickers(self):
+        """The tickers with data on disk."""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return set()
+        return {name for name in names if os.path.exists(os.path.join(self.root, name, "meta.json"))}
+
+    def arrays(self, ticker):
+        """Memory-mapped columns for a ticker: {"dates": datetime64[ns], "Close": ...}."""
+        meta_path = os.path.join(self._dir(ticker), "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        mtime = os.stat(meta_path).st_mtime_ns
+        cached = self._arrays.get(ticker)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        columns = {name: np.load(os.path.join(self._dir(ticker), f"{name}.npy"), mmap_mode="r")
+                   for name in ("dates",) + FIELDS}
+        self._arrays[ticker] = (mtime, columns)
+        return columns
+
+    def _write(self, ticker, frame, start, end, checked=None):
+        directory = self._dir(ticker)
+        frame = frame.sort_index()
+        frame = frame[~frame.index.duplicated(keep="last")]
+        columns = {"dates": frame.index.values.astype("datetime64[ns]")}
+        for field in FIELDS:
+            columns[field] = frame[field].to_numpy(dtype="float64")
+        for name, values in columns.items():
+            tmp = os.path.join(directory, f".{name}.tmp.npy")
+            np.save(tmp, values)
+            os.replace(tmp, os.path.join(directory, f"{name}.npy"))
+        meta = {"start": str(start.date()), "end": str(end.date()), "rows": len(frame),
+                "provider": self.provider.name, "updated": time.time()}
+        if checked is not None:
+            meta.update(checked)
+        tmp = os.path.join(directory, ".meta.tmp.json")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        # meta.json is replaced last, so readers never see a half-written update
+        os.replace(tmp, os.path.join(directory, "meta.json"))
+        self._arrays.pop(ticker, None)
+
+    def _frame(self, ticker):
+        columns = self.arrays(ticker)
+        if columns is None:
+            return empty_frame()
+        return pd.DataFrame({field: np.asarray(columns[field]) for field in FIELDS},
+                            index=pd.DatetimeIndex(np.asarray(columns["dates"]), name="Date"))
+
+    # Fetching
+
+    def missing_ranges(self, ticker, start, end):
+        start, end = to_day(start), to_day(end)
+        meta = self.meta(ticker)
+        if meta is None:
+            return [(start, end)] if start < end else []
+        have_start, have_end = to_day(meta["start"]), to_day(meta["end"])
+        if meta.get("checked_on") == str(to_day(pd.Timestamp.now()).date()):
+            # The tail past today was checked already today: nothing new until tomorrow
+            have_end = max(have_end, to_day(meta["checked_through"]))
+        ranges = []
+        if start < have_start:
+            ranges.append((start, have_start))
+        if end > have_end:
+            # Fetch from the end of what we have, so coverage stays contiguous
+            ranges.append((have_end, end))
+        return ranges
+
+    def ensure(self, ticker, start, end):
+        """Make sure [start, end) is on disk, fetching only what is missing."""
+        if not self.missing_ranges(ticker, start, end):
+            return
+        with self._locked(ticker):
+            # Another process may have filled the range while we waited
+            ranges = self.missing_ranges(ticker, start, end)
+            if not ranges:
+                return
+            fetched = []
+            for range_start, range_end in ranges:
+                fetched.append(self.provider.fetch(ticker, str(range_start.date()), str(range_end.date())))
+                self.fetches += 1
+            self.merge(ticker, fetched, start, end)
+
+    def ensure_many(self, tickers, start, end):
+        """Fetch the missing ranges of many tickers concurrently.
+
+        Returns {ticker: error} for the symbols that could not be fetched;
+        those are not marked as covered, so the next call tries them again.
+        """
+        from tool.fetch import FetchEngine
+
+        groups = defaultdict(list)
+        known = set()
+        for ticker in tickers:
+            for missing in self.missing_ranges(ticker, start, end):
+                groups[missing].append(ticker)
+                if self.meta(ticker) is not None:
+                    known.add(ticker)
+        if not groups:
+            return {}
+        if self.engine is None or self.engine.provider is not self.provider:
+            self.engine = FetchEngine(self.provider)
+
+        fetched = defaultdict(list)
+        failed = {}
+        for (range_start, range_end), group in groups.items():
+            # A known ticker with no new bars (weekend, holiday, today) has nothing to add, not an error
+            result = self.engine.fetch(group, str(range_start.date()), str(range_end.date()), empty_ok=known)
+            self.fetches += result.requests
+            for ticker, frame in result.frames.items():
+                fetched[ticker].append(frame)
+            failed.update(result.failed)
+
+        for ticker, frames in fetched.items():
+            if ticker in failed:
+                continue
+            with self._locked(ticker):
+                self.merge(ticker, frames, start, end)
+        return failed
+
+    def merge(self, ticker, frames, start, end):
+        """Merge fetched frames into the ticker's files and extend its coverage."""
+        start, end = to_day(start), to_day(end)
+        # Today's bar is not final yet, so never mark it as covered
+        today = to_day(pd.Timestamp.now())
+        # How far past today the tail has been checked today (see missing_ranges)
+        through = end if end > today else None
+        end = min(end, today)
+        meta = self.meta(ticker)
+        if meta is not None:
+            start = min(start, to_day(meta["start"]))
+            end = max(end, to_day(meta["end"]))
+            if meta.get("checked_on") == str(today.date()):
+                through = max(through or today, to_day(meta["checked_through"]))
+        checked = None
+        if through is not None:
+            checked = {"checked_on": str(today.date()), "checked_through": str(through.date())}
+        frames = [self._frame(ticker)] + [f for f in frames if f is not None and not f.empty]
+        frames = [f for f in frames if not f.empty]
+        merged = pd.concat(frames) if frames else empty_frame()
+        merged.index = to_days(merged.index).rename("Date")
+        self._write(ticker, merged.reindex(columns=list(FIELDS)), start, max(start, end), checked)
+
+    # Prefetching
+
+    def _marker(self, ticker):
+        return os.path.join(self._dir(ticker), "prefetch.json")
+
+    def _write_marker(self, ticker, marker):
+        os.makedirs(self._dir(ticker), exist_ok=True)
+        tmp = os.path.join(self._dir(ticker), f".prefetch.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(marker, f)
+        os.replace(tmp, self._marker(ticker))
+
+    def prefetch_marker(self, ticker):
+        """The ticker's pending prefetch, or None (expired markers are removed)."""
+        try:
+            with open(self._marker(ticker)) as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - marker["started"] > PREFETCH_TTL:
+            try:
+                os.remove(self._marker(ticker))
+            except OSError:
+                pass
+            return None
+        return marker
+
+    def start_prefetch(self, ticker, start, end):
+        self._write_marker(ticker, {"status": "fetching", "start": str(to_day(start).date()),
+                                    "end": str(to_day(end).date()), "started": time.time()})
+
+    def finish_prefetch(self, ticker, seconds, error=None):
+        marker = self.prefetch_marker(ticker)
+        if marker is not None:
+            self._write_marker(ticker, dict(marker, status="failed" if error else "done",
+                                            seconds=seconds, error=error))
+        self.log_prefetch({"type": "prefetch", "ticker": ticker, "seconds": round(seconds, 3), "error": error})
+
+    def log_prefetch(self, entry):
+        path = os.path.join(self.root, PREFETCH_LOG)
+        try:
+            if os.path.getsize(path) > MAX_LOG_BYTES:
+                os.replace(path, path + ".1")
+        except OSError:
+            pass
+        with open(path, "a") as f:
+            f.write(json.dumps(dict(entry, t=round(time.time(), 3))) + "\n")
+
+    def claim_prefetches(self, symbols, start, end, wait=PREFETCH_WAIT):
+        """Log whether each symbol's [start, end) was warmed by a prefetch; returns the outcomes."""
+        asked = time.time()
+        outcomes = {}
+        for symbol in symbols:
+            marker = self.prefetch_marker(symbol)
+            waited = 0.0
+            late = marker is not None and marker["status"] == "fetching"
+            while marker is not None and marker["status"] == "fetching" and waited < wait:
+                # Still downloading: wait for it instead of fetching the same range twice
+                time.sleep(0.05)
+                waited = time.time() - asked
+                marker = self.prefetch_marker(symbol)
+            if marker is not None:
+                try:
+                    # Claimed once, by whoever gets to it first
+                    os.remove(self._marker(symbol))
+                except OSError:
+                    marker = None
+            covered = not self.missing_ranges(symbol, start, end)
+            if marker is None:
+                if covered:
+                    continue  # already local, nothing to do with prefetching
+                outcome, saved = "miss", 0.0
+            elif not covered or marker["status"] == "failed":
+                outcome, saved = "stale", 0.0
+            elif late:
+                # The part of the download that overlapped with the Engineer's turn
+                outcome, saved = "late", asked - marker["started"]
+            else:
+                outcome, saved = "hit", marker.get("seconds", 0.0)
+            outcomes[symbol] = outcome
+            self.log_prefetch({"type": "demand", "ticker": symbol, "outcome": outcome,
+                               "saved": round(saved, 3), "waited": round(waited, 3)})
+        return outcomes
+
+    # Reading
+
+    def close_slice(self, ticker, start, end, field="Close"):
+        """Series of `field` for [start, end), backed by the memory-mapped file.
+
+        Reads what is on disk only; fetching the range first is up to the caller (ensure, ensure_many).
+        """
+        columns = self.arrays(ticker)
+        if columns is None:
+            return pd.Series(dtype="float64", name=ticker)
+        dates = columns["dates"]
+        lo = np.searchsorted(dates, np.datetime64(to_day(start), "ns"), side="left")
+        hi = np.searchsorted(dates, np.datetime64(to_day(end), "ns"), side="left")
+        index = pd.DatetimeIndex(dates[lo:hi], name="Date")
+        return pd.Series(columns[field][lo:hi], index=index, name=ticker, copy=False)
+
+    def get_close(self, stock_symbols, start_date, end_date):
+        """Close prices with one column per symbol, like yf.download(...)["Close"]."""
+        symbols = as_symbols(stock_symbols)
+        if not symbols:
+            return pd.DataFrame()
+        self.claim_prefetches(symbols, start_date, end_date)
+        failed = self.ensure_many(symbols, start_date, end_date)
+        series = [pd.Series(dtype="float64", name=symbol) if symbol in failed
+                  else self.close_slice(symbol, start_date, end_date) for symbol in symbols]
+        frame = pd.concat(series, axis=1)
+        frame.attrs["failed"] = failed
+        if failed:
+            # Printed so the agents see which symbols are missing from the result
+            print("Failed to fetch: " + ", ".join(f"{symbol} ({error})" for symbol, error in failed.items()))
+        return frame
+
+
+def default_store(root=DEFAULT_DIR, provider=None):
+    """Process-wide MarketDataStore for `root` (Yahoo provider by default)."""
+    with _stores_lock:
+        store = _stores.get(root)
+        if store is None:
+            store = _stores[root] = MarketDataStore(root, provider=provider)
+        elif provider is not None:
+            store.provider = provider
+        return store
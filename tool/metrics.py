@@ -0,0 +1,492 @@
+# Per-agent, per-round metrics for the group chats.
+#
+# ChatMetrics records one entry per round: who spoke, how long the reply took,
+# the LLM latency, prompt/completion tokens and cost of the completions made
+# for it, code-execution time for Executor rounds, and the time the UI took to
+# render the message. Rounds start when an agent begins generating a reply (a
+# reply function registered first on the agent) and end when it sends the
+# reply (a process_message_before_send hook).
+#
+# LLM calls are attributed through autogen's runtime logging: a logger that is
+# handed every chat completion together with the agent that made it. Calls
+# from agents no ChatMetrics tracks (e.g. autogen's internal speaker-selection
+# agents) are recorded under the "unattributed" app.
+#
+# Finished rounds go through the event bus (tool/events.py) to a sink thread
+# that appends them to .cache/metrics/rounds.jsonl (or METRICS_DIR) and
+# rewrites a Prometheus text file <app>.prom with p50/p95 per agent alongside
+# it, for a node_exporter textfile collector. usage_summary() adds up the
+# LLM calls, tokens and cost of every run of one ChatMetrics, i.e. of one
+# session; the totals of the shared OpenAIWrapper clients are process-wide.
+# rounds.jsonl is kept open and moved to rounds.jsonl.1 past MAX_LOG_BYTES, so
+# the two files hold the latest rounds. To aggregate across runs:
+#
+#     python -m tool.metrics [.cache/metrics/rounds.jsonl]
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import defaultdict, deque
+from datetime import datetime
+
+from tool.compaction import count_tokens, content_text
+from tool.events import ROUND, get_bus, publish
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DIR = os.environ.get("METRICS_DIR", os.path.join(ROOT, ".cache", "metrics"))
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # autogen's logger_utils.get_current_ts()
+QUANTILES = (0.5, 0.95)
+WINDOW = 1000  # observations kept per agent for the quantiles
+# The "unattributed" rounds are never reset by a new run; only the latest are kept
+UNATTRIBUTED_ROUNDS = 1000
+MAX_LOG_BYTES = 16 << 20  # rounds.jsonl is rotated past this
+USAGE_FIELDS = ("llm_calls", "cached_calls", "prompt_tokens", "completion_tokens", "cost")
+
+_owners = weakref.WeakKeyDictionary()  # agent -> ChatMetrics
+_logger_lock = threading.Lock()
+_logger_installed = False
+_registries = {}
+_registries_lock = threading.Lock()
+_unattributed = None
+_sink_lock = threading.Lock()
+_sink_installed = False
+# Records from every run go through one queue, in order
+_SINK_KEY = "metrics"
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile of `values` (q in [0, 1])."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def write_text(path, text):
+    """Replace `path` with `text` atomically; concurrent writers each use a tmp file of their own."""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def export(write):
+    """Run an export; a failed write is reported, never raised into the chat or the LLM call."""
+    try:
+        write()
+    except Exception as e:
+        print(f"Metrics export failed: {e}", file=sys.stderr)
+
+
+class Registry:
+    """Process-wide aggregates per (app, agent), exported as JSONL and Prometheus text."""
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        self.jsonl_path = os.path.join(directory, "rounds.jsonl")
+        self.counters = defaultdict(lambda: defaultdict(float))
+        self.observations = defaultdict(lambda: defaultdict(lambda: deque(maxlen=WINDOW)))
+        self._lock = threading.Lock()
+        self._written = 0.0
+        self._log = None
+        self._log_lock = threading.Lock()  # the JSONL file, apart from the aggregates
+        os.makedirs(directory, exist_ok=True)
+
+    def observe(self, record):
+        key = (record["app"], record["speaker"])
+        with self._lock:
+            counters = self.counters[key]
+            observations = self.observations[key]
+            if record["type"] == "round":
+                counters["rounds"] += 1
+                for field in USAGE_FIELDS:
+                    counters[field] += record[field]
+                observations["round_seconds"].append(record["duration"])
+                if record["llm_calls"]:
+                    observations["llm_latency_seconds"].append(record["llm_latency"])
+                if record["exec_time"]:
+                    observations["exec_seconds"].append(record["exec_time"])
+            elif record["type"] == "render":
+                observations["render_seconds"].append(record["render_time"])
+            # The text file is small; rewrite it at most once a second (claimed here, by one writer)
+            due = time.monotonic() - self._written > 1.0
+            if due:
+                self._written = time.monotonic()
+        export(lambda: self.append(record))
+        if due:
+            export(self.write_prometheus)
+
+    def append(self, record):
+        """Append `record` to rounds.jsonl, moving a full file to rounds.jsonl.1 first."""
+        line = json.dumps(record) + "\n"
+        with self._log_lock:
+            if self._log is not None and self._log.tell() > MAX_LOG_BYTES:
+                self._log.close()
+                self._log = None
+                os.replace(self.jsonl_path, self.jsonl_path + ".1")
+            if self._log is None:
+                self._log = open(self.jsonl_path, "a")
+            self._log.write(line)
+            self._log.flush()
+
+    def prometheus(self):
+        with self._lock:
+            counters = {key: dict(values) for key, values in self.counters.items()}
+            observations = {key: {name: list(values) for name, values in series.items()}
+                            for key, series in self.observations.items()}
+        lines = []
+        for name, help_text in (("rounds", "Rounds spoken"), ("llm_calls", "LLM completions"),
+                                ("cached_calls", "LLM completions served from the cache"),
+                                ("prompt_tokens", "Prompt tokens"), ("completion_tokens", "Completion tokens"),
+                                ("cost", "Estimated LLM cost in USD")):
+            metric = f"autogen_{name}_total"
+            lines += [f"# HELP {metric} {help_text}.", f"# TYPE {metric} counter"]
+            for (app, agent), values in sorted(counters.items()):
+                lines.append(f'{metric}{{app="{app}",agent="{agent}"}} {values.get(name, 0):g}')
+        for name, help_text in (("round_seconds", "Time from reply start to send"),
+                                ("llm_latency_seconds", "LLM latency per round"),
+                                ("exec_seconds", "Code execution time per round"),
+                                ("render_seconds", "UI render time per message")):
+            metric = f"autogen_{name}"
+            lines += [f"# HELP {metric} {help_text}.", f"# TYPE {metric} summary"]
+            for (app, agent), series in sorted(observations.items()):
+                values = series.get(name)
+                if not values:
+                    continue
+                labels = f'app="{app}",agent="{agent}"'
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{{labels},quantile="{q}"}} {percentile(values, q):.6f}')
+                lines.append(f"{metric}_sum{{{labels}}} {sum(values):.6f}")
+                lines.append(f"{metric}_count{{{labels}}} {len(values)}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        self._written = time.monotonic()
+        apps = sorted({app for app, _ in self.counters} | {app for app, _ in self.observations})
+        text = self.prometheus()
+        for app in apps:
+            # One file per app, each with only that app's series
+            body = "\n".join(line for line in text.splitlines()
+                             if line.startswith("#") or f'app="{app}"' in line) + "\n"
+            write_text(os.path.join(self.directory, f"{app}.prom"), body)
+
+
+def get_registry(directory=DEFAULT_DIR):
+    """Process-wide Registry writing to `directory`."""
+    with _registries_lock:
+        registry = _registries.get(directory)
+        if registry is None:
+            registry = _registries[directory] = Registry(directory)
+        return registry
+
+
+class ChatMetrics:
+    """Per-round records for the conversations of one set of agents."""
+
+    def __init__(self, app, registry=None, max_rounds=None):
+        self.app = app
+        self.registry = registry
+        # Rounds kept for summaries (all of the run's if None); the registry sees every one
+        self.max_rounds = max_rounds
+        self._lock = threading.Lock()
+        self._subscribers = []
+        # LLM usage of every run so far; new_run() does not reset it
+        self.usage = dict.fromkeys(USAGE_FIELDS, 0)
+        install_sink()
+        self.new_run()
+
+    def copy(self):
+        """Same app and registry, no agents and no rounds (one per conversation)."""
+        return ChatMetrics(self.app, self.registry, self.max_rounds)
+
+    def new_run(self, run_id=None):
+        with self._lock:
+            self.run_id = run_id or uuid.uuid4().hex[:12]
+            self.rounds = deque(maxlen=self.max_rounds) if self.max_rounds else []
+            self._count = 0
+            self._open = {}  # agent name -> round being generated
+
+    def track(self, agents):
+        """Record the rounds and LLM calls of `agents` (autogen ConversableAgents)."""
+        from autogen import Agent
+
+        install_logger()
+        for agent in agents:
+            _owners[agent] = self
+            agent.register_reply([Agent, None], reply_func=_begin_round, config=self)
+            agent.register_hook("process_message_before_send", self._end_round)
+
+    def subscribe(self, callback):
+        """Call `callback(record)` for every finished round."""
+        self._subscribers.append(callback)
+
+    # Recording
+
+    def _record(self, speaker):
+        return {
+            "type": "round", "app": self.app, "run_id": self.run_id, "round": None, "speaker": speaker,
+            "started": time.time(), "duration": 0.0, "llm_calls": 0, "cached_calls": 0,
+            "llm_latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0,
+            "exec_time": 0.0, "render_time": 0.0,
+        }
+
+    def begin(self, speaker):
+        with self._lock:
+            self._open[speaker] = self._record(speaker)
+
+    def llm_call(self, speaker, latency, prompt_tokens, completion_tokens, cost, cached):
+        with self._lock:
+            record = self._open.get(speaker)
+            if record is None:
+                return
+            record["llm_calls"] += 1
+            record["cached_calls"] += int(bool(cached))
+            record["llm_latency"] += latency
+            record["prompt_tokens"] += prompt_tokens
+            record["completion_tokens"] += completion_tokens
+            record["cost"] += cost or 0.0
+
+    def end(self, speaker, content):
+        now = time.time()
+        with self._lock:
+            record = self._open.pop(speaker, None)
+            if record is None:
+                # Sent without generating (e.g. the task message from initiate_chat)
+                record = self._record(speaker)
+            record["duration"] = now - record["started"]
+            if not record["llm_calls"] and content.lstrip().startswith("exitcode:"):
+                # Executor rounds: the whole reply is running the code
+                record["exec_time"] = record["duration"]
+            record["round"] = self._count
+            self._count += 1
+            self.rounds.append(record)
+            for field in USAGE_FIELDS:
+                self.usage[field] += record[field]
+        self._publish(record)
+
+    def record_render(self, speaker, seconds):
+        """Time the UI spent rendering a message from `speaker` (first render only)."""
+        with self._lock:
+            record = next((r for r in reversed(self.rounds) if r["speaker"] == speaker), None)
+            if record is None:
+                return
+            record["render_time"] += seconds
+        self._publish({"type": "render", "app": self.app, "run_id": self.run_id, "round": record["round"],
+                       "speaker": speaker, "started": time.time(), "render_time": seconds})
+
+    def flush(self):
+        """Rewrite the Prometheus file once the records published so far are written."""
+        publish(ROUND, self.app, None, run=_SINK_KEY, metrics=self, flush=True)
+
+    def _publish(self, record):
+        # Written out, and passed to subscribers, by the metrics sink (off the agents' path)
+        publish(ROUND, record["speaker"], record, run=_SINK_KEY, metrics=self)
+
+    def _observe(self, record):
+        (self.registry or get_registry()).observe(record)
+        if record["type"] == "round":
+            for callback in list(self._subscribers):
+                callback(record)
+
+    def _end_round(self, sender, message, recipient, silent):
+        content = message.get("content") if isinstance(message, dict) else message
+        self.end(sender.name, content_text({"content": content}))
+        return message
+
+    # Reporting
+
+    def usage_summary(self):
+        """LLM calls, tokens and cost of this ChatMetrics' runs (one session's), across runs."""
+        with self._lock:
+            return dict(self.usage, cost=round(self.usage["cost"], 6))
+
+    def summary_rows(self):
+        """One row per agent: rounds, LLM p50/p95, tokens, cost, exec and render time."""
+        with self._lock:
+            rounds = list(self.rounds)
+        by_agent = defaultdict(list)
+        for record in rounds:
+            by_agent[record["speaker"]].append(record)
+        rows = []
+        for speaker, records in by_agent.items():
+            latencies = [r["llm_latency"] for r in records if r["llm_calls"]]
+            rows.append({
+                "agent": speaker,
+                "rounds": len(records),
+                "llm p50 (s)": round(percentile(latencies, 0.5), 2),
+                "llm p95 (s)": round(percentile(latencies, 0.95), 2),
+                "prompt tokens": sum(r["prompt_tokens"] for r in records),
+                "completion tokens": sum(r["completion_tokens"] for r in records),
+                "cost ($)": round(sum(r["cost"] for r in records), 4),
+                "exec (s)": round(sum(r["exec_time"] for r in records), 2),
+                "render (s)": round(sum(r["render_time"] for r in records), 3),
+            })
+        return rows
+
+    def summary_markdown(self):
+        rows = self.summary_rows()
+        if not rows:
+            return ""
+        header = list(rows[0])
+        lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+        lines += ["| " + " | ".join(str(row[column]) for column in header) + " |" for row in rows]
+        return "\n".join(lines)
+
+
+def _metrics_sink(event):
+    metrics = event.data["metrics"]
+    if event.data.get("flush"):
+        export((metrics.registry or get_registry()).write_prometheus)
+    else:
+        metrics._observe(event.content)
+
+
+def install_sink():
+    """Subscribe the sink that writes metrics records out (once per process)."""
+    global _sink_installed
+    with _sink_lock:
+        if not _sink_installed:
+            get_bus().subscribe(_metrics_sink, kinds=(ROUND,), run=_SINK_KEY, threaded=True, maxsize=10000,
+                                name="metrics")
+            _sink_installed = True
+
+
+def _begin_round(recipient, messages=None, sender=None, config=None):
+    config.begin(recipient.name)
+    return False, None
+
+
+def _completion_tokens(response):
+    try:
+        return sum(count_tokens(choice.message.content or "") for choice in response.choices)
+    except AttributeError:
+        return 0
+
+
+def _unattributed_metrics():
+    global _unattributed
+    if _unattributed is None:
+        _unattributed = ChatMetrics("unattributed", max_rounds=UNATTRIBUTED_ROUNDS)
+    return _unattributed
+
+
+def install_logger():
+    """Start autogen runtime logging with a logger that feeds ChatMetrics (once per process)."""
+    global _logger_installed
+    from autogen import runtime_logging
+    from autogen.logger.base_logger import BaseLogger
+
+    class CompletionLogger(BaseLogger):
+        def __init__(self, inner=None):
+            # Keep an already configured logger (e.g. sqlite) working
+            self.inner = inner
+
+        def start(self):
+            return self.inner.start() if self.inner else str(uuid.uuid4())
+
+        def log_chat_completion(self, invocation_id, client_id, wrapper_id, source, request, response,
+                                is_cached, cost, start_time):
+            if self.inner:
+                self.inner.log_chat_completion(invocation_id, client_id, wrapper_id, source, request, response,
+                                               is_cached, cost, start_time)
+            if isinstance(response, str):
+                return  # a failed attempt ("error_code:...")
+            try:
+                latency = (datetime.utcnow() - datetime.strptime(start_time, TIMESTAMP_FORMAT)).total_seconds()
+            except (TypeError, ValueError):
+                latency = 0.0
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+            else:
+                prompt_tokens = sum(count_tokens(content_text(m)) for m in request.get("messages", []))
+                completion_tokens = _completion_tokens(response)
+            name = getattr(source, "name", str(source))
+            metrics = _owners.get(source) if not isinstance(source, str) else None
+            if metrics is None:
+                metrics = _unattributed_metrics()
+                metrics.begin(name)
+                metrics.llm_call(name, latency, prompt_tokens, completion_tokens, cost, is_cached)
+                metrics.end(name, "")
+                return
+            metrics.llm_call(name, latency, prompt_tokens, completion_tokens, cost, is_cached)
+
+        def log_new_agent(self, agent, init_args):
+            if self.inner:
+                self.inner.log_new_agent(agent, init_args)
+
+        def log_event(self, source, name, **kwargs):
+            if self.inner:
+                self.inner.log_event(source, name, **kwargs)
+
+        def log_new_wrapper(self, wrapper, init_args):
+            if self.inner:
+                self.inner.log_new_wrapper(wrapper, init_args)
+
+        def log_new_client(self, client, wrapper, init_args):
+            if self.inner:
+                self.inner.log_new_client(client, wrapper, init_args)
+
+        def log_function_use(self, source, function, args, returns):
+            if self.inner:
+                self.inner.log_function_use(source, function, args, returns)
+
+        def stop(self):
+            if self.inner:
+                self.inner.stop()
+
+        def get_connection(self):
+            return self.inner.get_connection() if self.inner else None
+
+    with _logger_lock:
+        if _logger_installed:
+            return
+        inner = runtime_logging.autogen_logger if runtime_logging.logging_enabled() else None
+        if inner is not None:
+            runtime_logging.stop()
+        runtime_logging.start(logger=CompletionLogger(inner))
+        _logger_installed = True
+
+
+def _lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.readlines()
+
+
+def report(path):
+    """p50/p95 per app and agent over every run recorded in a rounds.jsonl (and its rotated .1)."""
+    series = defaultdict(lambda: defaultdict(list))
+    runs = defaultdict(set)
+    for line in _lines(path + ".1") + _lines(path):
+        record = json.loads(line)
+        key = (record["app"], record["speaker"])
+        runs[key].add(record["run_id"])
+        if record["type"] == "render":
+            series[key]["render"].append(record["render_time"])
+        elif record["llm_calls"]:
+            series[key]["llm"].append(record["llm_latency"])
+        elif record["exec_time"]:
+            series[key]["exec"].append(record["exec_time"])
+    print(f"{'app':<20} {'agent':<24} {'runs':>5} {'llm p50':>8} {'llm p95':>8} "
+          f"{'exec p50':>9} {'exec p95':>9} {'render p95':>11}")
+    for (app, agent), values in sorted(series.items()):
+        print(f"{app:<20} {agent:<24} {len(runs[(app, agent)]):>5} "
+              f"{percentile(values['llm'], 0.5):>8.2f} {percentile(values['llm'], 0.95):>8.2f} "
+              f"{percentile(values['exec'], 0.5):>9.2f} {percentile(values['exec'], 0.95):>9.2f} "
+              f"{percentile(values['render'], 0.95):>11.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize recorded round metrics")
+    parser.add_argument("path", nargs="?", default=os.path.join(DEFAULT_DIR, "rounds.jsonl"))
+    report(parser.parse_args().path)
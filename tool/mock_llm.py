@@ -0,0 +1,263 @@
+# Local OpenAI-compatible chat completions server with scripted replies.
+#
+# Serves POST /v1/chat/completions, streamed (server-sent events) or not,
+# after `latency` seconds to the first token and then at `tokens_per_second`
+# (a token is one word here). Nothing leaves the machine and no tokens are
+# paid for, so whole group chats can be run as often as a benchmark needs
+# (tool/bench.py) or an app pointed at it while working on the UI:
+#
+#     python -m tool.mock_llm --port 8000 --latency 0.3 --tokens-per-second 80
+#     OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=mock streamlit run autogen_st_3.py
+#
+# Who is asking is told apart by the request's system message. Script.learn()
+# maps the system messages of a session's agents to their names (otherwise the
+# first word of the system message is taken as the name); replies[name]
+# is that agent's n-th reply, n being how many replies of its own are in the
+# request, so the same script serves any number of concurrent chats. Speaker
+# selection requests ("select the next role from [...]") are answered with
+# the first name in `prefer` that is a candidate. A Script subclass can pace
+# each reply itself (Reply.latency, Reply.tokens_per_second; see tool/replay.py).
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANDIDATES = re.compile(r"select the next role from \[([^\]]*)\]")
+TOKEN = re.compile(r"\s*\S+")
+
+# latency / tokens_per_second None: the server's
+Reply = namedtuple("Reply", "caller text latency tokens_per_second", defaults=(None, None))
+
+ENGINEER_CODE = """```python
+import random
+import statistics
+
+random.seed(0)
+prices = [100.0]
+for _ in range(20000):
+    prices.append(prices[-1] * (1 + random.gauss(0, 0.01)))
+returns = [b / a - 1 for a, b in zip(prices, prices[1:])]
+print(f"last {prices[-1]:.2f} mean return {statistics.mean(returns):.6f} volatility {statistics.stdev(returns):.6f}")
+```"""
+
+REPORT = "\n".join(["```md", "# Financial report", ""] +
+                   [f"- Finding {i}: the simulated price series moved {i * 0.7:.1f}% over the period, "
+                    f"with volatility in line with the sector." for i in range(1, 31)] + ["```"])
+
+# A run of the report pipelines: plan, code, run it, report, review
+DEFAULT_REPLIES = {
+    "Planner": ["Plan: 1. Engineer, load the prices and compute returns and volatility. "
+                "2. Writer, summarise the results in a report.",
+                "The numbers are in. Writer, please write the report.",
+                "TERMINATE"],
+    "Engineer": [ENGINEER_CODE],
+    "Writer": [REPORT],
+    "Critic": ["TERMINATE"],
+    "Admin": ["Looks good, thank you."],
+}
+DEFAULT_PREFER = ("Critic", "Writer")
+
+
+class Script:
+    """Replies per agent name, and whom to pick when asked for the next speaker."""
+
+    def __init__(self, replies=None, prefer=DEFAULT_PREFER, default="OK."):
+        self.replies = dict(DEFAULT_REPLIES if replies is None else replies)
+        self.prefer = list(prefer)
+        self.default = default
+        self.names = {}  # system message -> agent name
+        self._lock = threading.Lock()
+
+    def learn(self, agents):
+        """Recognize `agents` by their system messages."""
+        with self._lock:
+            for agent in agents:
+                if agent.system_message:
+                    self.names[agent.system_message.strip()] = agent.name
+
+    def caller(self, messages):
+        system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+        with self._lock:
+            name = self.names.get(system.strip())
+        # Not learned: the report teams' system messages start with the agent's name ("Planner. ...")
+        return name or system.split(".", 1)[0].strip() or None
+
+    def reply(self, messages):
+        """The Reply to a chat completion request."""
+        for message in reversed(messages):
+            match = CANDIDATES.search(str(message.get("content") or ""))
+            if match:
+                candidates = [name.strip(" '\"") for name in match.group(1).split(",")]
+                return Reply("speaker selection", next((name for name in self.prefer if name in candidates),
+                                                       candidates[0]))
+        name = self.caller(messages)
+        replies = self.replies.get(name)
+        if not replies:
+            return Reply(name, self.default)
+        own = sum(1 for m in messages if m.get("role") == "assistant")
+        return Reply(name, replies[min(own, len(replies) - 1)])
+
+
+def _usage(messages, text):
+    # Roughly four characters per token, as far as cost accounting is concerned
+    prompt = sum(len(str(m.get("content") or "")) for m in messages) // 4
+    completion = len(text) // 4
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as with the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+        else:
+            self._json(404, {"error": {"message": f"No route {self.path}"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._json(404, {"error": {"message": f"No route {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server.mock.serve(self, request)
+
+    def _json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data):
+        self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+
+
+class MockLLM:
+    """The server, on a background thread; `url` goes in base_url / OPENAI_BASE_URL."""
+
+    def __init__(self, script=None, latency=0.05, tokens_per_second=500.0, host="127.0.0.1", port=0):
+        self.script = script or Script()
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self.thread = None
+        self.requests = 0
+        self.tokens = 0
+        self.busy = 0.0  # seconds spent answering, summed over requests
+        self.callers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-llm", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "tokens": self.tokens, "busy_seconds": round(self.busy, 3),
+                    "callers": dict(self.callers)}
+
+    def serve(self, handler, request):
+        started = time.perf_counter()
+        messages = request.get("messages") or []
+        caller, text, latency, rate = self.script.reply(messages)
+        latency = self.latency if latency is None else latency
+        rate = self.tokens_per_second if rate is None else rate
+        tokens = TOKEN.findall(text) or [text]
+        model = request.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        with self._lock:
+            # Counted before the reply goes out, so a client that has its answer sees it counted
+            self.requests += 1
+            self.callers[caller] = self.callers.get(caller, 0) + 1
+        time.sleep(latency)
+        if request.get("stream"):
+            self._stream(handler, completion_id, model, tokens, rate)
+        else:
+            self._pace(started + latency, len(tokens), rate)
+            handler._json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop", "logprobs": None}],
+                "usage": _usage(messages, text),
+            })
+        with self._lock:
+            self.tokens += len(tokens)
+            self.busy += time.perf_counter() - started
+
+    def _pace(self, start, i, rate):
+        # Token i is due i / rate seconds after the first one
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _stream(self, handler, completion_id, model, tokens, rate):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        start = time.perf_counter()
+
+        def event(delta, finish_reason=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason,
+                                                  "logprobs": None}]}
+            handler._chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+
+        event({"role": "assistant", "content": ""})
+        for i, token in enumerate(tokens):
+            self._pace(start, i, rate)
+            event({"content": token})
+        event({}, "stop")
+        handler._chunk(b"data: [DONE]\n\n")
+        handler._chunk(b"")
+        handler.wfile.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible server with scripted replies")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds to the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--script", help='JSON file of {"agent name": ["first reply", "second reply", ...]}')
+    args = parser.parse_args()
+
+    replies = None
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            replies = json.load(f)
+    mock = MockLLM(Script(replies), latency=args.latency, tokens_per_second=args.tokens_per_second,
+                   host=args.host, port=args.port)
+    print(f"Serving scripted completions on {mock.url}", flush=True)
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.server.server_close()
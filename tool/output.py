@@ -0,0 +1,191 @@
+# Bounded capture of code-execution output.
+#
+# Whatever the Engineer's code prints ends up in the Executor's message, and
+# that message is re-sent to the LLM on every later turn: one printed
+# DataFrame or download log can cost more tokens than the rest of the chat.
+# BoundedOutput is a file-like sink (for redirect_stdout/redirect_stderr)
+# that keeps only the first and last few thousand characters in memory. Once
+# the output outgrows that, all of it goes to a spill file in the work dir
+# and the message says where:
+#
+#     exitcode: 0 (execution succeeded)
+#     Code output: <head>
+#     [... 1,204,332 bytes (~301,583 tokens) omitted; full output in output/tmp_code_3f2a.txt ...]
+#     <tail>
+#
+# `on_chunk` gets the output as it is written (throttled, and only the first
+# `stream_chars` of it), so front ends can show it live.
+
+import io
+import os
+import time
+from collections import deque
+
+from tool.compaction import count_tokens
+
+SPILL_DIR = "output"
+DEFAULT_MAX_CHARS = 4000
+STREAM_CUT_NOTE = "\n[... live output stops here; the rest is in the result ...]\n"
+
+
+def _tokens(text):
+    # Not through count_tokens' cache: these are large, one-off chunks
+    return count_tokens.__wrapped__(text)
+
+
+def _bytes(text):
+    return len(text.encode("utf-8", errors="replace"))
+
+
+class BoundedOutput(io.TextIOBase):
+    """Text sink that keeps a bounded head and tail and spills the rest to a file."""
+
+    encoding = "utf-8"
+
+    def __init__(self, spill_path, max_chars=DEFAULT_MAX_CHARS, on_chunk=None, stream_chars=20000,
+                 interval=0.1, relative_to=None):
+        self.spill_path = spill_path
+        # The note gives the path relative to this (the code's working directory)
+        self.relative_to = relative_to
+        # Same split as compaction's _cut: two thirds head, one third tail
+        self.head_chars = max_chars * 2 // 3
+        self.tail_chars = max_chars - self.head_chars
+        self.on_chunk = on_chunk
+        self.stream_chars = stream_chars
+        self.interval = interval
+        self.head = []
+        self.head_len = 0
+        self.tail = deque()
+        self.tail_len = 0
+        self.total_bytes = 0
+        self.omitted_bytes = 0
+        self.omitted_tokens = 0
+        self._spill = None
+        self._streamed = 0
+        self._pending = []
+        self._last_sent = 0.0
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if not isinstance(s, str):
+            raise TypeError(f"write() argument must be str, not {type(s).__name__}")
+        if not s:
+            return 0
+        self.total_bytes += _bytes(s)
+        if self._spill is not None:
+            self._spill.write(s)
+        self._stream(s)
+
+        rest = s
+        if self.head_len < self.head_chars:
+            part = rest[: self.head_chars - self.head_len]
+            self.head.append(part)
+            self.head_len += len(part)
+            rest = rest[len(part):]
+        if rest:
+            self.tail.append(rest)
+            self.tail_len += len(rest)
+            self._evict()
+        return len(s)
+
+    def _evict(self):
+        while self.tail_len > self.tail_chars:
+            if self._spill is None:
+                # Everything written so far is still in memory: start the file with it
+                os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+                self._spill = open(self.spill_path, "w", encoding="utf-8", errors="replace")
+                self._spill.write("".join(self.head))
+                self._spill.write("".join(self.tail))
+            excess = self.tail_len - self.tail_chars
+            first = self.tail[0]
+            if len(first) <= excess:
+                dropped = self.tail.popleft()
+            else:
+                dropped, self.tail[0] = first[:excess], first[excess:]
+            self.tail_len -= len(dropped)
+            self.omitted_bytes += _bytes(dropped)
+            self.omitted_tokens += _tokens(dropped)
+
+    def _stream(self, s):
+        if self.on_chunk is None or self._streamed > self.stream_chars:
+            return
+        if self._streamed + len(s) > self.stream_chars:
+            s = s[: self.stream_chars - self._streamed] + STREAM_CUT_NOTE
+        self._streamed += len(s)
+        self._pending.append(s)
+        if time.monotonic() - self._last_sent >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            chunk = "".join(self._pending)
+            self._pending = []
+            self._last_sent = time.monotonic()
+            self.on_chunk(chunk)
+        if self._spill is not None and not self._spill.closed:
+            self._spill.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        if self._spill is not None:
+            self._spill.close()
+        super().close()
+
+    @property
+    def spilled(self):
+        return self._spill is not None
+
+    def getvalue(self):
+        """The output as it goes into the message: head, a note, tail."""
+        head, tail = "".join(self.head), "".join(self.tail)
+        if not self.spilled:
+            return head + tail
+        where = os.path.relpath(self.spill_path, self.relative_to)
+        note = (f"\n[... {self.omitted_bytes:,} bytes (~{self.omitted_tokens:,} tokens) omitted; "
+                f"full output in {where} ...]\n")
+        return head + note + tail
+
+    def stats(self):
+        return {"bytes": self.total_bytes, "bytes_saved": self.omitted_bytes,
+                "tokens_saved": self.omitted_tokens, "spilled": 1 if self.spilled else 0}
+
+
+def spill_path(work_dir, code_file):
+    """Where the full output of `code_file` goes when it is too long."""
+    stem = os.path.splitext(os.path.basename(code_file))[0]
+    return os.path.join(work_dir, SPILL_DIR, f"{stem}.txt")
+
+
+def bound_text(text, path, max_chars=DEFAULT_MAX_CHARS, relative_to=None):
+    """Bound output that is already in memory; returns (text, stats)."""
+    output = BoundedOutput(path, max_chars=max_chars, relative_to=relative_to)
+    output.write(text)
+    output.close()
+    return output.getvalue(), output.stats()
+
+
+if __name__ == '__main__':
+    import tempfile
+    from contextlib import redirect_stdout
+
+    import numpy as np
+
+    # A DataFrame-sized print: what lands in the message, and what it saves
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        started = time.perf_counter()
+        output = BoundedOutput(spill_path(work_dir, "tmp_code_demo.py"))
+        with redirect_stdout(output):
+            for row in np.random.rand(20000, 8):
+                print(" ".join(f"{value:.6f}" for value in row))
+        output.close()
+        seconds = time.perf_counter() - started
+        message = output.getvalue()
+        stats = output.stats()
+        print(message[:300])
+        print(f"{stats['bytes']:,} bytes printed, {_bytes(message):,} kept in the message, "
+              f"{stats['tokens_saved']:,} tokens saved, {seconds:.2f}s")
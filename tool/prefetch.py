@@ -0,0 +1,274 @@
+# Speculative market-data prefetch from the Planner's and Admin's messages.
+#
+# In the Planner -> Engineer -> Executor flow the download only starts when
+# the Engineer's code reaches the Executor, two LLM round trips after the
+# tickers and the period were first named. The Prefetcher subscribes to the
+# event bus, picks ticker symbols and a period out of what the Planner and
+# the Admin send and warms the local store (tool/market_data.py) on a
+# background thread while the Engineer is still writing its code:
+#
+#     get_prefetcher().subscribe()      # once per process
+#     python -m tool.prefetch "Compare AAPL and MSFT over the past 6 months"
+#     python -m tool.prefetch --report  # hit rate and seconds saved
+#
+# Plans are full of upper-case words (PLOT, CLOSE, SAVE), so a bare one is
+# only taken for a symbol if it is a well-known one or already in the store;
+# any other has to be marked as one: $ABNB, ^GSPC, (ABNB) or a share class
+# like BRK-B. Company names (Apple, Nvidia) count too. Periods are ISO
+# dates, "past/last N days/weeks/months/years", "year to date", "since 2023"
+# or "in 2023". Without a period the last year is warmed. Whether a prefetch
+# paid off is decided when get_stock_prices asks for the ticker, possibly in
+# an executor subprocess, so the outcomes are read back from the store's
+# prefetch.jsonl.
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from tool.events import MESSAGE, get_bus
+from tool.market_data import PREFETCH_LOG, default_store, to_day
+
+SPEAKERS = ("Planner", "Admin")
+MAX_TICKERS = 10
+
+TICKER = re.compile(r"(?<![\w$^])([$^]?)([A-Z]{1,5}(?:[.-][A-Z]{1,2})?)\b")
+# Upper-case words in plans that are not tickers
+NOT_TICKERS = {
+    "A", "I", "AI", "API", "APIS", "ASAP", "CEO", "CFO", "CSV", "DATA", "EPS", "ETF", "EU", "EUR", "FAQ", "FY",
+    "GDP", "HTML", "HTTP", "ID", "IPO", "JSON", "KPI", "MD", "NA", "NAN", "NASDAQ", "NOTE", "NYSE", "OHLC",
+    "OHLCV", "OK", "PDF", "PE", "PNG", "Q", "QA", "ROI", "SEC", "SMA", "EMA", "RSI", "MACD", "SQL", "STEP",
+    "TBD", "TERMINATE", "TODO", "UI", "UK", "URL", "US", "USA", "USD", "UTC", "VS", "YOY", "YTD", "TL", "DR",
+    "AND", "OR", "THE", "TO", "OF", "IN", "ON", "FOR", "IS", "IT", "BE", "AS", "AT", "BY", "IF", "NO", "NOT",
+}
+COMPANIES = {
+    "apple": "AAPL", "microsoft": "MSFT", "nvidia": "NVDA", "tesla": "TSLA", "amazon": "AMZN",
+    "alphabet": "GOOGL", "google": "GOOGL", "meta": "META", "facebook": "META", "netflix": "NFLX",
+    "intel": "INTC", "amd": "AMD", "ibm": "IBM", "oracle": "ORCL", "salesforce": "CRM",
+    "s&p 500": "^GSPC", "s&p500": "^GSPC", "nasdaq composite": "^IXIC", "dow jones": "^DJI",
+}
+# Bare upper-case words taken for symbols without a $ or parentheses
+KNOWN_TICKERS = set(COMPANIES.values()) | {
+    "GOOG", "SPY", "QQQ", "DIA", "IWM", "VOO", "VTI", "JPM", "BAC", "WFC", "GS", "WMT", "DIS", "KO", "PEP",
+    "MCD", "NKE", "XOM", "CVX", "PFE", "JNJ", "MRK", "UNH", "LLY", "AVGO", "ADBE", "CSCO", "QCOM", "TXN", "TSM",
+    "ASML", "UBER", "PYPL", "SHOP", "PLTR", "COIN", "BABA", "SBUX",
+}
+COMPANY = re.compile(r"\b(" + "|".join(re.escape(name) for name in sorted(COMPANIES, key=len, reverse=True))
+                     + r")\b", re.IGNORECASE)
+
+DATE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+NUMBERS = {"a": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "nine": 9, "twelve": 12}
+RELATIVE = re.compile(r"\b(?:past|last|previous|prior)\s+(\d+|a|one|two|three|four|five|six|nine|twelve)?\s*"
+                      r"(day|week|month|quarter|year)s?\b", re.IGNORECASE)
+YEAR_TO_DATE = re.compile(r"\b(?:year[- ]to[- ]date|YTD)\b", re.IGNORECASE)
+SINCE_YEAR = re.compile(r"\bsince\s+(\d{4})\b", re.IGNORECASE)
+IN_YEAR = re.compile(r"\b(?:in|for|during)\s+(\d{4})\b", re.IGNORECASE)
+UNIT_DAYS = {"day": 1, "week": 7, "month": 31, "quarter": 92, "year": 366}
+
+
+def tickers_in(text, known=()):
+    """Ticker symbols named in `text`, in order of first mention.
+
+    A bare upper-case word counts only if it is in KNOWN_TICKERS or `known`
+    (e.g. the store's tickers), or is marked as a symbol: (ABNB), BRK-B.
+    """
+    known = KNOWN_TICKERS.union(known)
+    found = []
+    for match in TICKER.finditer(text):
+        prefix, symbol = match.groups()
+        if prefix == "^":
+            symbol = "^" + symbol
+        elif not prefix and (symbol in NOT_TICKERS or len(symbol) == 1):
+            # A bare single letter (F, T) is an ordinary word far more often than a ticker
+            continue
+        elif not prefix and symbol not in known and not _marked(text, match):
+            continue
+        found.append(symbol)
+    found += [COMPANIES[name.lower()] for name in COMPANY.findall(text)]
+    return list(dict.fromkeys(found))
+
+
+def _marked(text, match):
+    # "(ABNB)" on its own in parentheses, or with a share class: "BRK-B", "BF.B"
+    symbol = match.group(2)
+    return ("-" in symbol or "." in symbol
+            or text[match.start() - 1:match.start()] == "(" and text[match.end():match.end() + 1] == ")")
+
+
+def period_in(text, today=None):
+    """(start, end) named in `text` as Timestamps, end exclusive; None if no period is named."""
+    today = to_day(today or pd.Timestamp.now())
+    dates = sorted(to_day(value) for value in DATE.findall(text) if _valid(value))
+    if dates:
+        return dates[0], max(dates[-1] + pd.Timedelta(days=1), today if len(dates) == 1 else dates[-1])
+    match = RELATIVE.search(text)
+    if match:
+        count = match.group(1) or "1"
+        count = int(count) if count.isdigit() else NUMBERS[count.lower()]
+        return today - pd.Timedelta(days=count * UNIT_DAYS[match.group(2).lower()]), today
+    if YEAR_TO_DATE.search(text):
+        return pd.Timestamp(year=today.year, month=1, day=1), today
+    match = SINCE_YEAR.search(text)
+    if match:
+        return pd.Timestamp(year=int(match.group(1)), month=1, day=1), today
+    match = IN_YEAR.search(text)
+    if match and 1970 <= int(match.group(1)) <= today.year:
+        year = int(match.group(1))
+        return pd.Timestamp(year=year, month=1, day=1), min(pd.Timestamp(year=year + 1, month=1, day=1), today)
+    return None
+
+
+def _valid(value):
+    try:
+        pd.Timestamp(value)
+        return True
+    except ValueError:
+        return False
+
+
+class Prefetcher:
+    """Warms the market-data store with what the Planner and the Admin talk about."""
+
+    def __init__(self, store=None, speakers=SPEAKERS, margin_days=7, default_days=365, max_tickers=MAX_TICKERS,
+                 workers=2):
+        self.store = store or default_store()
+        self.speakers = set(speakers)
+        # The Engineer's code rarely asks for exactly the period named; take a few days more
+        self.margin = pd.Timedelta(days=margin_days)
+        self.default_days = default_days
+        self.max_tickers = max_tickers
+        self.started = time.time()
+        self.prefetches = 0
+        self.subscription = None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+
+    def subscribe(self, bus=None):
+        """Watch every run's messages (once; later calls return the same subscription)."""
+        with self._lock:
+            if self.subscription is None:
+                self.subscription = (bus or get_bus()).subscribe(self, kinds=(MESSAGE,), threaded=True,
+                                                                 name="market data prefetch")
+            return self.subscription
+
+    def __call__(self, event):
+        if event.name in self.speakers and event.content:
+            self.scan(str(event.content))
+
+    def scan(self, text):
+        """Prefetch what `text` names; returns the (tickers, start, end) submitted, or None."""
+        tickers = tickers_in(text, known=self.store.tickers())[:self.max_tickers]
+        if not tickers:
+            return None
+        period = period_in(text)
+        if period is None:
+            today = to_day(pd.Timestamp.now())
+            period = today - pd.Timedelta(days=self.default_days), today
+        start, end = period[0] - self.margin, period[1]
+        tickers = [ticker for ticker in tickers if self._wanted(ticker, start, end)]
+        if not tickers:
+            return None
+        for ticker in tickers:
+            self.store.start_prefetch(ticker, start, end)
+        with self._lock:
+            self.prefetches += 1
+        self._pool.submit(self._warm, tickers, start, end)
+        return tickers, start, end
+
+    def _wanted(self, ticker, start, end):
+        if not self.store.missing_ranges(ticker, start, end):
+            return False
+        marker = self.store.prefetch_marker(ticker)
+        # Already on its way
+        return marker is None or marker["status"] != "fetching"
+
+    def _warm(self, tickers, start, end):
+        started = time.perf_counter()
+        try:
+            failed = self.store.ensure_many(tickers, start, end)
+        except Exception as e:
+            failed = {ticker: f"{type(e).__name__}: {e}" for ticker in tickers}
+        seconds = time.perf_counter() - started
+        for ticker in tickers:
+            self.store.finish_prefetch(ticker, seconds, failed.get(ticker))
+
+    def stats(self):
+        return prefetch_stats(self.store.root, since=self.started)
+
+    def summary(self):
+        stats = self.stats()
+        if not stats["prefetched"] and not stats["demands"]:
+            return "Prefetch: nothing prefetched"
+        rate = f"{stats['hit_rate']:.0%}" if stats["hit_rate"] is not None else "n/a"
+        return (f"Prefetch: {stats['prefetched']} tickers warmed, hit rate {rate} "
+                f"({stats['hits']} hits, {stats['late']} late, {stats['stale']} stale, {stats['misses']} misses), "
+                f"{stats['seconds_saved']:.1f}s saved, {stats['unused']} unused")
+
+    def close(self):
+        if self.subscription is not None:
+            get_bus().unsubscribe(self.subscription)
+            self.subscription = None
+        self._pool.shutdown(wait=False)
+
+
+def prefetch_stats(root, since=0.0):
+    """Hit rate and seconds saved from the prefetch log of the store at `root`."""
+    entries = []
+    for path in (os.path.join(root, PREFETCH_LOG + ".1"), os.path.join(root, PREFETCH_LOG)):
+        if os.path.exists(path):
+            with open(path) as f:
+                entries += [json.loads(line) for line in f if line.endswith("\n")]
+    entries = [entry for entry in entries if entry["t"] >= since]
+    prefetched = [entry for entry in entries if entry["type"] == "prefetch"]
+    demands = [entry for entry in entries if entry["type"] == "demand"]
+    outcomes = [entry["outcome"] for entry in demands]
+    hits, late = outcomes.count("hit"), outcomes.count("late")
+    claimed = {entry["ticker"] for entry in demands if entry["outcome"] != "miss"}
+    return {
+        "prefetched": len(prefetched),
+        "failed": sum(1 for entry in prefetched if entry["error"]),
+        "demands": len(demands),
+        "hits": hits,
+        "late": late,
+        "stale": outcomes.count("stale"),
+        "misses": outcomes.count("miss"),
+        # Late prefetches still saved part of the download
+        "hit_rate": round((hits + late) / len(demands), 3) if demands else None,
+        "seconds_saved": round(sum(entry["saved"] for entry in demands), 3),
+        "seconds_waited": round(sum(entry["waited"] for entry in demands), 3),
+        "unused": sum(1 for entry in prefetched if entry["ticker"] not in claimed),
+    }
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """The process-wide Prefetcher on the default store."""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+        return _prefetcher
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Show what a message would prefetch, or the prefetch report")
+    parser.add_argument("text", nargs="?")
+    parser.add_argument("--report", action="store_true", help="hit rate and seconds saved")
+    parser.add_argument("--hours", type=float, default=24.0, help="report on the last N hours")
+    args = parser.parse_args()
+
+    if args.report or not args.text:
+        print(json.dumps(prefetch_stats(default_store().root, since=time.time() - args.hours * 3600), indent=2))
+    else:
+        period = period_in(args.text)
+        tickers = tickers_in(args.text, known=default_store().tickers())
+        print(f"tickers: {', '.join(tickers) or '-'}")
+        print(f"period: {' to '.join(str(day.date()) for day in period) if period else 'default (last year)'}")
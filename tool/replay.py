@@ -0,0 +1,532 @@
+# Record real conversations and replay them offline.
+#
+# With RECORD_RUNS set (to a directory, or 1 for .cache/recordings) every
+# run of the report pipelines is recorded to <dir>/<run id>.jsonl: each LLM
+# request with its response, latency and time to first token, each code
+# execution with its code, exit code, output and duration, what people typed,
+# and every message and turn, timestamped. The Recorder sits on the session's
+# cache (every agent's LLM call goes through it) and wraps its code executors.
+#
+# A recording replays against the current code without network access: the
+# pipeline it came from is built again, its LLM is a local mock server
+# (tool/mock_llm.py) answering each request with the recorded response, code
+# executions return the recorded output without running anything, and human
+# input is answered as it was. Speaker selection calls, which autogen makes
+# without the cache, are answered with the recorded next speaker. Replays run at full speed or with the
+# recorded timings, and report where the conversation diverged, if anywhere:
+#
+#     RECORD_RUNS=1 streamlit run autogen_st_3.py
+#     python -m tool.replay                                  # list recordings
+#     python -m tool.replay .cache/recordings/<run>.jsonl    # full speed
+#     python -m tool.replay <recording> --timing recorded    # as it happened
+#
+# The command exits with status 1 when the replay diverged, so recordings
+# can be kept as fixtures for the group chat, speaker transitions and
+# rendering paths.
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+from autogen import Agent
+from autogen.coding.base import CommandLineCodeResult
+from autogen.io import IOStream
+
+from tool.bench import StreamlitUI, environ, isolate
+from tool.events import MESSAGE, get_bus
+from tool.jobs import load_pipeline
+from tool.llm_cache import normalize_messages
+from tool.loop import ChatRun, submit
+from tool.mock_llm import CANDIDATES, TOKEN, MockLLM, Reply, Script
+from tool.streaming import TokenStream, quiet_token_stream
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DIR = os.path.join(ROOT, ".cache", "recordings")
+
+
+def _request_hash(messages):
+    return hashlib.sha256(json.dumps(normalize_messages(messages), sort_keys=True,
+                                     default=str).encode("utf-8")).hexdigest()
+
+
+def _system(messages):
+    return next((m.get("content") or "" for m in messages if m.get("role") == "system"), "").strip()
+
+
+def _response(value):
+    """What a replay needs of an autogen/OpenAI ChatCompletion."""
+    try:
+        choice = value.choices[0]
+        usage = getattr(value, "usage", None)
+        return {"model": getattr(value, "model", None), "text": choice.message.content or "",
+                "finish_reason": choice.finish_reason,
+                "usage": {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+                if usage is not None else None}
+    except (AttributeError, IndexError):
+        return {"model": None, "text": str(value), "finish_reason": None, "usage": None}
+
+
+def get_recorder(pipeline, config):
+    """A Recorder for the pipeline's runs when RECORD_RUNS is set, otherwise None."""
+    directory = os.environ.get("RECORD_RUNS")
+    if not directory:
+        return None
+    return Recorder(pipeline, config, DEFAULT_DIR if directory == "1" else directory)
+
+
+# Recording
+
+class RecordingCache:
+    """The session's cache, with every lookup and stored completion recorded."""
+
+    def __init__(self, inner, recorder):
+        self.inner = inner
+        self.recorder = recorder
+        self._local = threading.local()
+
+    def get(self, key, default=None):
+        value = self.inner.get(key, default) if self.inner is not None else default
+        if value is not default:
+            self.recorder.llm_call(key, value, 0.0, None, cached=True)
+        else:
+            self._local.started = (key, time.perf_counter())
+        return value
+
+    def set(self, key, value):
+        started = getattr(self._local, "started", None)
+        if started is not None and started[0] == key:
+            self._local.started = None
+            seconds = time.perf_counter() - started[1]
+            iostream = IOStream.get_default()
+            ttft = None
+            if isinstance(iostream, TokenStream) and iostream.first_token is not None \
+                    and iostream.first_token >= started[1]:
+                ttft = iostream.first_token - started[1]
+            self.recorder.llm_call(key, value, seconds, ttft)
+        if self.inner is not None:
+            self.inner.set(key, value)
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __deepcopy__(self, memo):
+        # Speaker selection gets it in the manager's llm_config, which autogen copies
+        return self
+
+
+class RecordingExecutor:
+    """A code executor whose executions are recorded; everything else is the wrapped one's."""
+
+    def __init__(self, inner, recorder, name):
+        self.inner = inner
+        self.recorder = recorder
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(self.inner, attribute)
+
+    @property
+    def code_extractor(self):
+        return self.inner.code_extractor
+
+    def execute_code_blocks(self, code_blocks):
+        started = time.perf_counter()
+        result = self.inner.execute_code_blocks(code_blocks)
+        self.recorder.append({"type": "code", "agent": self.name,
+                              "code": [[block.language, block.code] for block in code_blocks],
+                              "exit_code": result.exit_code, "output": result.output,
+                              "seconds": time.perf_counter() - started})
+        return result
+
+    def restart(self):
+        self.inner.restart()
+
+
+class Recorder:
+    """Records the runs of one session to <directory>/<run id>.jsonl."""
+
+    def __init__(self, pipeline, config, directory=DEFAULT_DIR):
+        self.pipeline = pipeline
+        self.config = config
+        self.directory = directory
+        self.path = None
+        self.started = None
+        self.names = {}  # system message -> agent name
+        self._lock = threading.Lock()
+
+    def copy(self):
+        """Same pipeline and directory, no run (one per session)."""
+        return Recorder(self.pipeline, self.config, self.directory)
+
+    def track(self, agents):
+        for agent in agents:
+            if agent.system_message:
+                self.names[agent.system_message.strip()] = agent.name
+            agent.register_reply([Agent, None], reply_func=_turn, config=self)
+            agent.register_hook("process_message_before_send", self._sent)
+            if agent.human_input_mode != "NEVER":
+                self._record_human_input(agent)
+
+    def _record_human_input(self, agent):
+        get_human_input, a_get_human_input = agent.get_human_input, agent.a_get_human_input
+
+        def record(reply):
+            self.append({"type": "human", "agent": agent.name, "reply": reply})
+            return reply
+
+        agent.get_human_input = lambda prompt: record(get_human_input(prompt))
+
+        async def a_record(prompt):
+            return record(await a_get_human_input(prompt))
+
+        agent.a_get_human_input = a_record
+
+    def wrap(self, name, executor):
+        return RecordingExecutor(executor, self, name)
+
+    def cache(self, inner):
+        return RecordingCache(inner, self)
+
+    def start(self, message, run_id=None):
+        with self._lock:
+            self.path = os.path.join(self.directory, f"{run_id or uuid.uuid4().hex[:12]}.jsonl")
+            self.started = time.time()
+            if os.path.exists(self.path):
+                # A run started over under the same id
+                os.remove(self.path)
+        self.append({"type": "start", "pipeline": self.pipeline, "config": self.config, "task": message,
+                     "time": self.started})
+
+    def follow_up(self, message):
+        self.append({"type": "follow_up", "message": message})
+
+    def append(self, entry):
+        with self._lock:
+            if self.path is None:
+                # Recording joined a run already under way
+                self.path = os.path.join(self.directory, f"{uuid.uuid4().hex[:12]}.jsonl")
+                self.started = time.time()
+            entry = dict(entry, t=round(time.time() - self.started, 4))
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+    def llm_call(self, key, value, seconds, ttft, cached=False):
+        try:
+            request = json.loads(key)
+        except (TypeError, ValueError):
+            request = {"key": str(key)}
+        messages = request.get("messages") or []
+        self.append({"type": "llm", "caller": self.names.get(_system(messages)), "request": request,
+                     "hash": _request_hash(messages), "response": _response(value), "seconds": seconds,
+                     "ttft": ttft, "cached": cached})
+
+    def turn(self, name):
+        self.append({"type": "turn", "speaker": name})
+
+    def _sent(self, sender, message, recipient, silent):
+        content = message if isinstance(message, str) else (message or {}).get("content")
+        self.append({"type": "message", "speaker": sender.name, "content": content})
+        return message
+
+
+def _turn(recipient, messages=None, sender=None, config=None):
+    config.turn(recipient.name)
+    return False, None
+
+
+# Replaying
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.endswith("\n")]
+
+
+class ReplayScript(Script):
+    """Answers the mock LLM's requests from a recording."""
+
+    def __init__(self, replayer):
+        super().__init__(replies={})
+        self.replayer = replayer
+        self.by_hash = defaultdict(deque)
+        self.by_caller = defaultdict(deque)
+        for entry in replayer.entries:
+            # Speaker selection goes through the cache too, but is answered from the recorded turns
+            if entry["type"] == "llm" and not self.selection(entry["request"].get("messages") or []):
+                self.by_hash[entry["hash"]].append(entry)
+                self.by_caller[entry["caller"]].append(entry)
+        self.served = self.matched = self.unmatched = self.selections = 0
+
+    @staticmethod
+    def selection(messages):
+        """The candidates match of a speaker-selection request, or None."""
+        for message in reversed(messages):
+            match = CANDIDATES.search(str(message.get("content") or ""))
+            if match:
+                return match
+        return None
+
+    def reply(self, messages):
+        replayer = self.replayer
+        match = self.selection(messages)
+        if match:
+            candidates = [name.strip(" '\"") for name in match.group(1).split(",")]
+            speaker, seconds = replayer.next_turn()
+            with self._lock:
+                self.selections += 1
+            if speaker not in candidates:
+                replayer.diverged(f"speaker selection: recorded {speaker}, candidates {candidates}")
+                speaker = candidates[0]
+            return Reply("speaker selection", speaker, seconds if replayer.timed else 0.0, None)
+        caller = self.caller(messages)
+        with self._lock:
+            self.served += 1
+            queue = self.by_hash.get(_request_hash(messages), ())
+            entry = next((e for e in queue if not e.get("used")), None)
+            matched = entry is not None
+            if not matched:
+                # The request changed; go on with the caller's next recorded answer
+                entry = next((e for e in self.by_caller.get(caller, ()) if not e.get("used")), None)
+            if matched:
+                self.matched += 1
+            else:
+                self.unmatched += 1
+            if entry is not None:
+                entry["used"] = True
+        if entry is None:
+            replayer.diverged(f"LLM request by {caller} has no recorded answer")
+            return Reply(caller, "TERMINATE", 0.0, None)
+        if not matched:
+            replayer.diverged(f"LLM request by {caller} differs from the recording")
+        text = entry["response"]["text"]
+        if not replayer.timed:
+            return Reply(caller, text, 0.0, None)
+        # Recorded time to first token, then the rest of the tokens at the recorded rate
+        seconds, ttft = entry["seconds"], entry.get("ttft")
+        if ttft is None or seconds <= ttft:
+            return Reply(caller, text, seconds, None)
+        return Reply(caller, text, ttft, len(TOKEN.findall(text)) / (seconds - ttft))
+
+
+class ReplayExecutor:
+    """Returns the recorded results of an agent's code executions, in order, without running them."""
+
+    def __init__(self, inner, replayer, name):
+        self.inner = inner
+        self.replayer = replayer
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(self.inner, attribute)
+
+    @property
+    def code_extractor(self):
+        return self.inner.code_extractor
+
+    def execute_code_blocks(self, code_blocks):
+        entry = self.replayer.next_code(self.name)
+        if entry is None:
+            self.replayer.diverged(f"{self.name} ran code that is not in the recording")
+            return CommandLineCodeResult(exit_code=1, output="Not in the recording")
+        if [[block.language, block.code] for block in code_blocks] != entry["code"]:
+            self.replayer.diverged(f"{self.name} ran different code than recorded")
+        if self.replayer.timed:
+            time.sleep(entry["seconds"])
+        return CommandLineCodeResult(exit_code=entry["exit_code"], output=entry["output"])
+
+    def restart(self):
+        pass
+
+
+class Replayer:
+    """Takes a Recorder's place in the engine and serves a recording to one session."""
+
+    def __init__(self, entries, timed=False):
+        self.entries = entries
+        self.timed = timed
+        self.start = next(e for e in entries if e["type"] == "start")
+        self.recorded = [e for e in entries if e["type"] == "message"]
+        self.replayed = []
+        self.divergences = []
+        self.script = ReplayScript(self)
+        self._code = defaultdict(deque)
+        self._human = defaultdict(deque)
+        for entry in entries:
+            if entry["type"] == "code":
+                self._code[entry["agent"]].append(entry)
+            elif entry["type"] == "human":
+                self._human[entry["agent"]].append(entry["reply"])
+        self._lock = threading.Lock()
+
+    def copy(self):
+        return self
+
+    def track(self, agents):
+        self.script.learn(agents)
+        for agent in agents:
+            agent.register_hook("process_message_before_send", self._sent)
+            if agent.human_input_mode != "NEVER":
+                # The recorded answers, in order; "exit" ends the chat as a person would
+                agent.get_human_input = lambda prompt, name=agent.name: self.next_human_input(name)
+
+                async def a_get_human_input(prompt, name=agent.name):
+                    return self.next_human_input(name)
+
+                agent.a_get_human_input = a_get_human_input
+
+    def wrap(self, name, executor):
+        return ReplayExecutor(executor, self, name)
+
+    def cache(self, inner):
+        return inner
+
+    def start(self, message, run_id=None):
+        pass
+
+    def follow_up(self, message):
+        pass
+
+    def next_code(self, name):
+        with self._lock:
+            return self._code[name].popleft() if self._code[name] else None
+
+    def next_human_input(self, name):
+        with self._lock:
+            if self._human[name]:
+                return self._human[name].popleft()
+        self.diverged(f"{name} was asked for input that is not in the recording")
+        return "exit"
+
+    def next_turn(self):
+        """The recorded next speaker and how long it took from the last message to its turn."""
+        with self._lock:
+            position = len(self.replayed)
+        if position >= len(self.recorded):
+            return None, 0.0
+        speaker = self.recorded[position]["speaker"]
+        since = self.recorded[position - 1]["t"] if position else self.start.get("t", 0.0)
+        turn = next((e["t"] for e in self.entries if e["type"] == "turn" and e["speaker"] == speaker
+                     and e["t"] >= since), since)
+        return speaker, max(turn - since, 0.0)
+
+    def diverged(self, what):
+        with self._lock:
+            self.divergences.append({"message": len(self.replayed), "what": what})
+
+    def _sent(self, sender, message, recipient, silent):
+        content = message if isinstance(message, str) else (message or {}).get("content")
+        with self._lock:
+            self.replayed.append({"speaker": sender.name, "content": content})
+        return message
+
+    def compare(self):
+        """Where the replayed conversation first differs from the recorded one."""
+        for i, (recorded, replayed) in enumerate(zip(self.recorded, self.replayed)):
+            if recorded["speaker"] != replayed["speaker"]:
+                return {"message": i, "recorded": recorded["speaker"], "replayed": replayed["speaker"]}
+            if recorded["content"] != replayed["content"]:
+                return {"message": i, "speaker": recorded["speaker"], "content": "differs"}
+        if len(self.recorded) != len(self.replayed):
+            return {"message": min(len(self.recorded), len(self.replayed)),
+                    "recorded messages": len(self.recorded), "replayed messages": len(self.replayed)}
+        return None
+
+
+async def _conversation(session, replayer):
+    await session.a_initiate_chat(message=replayer.start["task"])
+    for entry in replayer.entries:
+        if entry["type"] == "follow_up":
+            await session.a_continue(entry["message"])
+
+
+def replay(path, timing="fast", ui=True):
+    """Replay a recording against the current code; returns a report (see compare())."""
+    entries = load(path)
+    replayer = Replayer(entries, timed=timing == "recorded")
+    directory = tempfile.mkdtemp(prefix="replay-")
+    try:
+        with MockLLM(replayer.script, latency=0.0, tokens_per_second=0.0) as mock, \
+                environ(OPENAI_BASE_URL=mock.url, OPENAI_API_KEY="replay"):
+            _, build = load_pipeline(replayer.start["pipeline"])
+            engine = isolate(build(**replayer.start["config"]), "replay", directory)
+            engine.recorder = replayer
+            session = engine.new_session(work_dir=os.path.join(directory, "work"))
+            run = ChatRun(task=replayer.start["task"], context=quiet_token_stream)
+            render = StreamlitUI()
+            ui_seconds = [0.0]
+
+            def on_message(event):
+                started = time.perf_counter()
+                render(event)
+                ui_seconds[0] += time.perf_counter() - started
+
+            subscription = get_bus().subscribe(on_message, kinds=(MESSAGE,), run=run, threaded=True,
+                                               name="replay ui") if ui else None
+            try:
+                submit(run._main(_conversation(session, replayer))).result()
+            finally:
+                if subscription is not None:
+                    get_bus().unsubscribe(subscription)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    script = replayer.script
+    recorded_seconds = max((e["t"] for e in entries), default=0.0)
+    return {
+        "recording": path,
+        "timing": timing,
+        "status": run.status,
+        "error": str(run.error) if run.error is not None else None,
+        "seconds": round((run.finished or time.time()) - (run.started or time.time()), 3),
+        "recorded_seconds": round(recorded_seconds, 3),
+        "messages": {"recorded": len(replayer.recorded), "replayed": len(replayer.replayed)},
+        "llm": {"served": script.served, "matched": script.matched, "unmatched": script.unmatched,
+                "speaker_selections": script.selections},
+        "ui_seconds": round(ui_seconds[0], 4) if ui else None,
+        "first_difference": replayer.compare(),
+        "divergences": replayer.divergences,
+    }
+
+
+def recordings(directory=DEFAULT_DIR):
+    """(path, task, messages, last modified) of every recording, newest first."""
+    found = []
+    for path in glob.glob(os.path.join(directory, "*.jsonl")):
+        entries = load(path)
+        start = next((e for e in entries if e["type"] == "start"), {})
+        found.append((path, start.get("task"), sum(e["type"] == "message" for e in entries),
+                      os.path.getmtime(path)))
+    return sorted(found, key=lambda recording: recording[3], reverse=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="List recorded runs or replay one offline")
+    parser.add_argument("recording", nargs="?")
+    parser.add_argument("--dir", default=os.environ.get("RECORD_RUNS") not in (None, "", "1")
+                        and os.environ["RECORD_RUNS"] or DEFAULT_DIR)
+    parser.add_argument("--timing", choices=("fast", "recorded"), default="fast")
+    parser.add_argument("--no-ui", action="store_true", help="do not time the transcript rendering")
+    args = parser.parse_args()
+    if args.recording is None:
+        for path, task, messages, modified in recordings(args.dir):
+            print(f"{os.path.basename(path)}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(modified))}  "
+                  f"{messages:3d} messages  {(task or '')[:60]}")
+    else:
+        report = replay(args.recording, args.timing, ui=not args.no_ui)
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["first_difference"] or report["divergences"] or report["status"] != "done" else 0)
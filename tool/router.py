@@ -0,0 +1,411 @@
+# Per-role model routing with latency- and error-aware failover over OAI_CONFIG_LIST.
+#
+# Every app pins one llm_config for all of its agents. With a Router the
+# ChatEngine (tool/engine.py) gives each agent the config-list entries of its
+# role's route instead: a cheap, fast model for the Planner, the Critic and
+# speaker selection, a stronger one for the Engineer and the Writer. Within a
+# route the entries are tried healthiest first: lowest observed latency (an
+# average that follows recent calls) scaled by the calls already in flight, so
+# concurrent sessions spread over equivalent endpoints, and by the error rate
+# of the last five minutes. An entry that fails three times in a row sits out
+# a cooldown. A failed call goes on to the next entry of the route, then to
+# the rest of the config list, and only the last error reaches the agent.
+#
+#     MODEL_ROUTING=1 streamlit run autogen_st_3.py   # routes over OAI_CONFIG_LIST
+#     python -m tool.router                           # which entries each role gets
+#     python -m tool.router --metrics                 # per-route calls, errors, latency
+#
+# Route entries are model names; a dated version (gpt-3.5-turbo-0125) matches
+# its base name. A route that matches nothing in the config list uses the
+# whole list. Per-route and per-endpoint counters and latency quantiles are
+# written to <METRICS_DIR>/routes.prom next to the chat metrics.
+#
+# Speaker selection runs on agents autogen builds from the manager's
+# llm_config for each selection, out of the Router's reach: it gets its
+# route's entries in the order of health when the session starts, and
+# autogen's own failover along that list, but its calls are not timed here.
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+
+import autogen
+from autogen import OpenAIWrapper
+from openai import APIError
+
+from tool.metrics import DEFAULT_DIR, QUANTILES, WINDOW, export, percentile, write_text
+
+SPEAKER_SELECTION = "speaker_selection"  # the role of the GroupChatManager's calls
+ROUTES = {
+    "fast": ("gpt-4o-mini", "gpt-3.5-turbo"),
+    "strong": ("gpt-4o", "gpt-4-turbo", "gpt-4"),
+}
+ROLES = {
+    "Admin": "fast",
+    "Planner": "fast",
+    "Critic": "fast",
+    SPEAKER_SELECTION: "fast",
+    "Engineer": "strong",
+    "Writer": "strong",
+}
+DEFAULT_ROUTE = "default"  # roles not in ROLES: the whole config list
+
+ALPHA = 0.3  # weight of the latest call in the latency average
+ERROR_WINDOW = 20  # recent outcomes the error rate is taken over
+ERROR_HORIZON = 300.0  # seconds; older errors no longer count against an endpoint
+MAX_ERRORS = 3  # consecutive errors before an endpoint sits out
+COOLDOWN = 30.0  # seconds, doubling with every further error up to MAX_COOLDOWN
+MAX_COOLDOWN = 300.0
+ERROR_SECONDS = 10.0  # what a failed call is taken to cost before the next endpoint answers
+# Errors that are the request's fault: another endpoint would refuse it too
+REQUEST_ERRORS = (400, 422)
+
+
+def matches(model, name):
+    """Whether config-list `model` is `name` or a dated version of it (gpt-4o-2024-08-06)."""
+    return re.fullmatch(re.escape(name) + r"(-[\d-]+)?", model or "") is not None
+
+
+def endpoint_name(entry):
+    host = entry.get("base_url") or entry.get("azure_endpoint")
+    return f"{entry.get('model')}@{host}" if host else str(entry.get("model"))
+
+
+class Endpoint:
+    """Observed health of one config-list entry, shared by every route that uses it."""
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.name = endpoint_name(entry)
+        self.latency = None  # seconds, average of recent calls
+        self.inflight = 0
+        self.outcomes = deque(maxlen=ERROR_WINDOW)  # (time, True for an error)
+        self.consecutive_errors = 0
+        self.down_until = 0.0
+
+    @property
+    def error_rate(self):
+        since = time.time() - ERROR_HORIZON
+        recent = [error for t, error in self.outcomes if t >= since]
+        return sum(recent) / len(recent) if recent else 0.0
+
+    def available(self, now):
+        return now >= self.down_until
+
+    def score(self):
+        """Expected seconds for a call here; untried endpoints come first."""
+        latency = (self.latency or 0.0) * (1 + self.inflight)
+        # A call that fails has to be made again elsewhere
+        return (latency + self.error_rate * ERROR_SECONDS) / max(1.0 - self.error_rate, 0.1)
+
+
+class Router:
+    """Routes each agent role to its config-list entries and keeps their health."""
+
+    def __init__(self, config_list, routes=ROUTES, roles=ROLES, fallback=True, directory=DEFAULT_DIR):
+        if not config_list:
+            raise ValueError("The config list is empty")
+        self.config_list = [dict(entry) for entry in config_list]
+        self.endpoints = [Endpoint(entry) for entry in self.config_list]
+        self.routes = {}
+        for route, models in routes.items():
+            endpoints = [e for name in models for e in self.endpoints if matches(e.entry.get("model"), name)]
+            self.routes[route] = list(dict.fromkeys(endpoints)) or list(self.endpoints)
+        self.routes.setdefault(DEFAULT_ROUTE, list(self.endpoints))
+        self.roles = dict(roles)
+        # After the route's own entries, the rest of the config list
+        self.fallback = fallback
+        self.directory = directory
+        self.prom_path = os.path.join(directory, "routes.prom")
+        self.counters = defaultdict(lambda: defaultdict(float))  # (route, endpoint) -> counts
+        self.latencies = defaultdict(lambda: deque(maxlen=WINDOW))  # (route, endpoint) -> seconds
+        self._clients = {}
+        self._written = 0.0
+        self._lock = threading.Lock()
+
+    def route_for(self, role):
+        return self.roles.get(role, DEFAULT_ROUTE)
+
+    def order(self, route):
+        """The endpoints to try for `route`, best first."""
+        now = time.time()
+        with self._lock:
+            endpoints = self.routes.get(route, self.routes[DEFAULT_ROUTE])
+            ordered = sorted(endpoints, key=lambda e: (not e.available(now), e.score()))
+            if self.fallback:
+                rest = [e for e in self.endpoints if e not in endpoints]
+                ordered += sorted(rest, key=lambda e: (not e.available(now), e.score()))
+            return ordered
+
+    def llm_config(self, role, llm_config):
+        """`llm_config` with the role's entries, best first, as its config_list."""
+        base = {k: v for k, v in llm_config.items() if k not in ("model", "config_list")}
+        return dict(base, config_list=[dict(e.entry) for e in self.order(self.route_for(role))])
+
+    def client(self, role, llm_config):
+        """A RoutedClient for the role's route with `llm_config`'s parameters (one per route and config)."""
+        route = self.route_for(role)
+        base = {k: v for k, v in llm_config.items() if k not in ("model", "config_list")}
+        key = (route, json.dumps(base, sort_keys=True, default=str))
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = RoutedClient(self, route, base)
+            return client
+
+    def started(self, endpoint):
+        with self._lock:
+            endpoint.inflight += 1
+
+    def released(self, endpoint):
+        """A call that says nothing about the endpoint (the request itself was refused)."""
+        with self._lock:
+            endpoint.inflight -= 1
+
+    def finished(self, route, endpoint, seconds, error=None, cached=False, failover=False):
+        with self._lock:
+            endpoint.inflight -= 1
+            counters = self.counters[(route, endpoint.name)]
+            counters["calls"] += 1
+            if error is not None:
+                counters["errors"] += 1
+                if failover:
+                    counters["failovers"] += 1
+                endpoint.outcomes.append((time.time(), True))
+                endpoint.consecutive_errors += 1
+                if endpoint.consecutive_errors >= MAX_ERRORS:
+                    cooldown = min(COOLDOWN * 2 ** (endpoint.consecutive_errors - MAX_ERRORS), MAX_COOLDOWN)
+                    endpoint.down_until = time.time() + cooldown
+            elif cached:
+                # A cache hit says nothing about the endpoint
+                counters["cached"] += 1
+            else:
+                endpoint.outcomes.append((time.time(), False))
+                endpoint.consecutive_errors = 0
+                endpoint.down_until = 0.0
+                endpoint.latency = seconds if endpoint.latency is None else \
+                    ALPHA * seconds + (1 - ALPHA) * endpoint.latency
+                self.latencies[(route, endpoint.name)].append(seconds)
+            # The text file is small; rewrite it at most once a second (claimed here, by one call)
+            due = time.monotonic() - self._written > 1.0
+            if due:
+                self._written = time.monotonic()
+        if due:
+            export(self.write_prometheus)
+
+    def stats(self):
+        """Per-route, per-endpoint counts and latency, and each endpoint's health."""
+        with self._lock:
+            routes = {}
+            for (route, name), counters in sorted(self.counters.items()):
+                latencies = list(self.latencies[(route, name)])
+                routes.setdefault(route, {})[name] = dict(
+                    {field: int(counters[field]) for field in ("calls", "errors", "failovers", "cached")},
+                    p50=round(percentile(latencies, 0.5), 3) if latencies else None,
+                    p95=round(percentile(latencies, 0.95), 3) if latencies else None,
+                )
+            now = time.time()
+            endpoints = {e.name: {"latency": round(e.latency, 3) if e.latency is not None else None,
+                                  "error_rate": round(e.error_rate, 3), "inflight": e.inflight,
+                                  "down_for": round(max(e.down_until - now, 0.0), 1)} for e in self.endpoints}
+        return {"routes": routes, "endpoints": endpoints}
+
+    def summary(self):
+        stats = self.stats()
+        if not stats["routes"]:
+            return "Routing: no calls yet"
+        parts = []
+        for route, endpoints in stats["routes"].items():
+            calls = sum(e["calls"] for e in endpoints.values())
+            errors = sum(e["errors"] for e in endpoints.values())
+            used = ", ".join(f"{name} {e['calls']}" + (f" p50 {e['p50']:.2f}s" if e["p50"] is not None else "")
+                             for name, e in endpoints.items())
+            parts.append(f"{route}: {calls} calls, {errors} errors ({used})")
+        return "Routing: " + "; ".join(parts)
+
+    def prometheus(self):
+        with self._lock:
+            counters = {key: dict(values) for key, values in self.counters.items()}
+            latencies = {key: list(values) for key, values in self.latencies.items()}
+        lines = []
+        for name, help_text in (("calls", "LLM calls made on the route"), ("errors", "Failed LLM calls"),
+                                ("failovers", "Failed calls retried on another endpoint"),
+                                ("cached", "Calls answered from the cache")):
+            metric = f"autogen_route_{name}_total"
+            lines += [f"# HELP {metric} {help_text}.", f"# TYPE {metric} counter"]
+            for (route, endpoint), values in sorted(counters.items()):
+                lines.append(f'{metric}{{route="{route}",endpoint="{endpoint}"}} {values.get(name, 0):g}')
+        metric = "autogen_route_latency_seconds"
+        lines += [f"# HELP {metric} LLM latency per call.", f"# TYPE {metric} summary"]
+        for (route, endpoint), values in sorted(latencies.items()):
+            if not values:
+                continue
+            labels = f'route="{route}",endpoint="{endpoint}"'
+            for q in QUANTILES:
+                lines.append(f'{metric}{{{labels},quantile="{q}"}} {percentile(values, q):.6f}')
+            lines.append(f"{metric}_sum{{{labels}}} {sum(values):.6f}")
+            lines.append(f"{metric}_count{{{labels}}} {len(values)}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        self._written = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        write_text(self.prom_path, self.prometheus())
+
+
+class _CacheProbe:
+    """The cache handed to create(), noting whether it answered the request."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.hit = False
+
+    def get(self, key, default=None):
+        value = self.inner.get(key, default)
+        self.hit = value is not default
+        return value
+
+    def set(self, key, value):
+        self.inner.set(key, value)
+
+    def close(self):
+        self.inner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RoutedClient:
+    """Stands in for an agent's OpenAIWrapper: each call goes to the route's healthiest endpoint."""
+
+    def __init__(self, router, route, base_config):
+        self.router = router
+        self.route = route
+        self.base_config = base_config
+        # One single-entry wrapper per endpoint; autogen's own failover is done here instead
+        self._wrappers = {}
+        self._lock = threading.Lock()
+
+    def wrapper(self, endpoint):
+        with self._lock:
+            wrapper = self._wrappers.get(endpoint)
+            if wrapper is None:
+                wrapper = self._wrappers[endpoint] = OpenAIWrapper(**dict(self.base_config, **endpoint.entry))
+            return wrapper
+
+    def create(self, **config):
+        endpoints = self.router.order(self.route)
+        for i, endpoint in enumerate(endpoints):
+            wrapper = self.wrapper(endpoint)
+            probe = _CacheProbe(config["cache"]) if config.get("cache") is not None else None
+            call = dict(config, cache=probe) if probe is not None else config
+            self.router.started(endpoint)
+            started = time.perf_counter()
+            try:
+                response = wrapper.create(**call)
+            except (APIError, TimeoutError) as e:
+                seconds = time.perf_counter() - started
+                if getattr(e, "status_code", None) in REQUEST_ERRORS or getattr(e, "code", None) == "content_filter":
+                    # Not the endpoint's fault
+                    self.router.released(endpoint)
+                    raise
+                last = i == len(endpoints) - 1
+                self.router.finished(self.route, endpoint, seconds, error=e, failover=not last)
+                if last:
+                    raise
+                continue
+            except BaseException:
+                self.router.released(endpoint)
+                raise
+            self.router.finished(self.route, endpoint, time.perf_counter() - started,
+                                 cached=probe is not None and probe.hit)
+            return response
+        raise RuntimeError("No endpoint to route to")
+
+    @staticmethod
+    def extract_text_or_completion_object(response):
+        return OpenAIWrapper.extract_text_or_completion_object(response)
+
+    def _summaries(self, attribute):
+        summary = None
+        for wrapper in list(self._wrappers.values()):
+            usage = getattr(wrapper, attribute)
+            if usage is None:
+                continue
+            summary = summary or {"total_cost": 0}
+            summary["total_cost"] += usage.get("total_cost", 0)
+            for model, data in usage.items():
+                if model == "total_cost":
+                    continue
+                if model not in summary:
+                    summary[model] = dict(data)
+                else:
+                    for field in ("cost", "prompt_tokens", "completion_tokens", "total_tokens"):
+                        summary[model][field] += data.get(field, 0)
+        return summary
+
+    @property
+    def total_usage_summary(self):
+        return self._summaries("total_usage_summary")
+
+    @property
+    def actual_usage_summary(self):
+        return self._summaries("actual_usage_summary")
+
+    def print_usage_summary(self, mode=("actual", "total")):
+        for wrapper in list(self._wrappers.values()):
+            wrapper.print_usage_summary(mode)
+
+    def clear_usage_summary(self):
+        for wrapper in list(self._wrappers.values()):
+            wrapper.clear_usage_summary()
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """The process-wide Router when MODEL_ROUTING is set, otherwise None.
+
+    MODEL_ROUTING=1 reads OAI_CONFIG_LIST (the environment variable or the
+    file, as autogen does); any other value is the path of a config list.
+    """
+    global _router
+    source = os.environ.get("MODEL_ROUTING")
+    if not source or source == "0":
+        return None
+    with _router_lock:
+        if _router is None:
+            _router = Router(load_config_list("OAI_CONFIG_LIST" if source == "1" else source))
+        return _router
+
+
+def load_config_list(env_or_file="OAI_CONFIG_LIST"):
+    return autogen.config_list_from_json(env_or_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Show the model routes over a config list, or their metrics")
+    parser.add_argument("--config", default="OAI_CONFIG_LIST", help="config list (environment variable or file)")
+    parser.add_argument("--metrics", action="store_true", help="print the per-route metrics file")
+    args = parser.parse_args()
+
+    if args.metrics:
+        path = os.path.join(DEFAULT_DIR, "routes.prom")
+        if not os.path.exists(path):
+            raise SystemExit(f"No route metrics at {path} yet")
+        with open(path) as f:
+            print(f.read(), end="")
+    else:
+        router = Router(load_config_list(args.config))
+        for role in list(ROLES) + ["(other roles)"]:
+            route = router.route_for(role)
+            print(f"{role}: {route} -> {', '.join(e.name for e in router.order(route))}")
@@ -0,0 +1,157 @@
+# Rule-based speaker selection for the group chats.
+#
+# With speaker_selection_method="auto" the GroupChatManager makes one LLM call
+# per round just to pick who talks next, although most of our flow is fixed
+# (see agent_workflow.txt): Planner -> Engineer -> Executor, back to the
+# Engineer when the execution failed, otherwise on to the Writer.
+# SpeakerStateMachine is passed as speaker_selection_method and picks the next
+# speaker from rules declared by each app; only when a rule does not decide
+# (an ambiguous state) does it hand the round back to the LLM ("auto").
+#
+#     selector = SpeakerStateMachine({
+#         "Admin": "Planner",
+#         "Planner": "Engineer",
+#         "Engineer": "Executor",
+#         "Executor": lambda turn: "Engineer" if turn.failed else "Writer",
+#         "Writer": None,  # ambiguous: let the LLM decide
+#     })
+#     groupchat = autogen.GroupChat(..., speaker_selection_method=selector)
+#
+# A rule is an agent name, END (finish the chat), None (ask the LLM) or a
+# callable(turn) returning one of those. Picks that the transition graph does
+# not allow are ignored and fall back to the LLM as well. through() builds the
+# rules for the apps where every agent reports back to the Admin.
+
+import re
+import threading
+
+# Returned by a rule to end the conversation
+END = "__end__"
+
+FAILURE_MARKERS = ("no price data found", "possibly delisted", "Failed to fetch:",
+                   "Traceback (most recent call last)")
+
+
+def execution_failed(content):
+    """Whether an Executor message reports a failed run or missing data."""
+    content = content or ""
+    exitcode = re.search(r"exitcode: (-?\d+)", content)
+    if exitcode and exitcode.group(1) != "0":
+        return True
+    return any(marker in content for marker in FAILURE_MARKERS)
+
+
+class Turn:
+    """What a rule sees: the last message and who spoke before it."""
+
+    def __init__(self, speaker, messages):
+        self.speaker = speaker
+        self.messages = messages
+        self.message = self.messages[-1] if self.messages else {}
+        self.content = self.message.get("content") or ""
+        self.previous = self.messages[-2].get("name") if len(self.messages) > 1 else None
+
+    @property
+    def failed(self):
+        return execution_failed(self.content)
+
+    def spoke(self, name):
+        """Whether `name` has spoken earlier in this conversation."""
+        return any(message.get("name") == name for message in self.messages[:-1])
+
+    def last_from(self, name):
+        """Content of the latest message from `name`, or None."""
+        for message in reversed(self.messages):
+            if message.get("name") == name:
+                return message.get("content") or ""
+        return None
+
+    def executed(self, name="Executor"):
+        """Whether `name` has run code and its latest run succeeded."""
+        content = self.last_from(name)
+        return content is not None and not execution_failed(content)
+
+    def before(self):
+        """The turn as it was one message earlier."""
+        return Turn(self.previous, self.messages[:-1])
+
+
+def through(hub, flow):
+    """Rules for a hub-and-spoke graph where every agent hands back to `hub`.
+
+    `flow` maps the agent that spoke before the hub (None at the start) to the
+    rule for what the hub hands over to next; callables get that agent's turn.
+    """
+    def hub_rule(turn):
+        rule = flow.get(turn.previous)
+        if callable(rule):
+            rule = rule(turn.before())
+        return rule
+
+    rules = {name: hub for name in flow if name is not None}
+    rules[hub] = hub_rule
+    return rules
+
+
+class SpeakerStateMachine:
+    """speaker_selection_method that follows declared rules, else asks the LLM."""
+
+    def __init__(self, rules, fallback="auto"):
+        self.rules = dict(rules)
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self.reset()
+
+    def copy(self):
+        """Same rules with fresh counters (one per conversation)."""
+        return SpeakerStateMachine(self.rules, self.fallback)
+
+    def reset(self):
+        self.rounds = 0
+        # Rounds the rules decided, and how many of those would have cost an LLM call
+        self.decided = 0
+        self.avoided = 0
+        self.fallbacks = 0
+
+    def candidates(self, last_speaker, groupchat):
+        # GroupChat fills this from the transition graph (or allow_repeat_speaker)
+        allowed = getattr(groupchat, "allowed_speaker_transitions_dict", None) or {}
+        return list(allowed.get(last_speaker, groupchat.agents))
+
+    def decide(self, last_speaker, groupchat):
+        rule = self.rules.get(last_speaker.name)
+        if callable(rule):
+            rule = rule(Turn(last_speaker.name, groupchat.messages))
+        return rule
+
+    def __call__(self, last_speaker, groupchat):
+        if len(groupchat.messages) <= 1:
+            # A new conversation (initiate_chat clears the history)
+            with self._lock:
+                self.reset()
+        candidates = self.candidates(last_speaker, groupchat)
+        choice = self.decide(last_speaker, groupchat)
+        with self._lock:
+            self.rounds += 1
+            if choice == END:
+                self.decided += 1
+                return None
+            agent = None
+            if choice is not None:
+                agent = next((a for a in candidates if a.name == choice), None)
+            if agent is None:
+                self.fallbacks += 1
+                return self.fallback
+            self.decided += 1
+            # With a single candidate autogen skips the LLM anyway
+            if len(candidates) > 1:
+                self.avoided += 1
+            return agent
+
+    def stats(self):
+        return {"rounds": self.rounds, "decided": self.decided,
+                "llm_calls_avoided": self.avoided, "llm_selections": self.fallbacks}
+
+    def summary(self):
+        return (f"Speaker selection: {self.decided}/{self.rounds} rounds by rule, "
+                f"{self.avoided} LLM calls avoided, {self.fallbacks} left to the LLM")
@@ -0,0 +1,217 @@
+# Token-level streaming of agent replies into the chat UI.
+#
+# With "stream": True in an agent's llm_config, autogen's OpenAI client prints
+# every content chunk to the current IOStream as print(chunk, end="", flush=True).
+# TokenStream is an IOStream that turns those prints into on_token() calls for
+# the agent currently replying and finalizes the message on the next regular
+# print (autogen prints "<speaker> (to <recipient>):" when the reply is sent).
+#
+# The agent currently replying is announced by begin_reply(), a reply function
+# registered on every agent; it runs first when an agent starts generating.
+# The live output of code an Executor runs comes in through output() and is
+# streamed the same way (without counting towards time to first token).
+#
+# Every chunk is also published as a TOKEN event (tool/events.py). Front ends
+# that render tokens (the Panel apps, through PanelSink) subscribe to those
+# instead of being called from the agent's thread.
+#
+# Requires an autogen version whose a_generate_oai_reply carries the IOStream
+# into its worker thread (0.2.27+), so async chats stream as well.
+
+import time
+from contextlib import contextmanager
+
+from autogen import Agent
+from autogen.io import IOStream
+from autogen.io.console import IOConsole
+
+from tool.events import MESSAGE, SPEAKER, TOKEN, current_scope, get_bus, publish
+
+
+class TokenStream(IOStream):
+    """IOStream that routes streamed tokens to on_start/on_token/on_end hooks."""
+
+    def __init__(self, echo=True):
+        self.console = IOConsole() if echo else None
+        self.name = None
+        self.replying = None  # last agent announced by begin_reply, kept across finish()
+        self.timed = True
+        self.text = ""
+        self.started = None
+        self.first_token = None
+        self.scope = None  # the run (or scope key) of the reply being streamed
+        self.ttft = {}  # agent name -> list of time-to-first-token (seconds)
+
+    # IOStream protocol
+
+    def print(self, *objects, sep=" ", end="\n", flush=False):
+        if end == "" and self.name is not None:
+            self.token(sep.join(str(o) for o in objects))
+            return
+        self.finish()
+        if self.console is not None:
+            self.console.print(*objects, sep=sep, end=end, flush=flush)
+
+    def input(self, prompt="", *, password=False):
+        if self.console is None:
+            raise RuntimeError("TokenStream without a console cannot read input")
+        return self.console.input(prompt, password=password)
+
+    # Streaming state
+
+    def begin(self, name, timed=True):
+        self.finish()
+        self.name = self.replying = name
+        self.timed = timed
+        self.text = ""
+        self.started = time.perf_counter()
+        self.first_token = None
+        # Tokens arrive on autogen's worker thread, which does not carry the run's context
+        self.scope = current_scope()
+
+    def token(self, chunk):
+        if not chunk:
+            return
+        ttft = None
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+            if self.timed:
+                ttft = self.first_token - self.started
+                self.ttft.setdefault(self.name, []).append(ttft)
+            self.on_start(self.name, ttft)
+        self.text += chunk
+        self.on_token(self.name, chunk, self.text)
+        publish(TOKEN, self.name, chunk, run=self.scope, text=self.text, ttft=ttft)
+
+    def output(self, chunk):
+        """Live output of code run by the replying agent (see tool/executors.py)."""
+        if self.name is None and self.replying is not None:
+            # autogen printed the ">>>>>>>> EXECUTING" line in between
+            self.begin(self.replying, timed=False)
+        self.token(chunk)
+
+    def finish(self):
+        if self.name is not None and self.first_token is not None:
+            self.on_end(self.name, self.text)
+        self.name = None
+        self.first_token = None
+
+    def ttft_summary(self):
+        """Mean time-to-first-token per agent, in seconds."""
+        return {name: sum(values) / len(values) for name, values in self.ttft.items()}
+
+    # Hooks for front ends
+
+    def on_start(self, name, ttft):
+        if ttft is not None and self.console is not None:
+            print(f"[stream] {name} time to first token: {ttft:.2f}s")
+
+    def on_token(self, name, chunk, text):
+        pass
+
+    def on_end(self, name, text):
+        pass
+
+
+def begin_reply(recipient, messages, sender, config):
+    """Reply function: tell the active TokenStream which agent is replying."""
+    iostream = IOStream.get_default()
+    if isinstance(iostream, TokenStream):
+        iostream.begin(recipient.name)
+    return False, None
+
+
+def register_streaming(agents):
+    for agent in agents:
+        agent.register_reply([Agent, None], reply_func=begin_reply, config=None)
+
+
+class RunTokenStream(TokenStream):
+    """Streams into a ChatRun: run.partial holds the message being generated."""
+
+    def __init__(self, run, echo=True):
+        super().__init__(echo=echo)
+        self.run = run
+        run.ttft = self.ttft
+
+    def on_token(self, name, chunk, text):
+        self.run.partial = {"name": name, "content": text}
+
+    def on_end(self, name, text):
+        self.run.partial = None
+
+
+@contextmanager
+def token_stream(run):
+    """Context for start_run(..., context=token_stream): stream into the run."""
+    with IOStream.set_default(RunTokenStream(run)):
+        yield
+
+
+@contextmanager
+def quiet_token_stream(run):
+    """token_stream without console output, for runs nobody watches (batches, benchmarks)."""
+    with IOStream.set_default(RunTokenStream(run, echo=False)):
+        yield
+
+
+class PanelSink:
+    """Shows a chat's events in a pn.chat.ChatInterface, off the agents' path.
+
+    Subscribe it with subscribe() and run the chat under scope(sink) with a
+    TokenStream; its agents publish through tool/events.py (track()). Streamed
+    replies are updated in place as tokens arrive and replaced by the final
+    message, so nothing is shown twice.
+    """
+
+    def __init__(self, chat_interface, avatars, ttft_pane=None, metrics=None):
+        self.chat_interface = chat_interface
+        self.avatars = avatars
+        self.ttft_pane = ttft_pane
+        self.metrics = metrics
+        self.streaming = {}  # agent name -> the chat message its tokens go to
+        self.ttft = {}  # agent name -> list of time-to-first-token (seconds)
+
+    def subscribe(self):
+        """Subscribe to the events published under scope(self)."""
+        return get_bus().subscribe(self, kinds=(MESSAGE, SPEAKER, TOKEN), run=self, threaded=True, name="panel")
+
+    def __call__(self, event):
+        if event.kind == SPEAKER:
+            # A new reply: its tokens start a new chat message
+            self.streaming.pop(event.name, None)
+        elif event.kind == TOKEN:
+            self.on_token(event.name, event.data["text"], event.data.get("ttft"))
+        elif event.kind == MESSAGE:
+            self.on_message(event.name, event.content)
+
+    def on_token(self, name, text, ttft):
+        if ttft is not None:
+            self.ttft.setdefault(name, []).append(ttft)
+            if self.ttft_pane is not None:
+                self.ttft_pane.object = "Time to first token: " + ", ".join(
+                    f"{agent} {sum(values) / len(values):.2f}s" for agent, values in self.ttft.items())
+        message = self.streaming.get(name)
+        if message is None:
+            self.streaming[name] = self.chat_interface.stream(text, user=name, avatar=self.avatars.get(name))
+        else:
+            # Tokens may have been dropped under load; the text so far is always complete
+            message.object = text
+
+    def on_message(self, name, content):
+        started = time.perf_counter()
+        message = self.streaming.pop(name, None)
+        if message is not None:
+            # Shown token by token already; the final text may differ (an Executor's live output)
+            if content is not None and message.object != content:
+                message.object = content
+            return
+        self.chat_interface.send(content, user=name, avatar=self.avatars.get(name), respond=False)
+        if self.metrics is not None:
+            self.metrics.record_render(name, time.perf_counter() - started)
+
+    async def prompt(self, name, prompt):
+        """Show an agent's request for human input (a HumanInput's on_prompt, see tool/human.py)."""
+        # After the messages that led to it
+        await get_bus().drain(self)
+        self.chat_interface.send(f"{name}: {prompt}", user="System", respond=False)
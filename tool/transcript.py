@@ -0,0 +1,168 @@
+# Incremental, bounded chat transcript for the Streamlit apps.
+#
+# The apps poll by rerunning the whole script, and every rerun used to redraw
+# every message in full, so a rerun at round 50 cost fifty times one at round
+# 1. Transcript keeps what it has already parsed in the run's state and draws
+# a bounded window on each rerun:
+#
+# - each message is parsed (split into text and code blocks) once, when it
+#   first arrives; later reruns only parse what is new;
+# - the last `recent` messages are drawn; older ones are behind a toggle and
+#   shown a page of `page_size` at a time;
+# - code blocks longer than `fold_lines` lines and text longer than
+#   `fold_chars` show a preview, and the rest is only sent to the browser
+#   when its toggle is switched on.
+#
+# So the work per rerun is bounded by recent + page_size messages of at most
+# a fold each, however long the chat gets:
+#
+#     transcript = Transcript.of(run)
+#     transcript.render(message_container, on_rendered=chat.metrics.record_render)
+#
+#     python -m tool.transcript   # rerun cost at round 10 vs 50, full vs windowed
+
+import math
+import re
+import time
+
+FENCE = re.compile(r"```([\w+-]*)[^\n]*\n(.*?)(?:```|\Z)", re.S)
+
+
+def parse(content):
+    """Split `content` into ("text", text) and ("code", language, code) blocks."""
+    content = content if isinstance(content, str) else str(content or "")
+    blocks, start = [], 0
+    for match in FENCE.finditer(content):
+        if match.start() > start:
+            blocks.append(("text", content[start:match.start()]))
+        blocks.append(("code", match.group(1) or None, match.group(2).rstrip("\n")))
+        start = match.end()
+    if start < len(content):
+        blocks.append(("text", content[start:]))
+    return blocks
+
+
+class Transcript:
+    """Parsed messages of one run and the window of them to draw."""
+
+    def __init__(self, key="transcript", recent=12, page_size=20, fold_chars=1500, fold_lines=15):
+        self.key = key
+        self.recent = recent
+        self.page_size = page_size
+        self.fold_chars = fold_chars
+        self.fold_lines = fold_lines
+        self.messages = []  # (message, blocks)
+        self.rendered = 0  # messages drawn at least once (for the render metrics)
+
+    @classmethod
+    def of(cls, run, **kwargs):
+        """The run's Transcript, kept in run.state across reruns."""
+        if "transcript" not in run.state:
+            run.state["transcript"] = cls(**kwargs)
+        transcript = run.state["transcript"]
+        transcript.update(run.messages_since(len(transcript.messages)))
+        return transcript
+
+    def update(self, new_messages):
+        for message in new_messages:
+            self.messages.append((message, parse(message.get("content"))))
+
+    def window(self, page=None):
+        """Indices to draw: the recent messages, or page `page` (1-based) of the older ones."""
+        older = max(len(self.messages) - self.recent, 0)
+        if page is None:
+            return range(older, len(self.messages))
+        start = (page - 1) * self.page_size
+        return range(min(start, older), min(start + self.page_size, older))
+
+    def pages(self):
+        return math.ceil(max(len(self.messages) - self.recent, 0) / self.page_size)
+
+    def render(self, container, on_rendered=None):
+        """Draw the window; `container(message)` returns (context manager, heading), or None to skip it."""
+        import streamlit as st
+
+        pages = self.pages()
+        if pages:
+            older = len(self.messages) - self.recent
+            if st.toggle(f"Show {older} earlier messages", key=f"{self.key}-older"):
+                page = pages
+                if pages > 1:
+                    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=pages,
+                                           key=f"{self.key}-page")
+                self._draw(st, self.window(page), container)
+                st.divider()
+        self._draw(st, self.window(), container, on_rendered)
+        self.rendered = len(self.messages)
+
+    def _draw(self, st, indices, container, on_rendered=None):
+        for i in indices:
+            started = time.perf_counter()
+            message, blocks = self.messages[i]
+            placement = container(message)
+            if placement is None:
+                continue
+            box, heading = placement
+            with box:
+                if heading:
+                    st.markdown(heading)
+                for j, block in enumerate(blocks):
+                    self._block(st, block, f"{self.key}-{i}-{j}")
+            if on_rendered is not None and i >= self.rendered:
+                on_rendered(message["name"], time.perf_counter() - started)
+
+    def _block(self, st, block, key):
+        if block[0] == "code":
+            _, language, code = block
+            lines = code.count("\n") + 1
+            if lines <= self.fold_lines:
+                st.code(code, language=language)
+                return
+            st.code("\n".join(code.split("\n")[:self.fold_lines // 2]) + "\n...", language=language)
+            if st.toggle(f"Show all {lines} lines", key=key):
+                st.code(code, language=language)
+            return
+        text = block[1]
+        if not text.strip():
+            return
+        if len(text) <= self.fold_chars:
+            st.markdown(text)
+            return
+        # Cut at a line break so the preview does not end in broken markdown
+        cut = text.rfind("\n", 0, self.fold_chars)
+        st.markdown(text[:cut if cut > 0 else self.fold_chars] + " ...")
+        if st.toggle(f"Show all ({len(text):,} characters)", key=key):
+            st.markdown(text)
+
+
+if __name__ == '__main__':
+    # What one rerun sends to the browser, drawing everything vs the window
+    def chat(rounds):
+        code = "\n".join(f"prices_{i} = fetch('NVDA', day={i})" for i in range(60))
+        text = "\n".join(f"- Finding {i}: revenue grew {i}% quarter over quarter." for i in range(80))
+        speakers = [("Planner", "Plan: fetch prices, chart them, write the report."),
+                    ("Engineer", f"```python\n{code}\n```"),
+                    ("Executor", "exitcode: 0 (execution succeeded)\nCode output: " + "1.0 " * 3000),
+                    ("Writer", f"# Report\n{text}")]
+        return [{"name": name, "content": content} for name, content in
+                (speakers[i % len(speakers)] for i in range(rounds))]
+
+    for rounds in (10, 50):
+        messages = chat(rounds)
+        full = sum(len(m["content"]) for m in messages)
+        transcript = Transcript()
+        transcript.update(messages[:-1])
+        started = time.perf_counter()
+        transcript.update(messages[-1:])  # the new message is the only one parsed on this rerun
+        parse_ms = (time.perf_counter() - started) * 1000
+        sent = 0
+        for i in transcript.window():
+            for block in transcript.messages[i][1]:
+                if block[0] == "code":
+                    lines = block[2].split("\n")
+                    sent += len("\n".join(lines if len(lines) <= transcript.fold_lines
+                                          else lines[:transcript.fold_lines // 2]))
+                else:
+                    sent += min(len(block[1]), transcript.fold_chars)
+        print(f"round {rounds}: full redraw {full:,} chars, windowed {sent:,} chars "
+              f"({len(transcript.window())} messages), new message parsed in {parse_ms:.2f} ms")
@@ -1,9 +1,12 @@
 # Add your utilities or helper functions to this file.
 
 import os
+from functools import lru_cache
 from dotenv import load_dotenv, find_dotenv
 
 # these expect to find a .env file at the directory above the lesson.                                                                                                                     # the format for that file is (without the comment)                                                                                                                                       #API_KEYNAME=AStringThatIsTheLongAPIKeyFromSomeService                                                                                                                                     
+# find_dotenv() walks the filesystem, so only do it once per process
+@lru_cache(maxsize=None)
 def load_env():
     _ = load_dotenv(find_dotenv())
 
@@ -12,6 +15,14 @@ def get_openai_api_key():
     openai_api_key = os.getenv("OPENAI_API_KEY")
     return openai_api_key
 
+# Code executors run scripts from their work dir in a subprocess; make `tool`
+# importable there so functions handed to the executor can use the helpers
+def add_repo_to_pythonpath():
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = os.environ.get("PYTHONPATH", "").split(os.pathsep)
+    if repo_root not in paths:
+        os.environ["PYTHONPATH"] = os.pathsep.join([repo_root] + [p for p in paths if p])
+
 def get_agentops_api_key():
     load_env()
     agentops_api_key = os.getenv("AGENTOPS_API_KEY")
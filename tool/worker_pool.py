@@ -0,0 +1,479 @@
+# Warm, persistent Python workers for the Executor.
+#
+# LocalCommandLineCodeExecutor starts a fresh interpreter for every code block,
+# and each one re-imports pandas, yfinance and matplotlib before doing any
+# work. WorkerPool keeps a few worker processes that have imported those
+# modules already. Each conversation is pinned to one worker and gets its own
+# globals there, so variables from the previous block stay defined, as in a
+# notebook kernel. The rest of the process is put back after every block:
+# modules imported from the work dir (the executor's functions.py) are
+# evicted, sys.path is restored, and os.environ goes back to the worker's own
+# (a conversation's changes to it are re-applied for its next block only).
+#
+# A worker is recycled (replaced by a freshly started spare) after `max_runs`
+# blocks, when its resident memory passes `max_rss_mb`, or when a block runs
+# into the timeout. The conversations pinned to it lose their variables then,
+# and the next output says so.
+#
+# The apps never say when a session is over, so a conversation that has not
+# run a block for `idle_ttl` seconds is released: its variables are dropped
+# and it is unpinned. If it comes back, it starts over on the least busy
+# worker, with a note like after a recycle.
+#
+# Output is captured with tool/output.py: only a bounded head and tail come
+# back in the result (the rest is spilled to a file in the work dir), and with
+# `on_output` the output is passed on while the code is still running. What
+# child processes and C extensions write to fd 1 and 2 during a block is
+# caught in a temporary file and added to the output after the block's own.
+#
+# Benchmark against a fresh interpreter per block:
+#
+#     python -m tool.worker_pool --blocks 20
+
+import argparse
+import builtins
+import ctypes
+import io
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from multiprocessing.connection import Connection
+
+from tool.output import DEFAULT_MAX_CHARS, BoundedOutput, spill_path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PRELOAD = ("numpy", "pandas", "matplotlib", "matplotlib.pyplot", "yfinance")
+RESTARTED_NOTE = ("Note: the Python worker was restarted; variables from earlier code blocks "
+                  "are no longer defined.\n")
+MAX_RELEASED = 10000
+RELEASED_NOTE = ("Note: this conversation was idle and its variables were released; variables from "
+                 "earlier code blocks are no longer defined.\n")
+
+
+def rss_mb():
+    """Current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        # Peak rather than current RSS where /proc is not available (KB on Linux, bytes on macOS)
+        scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def _flush_c_stdio():
+    try:
+        ctypes.CDLL(None).fflush(None)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+@contextmanager
+def _fd_output(output):
+    """Send what is written to fd 1 and 2 meanwhile (child processes, C extensions) to `output`."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with tempfile.TemporaryFile() as capture:
+        saved = os.dup(1), os.dup(2)
+        os.dup2(capture.fileno(), 1)
+        os.dup2(capture.fileno(), 2)
+        try:
+            yield
+        finally:
+            _flush_c_stdio()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            for fd in saved:
+                os.close(fd)
+            capture.seek(0)
+            reader = io.TextIOWrapper(capture, encoding="utf-8", errors="replace")
+            for chunk in iter(lambda: reader.read(65536), ""):
+                output.write(chunk)
+            reader.detach()
+
+
+def _run(namespace, code, filename, output):
+    with _fd_output(output), redirect_stdout(output), redirect_stderr(output):
+        try:
+            exec(compile(code, filename, "exec"), namespace)
+            exit_code = 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            if e.code is not None and not isinstance(e.code, int):
+                print(e.code, file=sys.stderr)
+        except BaseException:
+            # Drop this frame from the traceback, like a script run by the interpreter
+            kind, value, tb = sys.exc_info()
+            traceback.print_exception(kind, value, tb.tb_next)
+            exit_code = 1
+    if "matplotlib.pyplot" in sys.modules:
+        # Figures are saved by the code itself; do not let them pile up
+        sys.modules["matplotlib.pyplot"].close("all")
+    output.close()
+    return exit_code
+
+
+def _set_environ(environ):
+    for name in set(os.environ) - set(environ):
+        del os.environ[name]
+    for name, value in environ.items():
+        if os.environ.get(name) != value:
+            os.environ[name] = value
+
+
+def _evict_modules(work_dir, before):
+    """Drop the modules imported from `work_dir` since `before`, so the next conversation imports its own."""
+    prefix = os.path.join(work_dir, "")
+    for name in set(sys.modules) - before:
+        path = getattr(sys.modules[name], "__file__", None)
+        if path and os.path.abspath(path).startswith(prefix):
+            del sys.modules[name]
+    sys.path_importer_cache.pop(work_dir, None)
+
+
+def _worker_main(preload):
+    # Requests come in on stdin and results go out on the original stdout;
+    # fd 1 is pointed at stderr so stray output (C extensions, child
+    # processes) cannot corrupt the protocol.
+    reader = Connection(os.dup(0), writable=False)
+    conn = Connection(os.dup(1), readable=False)
+    os.dup2(2, 1)
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    for module in preload:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+    namespaces = {}
+    environs = {}  # conversation -> its os.environ
+    base_environ = dict(os.environ)
+    base_path = list(sys.path)
+    while True:
+        try:
+            request = reader.recv()
+        except EOFError:
+            return
+        if request[0] == "drop":
+            namespaces.pop(request[1], None)
+            environs.pop(request[1], None)
+            continue
+        _, conversation, code, filename, work_dir, max_chars, stream = request
+        started = time.perf_counter()
+        on_chunk = (lambda chunk: conn.send(("output", chunk))) if stream else None
+        output = BoundedOutput(spill_path(work_dir, filename), max_chars=max_chars, on_chunk=on_chunk,
+                               relative_to=work_dir)
+        os.chdir(work_dir)
+        # So `from functions import ...` finds the executor's functions module
+        sys.path.insert(0, work_dir)
+        _set_environ(environs.get(conversation, base_environ))
+        namespace = namespaces.setdefault(conversation, {"__name__": "__main__", "__builtins__": builtins})
+        namespace["__file__"] = filename
+        modules = set(sys.modules)
+        try:
+            exit_code = _run(namespace, code, filename, output)
+        finally:
+            if os.environ != base_environ:
+                environs[conversation] = dict(os.environ)
+            else:
+                environs.pop(conversation, None)
+            _set_environ(base_environ)
+            sys.path[:] = base_path
+            _evict_modules(work_dir, modules)
+        conn.send(("done", exit_code, output.getvalue(), output.stats(), rss_mb(), time.perf_counter() - started))
+
+
+class Worker:
+    """One worker process (python -m tool.worker_pool --worker) and the pipes to it."""
+
+    _ids = itertools.count()
+
+    def __init__(self, preload):
+        self.id = next(self._ids)
+        env = dict(os.environ)
+        # The worker imports this module, so the repo root must be importable
+        env["PYTHONPATH"] = os.pathsep.join(p for p in (ROOT, env.get("PYTHONPATH")) if p)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "tool.worker_pool", "--worker", ",".join(preload)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, cwd=ROOT,
+        )
+        self.sender = Connection(os.dup(self.process.stdin.fileno()), readable=False)
+        self.conn = Connection(os.dup(self.process.stdout.fileno()), writable=False)
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.runs = 0
+        self.rss_mb = 0.0
+        self.lock = threading.Lock()
+        self.replaced_by = None
+
+    def send(self, request):
+        self.sender.send(request)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def stop(self):
+        for conn in (self.sender, self.conn):
+            conn.close()
+        if self.alive():
+            self.process.kill()
+        self.process.wait(5)
+
+
+class WorkerPool:
+    """Pre-started Python workers that conversations are pinned to."""
+
+    def __init__(self, size=2, preload=DEFAULT_PRELOAD, max_runs=100, max_rss_mb=1024, idle_ttl=1800):
+        self.size = size
+        self.preload = tuple(preload)
+        self.max_runs = max_runs
+        self.max_rss_mb = max_rss_mb
+        self.idle_ttl = idle_ttl
+        self.recycled = 0
+        self.released = 0
+        self._lock = threading.Lock()
+        self._workers = [Worker(self.preload) for _ in range(size)]
+        self._spare = None
+        self._spare_ready = threading.Event()
+        self._replace_lock = threading.Lock()
+        self._assigned = {}  # conversation -> worker
+        self._restarted = set()  # conversations whose worker was replaced
+        self._last_used = {}  # conversation -> time.monotonic() of its last block
+        self._released = OrderedDict()  # conversations released while idle (the latest MAX_RELEASED)
+        self._closed = threading.Event()
+        self._prepare_spare()
+        if idle_ttl:
+            threading.Thread(target=self._release_loop, name="code-worker-release", daemon=True).start()
+
+    def _prepare_spare(self):
+        self._spare_ready.clear()
+
+        def start():
+            self._spare = Worker(self.preload)
+            self._spare_ready.set()
+
+        threading.Thread(target=start, name="code-worker-spare", daemon=True).start()
+
+    def _replace(self, worker):
+        """Swap `worker` for the warm spare; its conversations start over."""
+        with self._replace_lock:
+            if worker.replaced_by is not None:
+                # Another thread got here first
+                return worker.replaced_by
+            self._spare_ready.wait()
+            with self._lock:
+                index = self._workers.index(worker)
+                replacement = worker.replaced_by = self._workers[index] = self._spare
+                self._spare = None
+                for conversation, assigned in self._assigned.items():
+                    if assigned is worker:
+                        self._assigned[conversation] = replacement
+                        self._restarted.add(conversation)
+                self.recycled += 1
+            self._prepare_spare()
+        # Let a block that is still running on it finish first
+        with worker.lock:
+            worker.stop()
+        return replacement
+
+    def _worker_for(self, conversation):
+        with self._lock:
+            worker = self._assigned.get(conversation)
+            if worker is None:
+                # Pin new conversations to the worker with the fewest of them
+                load = {w.id: 0 for w in self._workers}
+                for assigned in self._assigned.values():
+                    load[assigned.id] = load.get(assigned.id, 0) + 1
+                worker = min(self._workers, key=lambda w: load[w.id])
+                self._assigned[conversation] = worker
+            self._last_used[conversation] = time.monotonic()
+            return worker
+
+    def run(self, conversation, code, filename, work_dir, timeout=60, on_output=None,
+            max_chars=DEFAULT_MAX_CHARS):
+        """Run Python `code` in the conversation's namespace.
+
+        Returns (exit_code, output, seconds, output_stats). Exit code 124 means
+        timeout. `on_output(chunk)` is called with the output as it comes in.
+        """
+        started = time.perf_counter()
+        worker = self._worker_for(conversation)
+        while True:
+            worker.lock.acquire()
+            if worker.replaced_by is not None:
+                # Recycled by another thread while we waited for it
+                worker.lock.release()
+                worker = worker.replaced_by
+            elif not worker.alive() or worker.runs >= self.max_runs or worker.rss_mb > self.max_rss_mb:
+                worker.lock.release()
+                worker = self._replace(worker)
+            else:
+                break
+        try:
+            note = ""
+            with self._lock:
+                if self._released.pop(conversation, None):
+                    note = RELEASED_NOTE
+                elif conversation in self._restarted:
+                    self._restarted.discard(conversation)
+                    note = RESTARTED_NOTE
+            stats = {}
+            try:
+                worker.send(("run", conversation, code, filename, os.path.abspath(work_dir), max_chars,
+                             on_output is not None))
+                deadline = time.monotonic() + timeout
+                while True:
+                    if not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                        raise TimeoutError
+                    reply = worker.conn.recv()
+                    if reply[0] == "output":
+                        try:
+                            on_output(reply[1])
+                        except Exception:
+                            # A broken front end must not leave the reply half read
+                            traceback.print_exc()
+                        continue
+                    _, exit_code, output, stats, worker.rss_mb, _ = reply
+                    break
+            except TimeoutError:
+                exit_code, output = 124, "Timeout"
+            except (EOFError, OSError):
+                exit_code, output = 1, "The Python worker exited unexpectedly."
+            worker.runs += 1
+        finally:
+            with self._lock:
+                # Idle time counts from the end of the block
+                self._last_used[conversation] = time.monotonic()
+            worker.lock.release()
+        if exit_code == 124 or not worker.alive():
+            self._replace(worker)
+        return exit_code, note + output, time.perf_counter() - started, stats
+
+    def drop(self, conversation):
+        """Forget a conversation's variables."""
+        with self._lock:
+            worker = self._assigned.pop(conversation, None)
+            self._restarted.discard(conversation)
+            self._released.pop(conversation, None)
+            self._last_used.pop(conversation, None)
+        self._send_drop(worker, conversation)
+
+    def _send_drop(self, worker, conversation):
+        if worker is not None and worker.alive():
+            with worker.lock:
+                if worker.replaced_by is None:
+                    worker.send(("drop", conversation))
+
+    def release_idle(self, idle_ttl=None):
+        """Drop the conversations that have not run a block for `idle_ttl` seconds; returns how many."""
+        idle_ttl = self.idle_ttl if idle_ttl is None else idle_ttl
+        now = time.monotonic()
+        with self._lock:
+            idle = [conversation for conversation, used in self._last_used.items() if now - used > idle_ttl]
+            released = []
+            for conversation in idle:
+                del self._last_used[conversation]
+                self._restarted.discard(conversation)
+                self._released[conversation] = True
+                if len(self._released) > MAX_RELEASED:
+                    self._released.popitem(last=False)
+                released.append((self._assigned.pop(conversation, None), conversation))
+            self.released += len(released)
+        for worker, conversation in released:
+            self._send_drop(worker, conversation)
+        return len(released)
+
+    def _release_loop(self):
+        interval = max(1.0, min(60.0, self.idle_ttl / 10))
+        while not self._closed.wait(interval):
+            try:
+                self.release_idle()
+            except Exception:
+                traceback.print_exc()
+
+    def stats(self):
+        with self._lock:
+            workers = [{"id": w.id, "runs": w.runs, "rss_mb": round(w.rss_mb, 1), "alive": w.alive()}
+                       for w in self._workers]
+            return {"workers": workers, "conversations": len(self._assigned), "recycled": self.recycled,
+                    "released": self.released}
+
+    def shutdown(self):
+        self._closed.set()
+        self._spare_ready.wait(30)
+        with self._lock:
+            workers = list(self._workers) + ([self._spare] if self._spare else [])
+            self._workers = []
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(**kwargs):
+    """Process-wide WorkerPool (started on first use, idle for CODE_IDLE_TTL seconds).
+
+    It has CODE_WORKERS workers, by default one per chat the process runs at once
+    (MAX_RUNNING_CHATS, tool/loop.py), so admitted chats do not queue for a worker.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if "size" not in kwargs:
+                from tool.loop import get_admission
+
+                kwargs["size"] = int(os.environ.get("CODE_WORKERS") or get_admission().max_running)
+            kwargs.setdefault("idle_ttl", float(os.environ.get("CODE_IDLE_TTL", 1800)))
+            _pool = WorkerPool(**kwargs)
+        return _pool
+
+
+if __name__ == '__main__':
+    import statistics
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Benchmark warm workers against a fresh interpreter per block")
+    parser.add_argument("--blocks", type=int, default=20)
+    parser.add_argument("--worker", metavar="PRELOAD", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker is not None:
+        _worker_main([module for module in args.worker.split(",") if module])
+        sys.exit(0)
+
+    code = ("import pandas as pd\nimport numpy as np\n"
+            "frame = pd.DataFrame(np.random.rand(100, 3), columns=list('abc'))\n"
+            "print(frame.describe().loc['mean'].round(2).to_dict())\n")
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, "block.py")
+        with open(path, "w") as f:
+            f.write(code)
+        fresh = []
+        for _ in range(args.blocks):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, path], cwd=work_dir, capture_output=True, check=True)
+            fresh.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        pool = WorkerPool(size=1, preload=("numpy", "pandas"))
+        warm = []
+        for i in range(args.blocks):
+            exit_code, output, seconds, _ = pool.run("bench", code, path, work_dir)
+            assert exit_code == 0, output
+            warm.append(seconds)
+        # Variables persist between blocks of the same conversation
+        print(pool.run("bench", "print(frame.shape)", path, work_dir)[1].strip())
+        pool.shutdown()
+
+    print(f"fresh interpreter: median {statistics.median(fresh) * 1000:7.1f} ms per block")
+    print(f"warm worker:       median {statistics.median(warm) * 1000:7.1f} ms per block "
+          f"(first block {warm[0] * 1000:.1f} ms, includes worker start)")